@@ -0,0 +1,323 @@
+import datetime
+import heapq
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# id - номер записи в ссылках /archive/clips/<id>: не меняется при обновлении файла
+# и не переиспользуется после удаления. mtime - конец записи, start - её начало
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    camera TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    start REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+CREATE INDEX IF NOT EXISTS files_camera_mtime ON files (camera, mtime);
+"""
+UPSERT = """
+INSERT INTO files (path, camera, size, mtime, start) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, start = excluded.start
+"""
+
+# Время начала в имени файла записи: m_2024-01-31_12:00:00.avi, s_2024-01-31_12:00:00.250_1.mp4
+FILENAME_TIME = re.compile(r'_(\d{4}-\d{2}-\d{2}_\d{2}:\d{2}:\d{2})(\.\d{3})?')
+
+
+def clip_start(path: str, mtime: float) -> float:
+    """ Начало записи по времени в имени файла; если его там нет - mtime """
+    match = FILENAME_TIME.search(os.path.basename(path))
+    if match is None:
+        return mtime
+    try:
+        start = datetime.datetime.strptime(match.group(1), '%Y-%m-%d_%H:%M:%S').timestamp()
+    except ValueError:
+        return mtime
+    if match.group(2):
+        start += float(match.group(2))
+    return min(start, mtime)
+
+
+class ArchiveIndex:
+    """
+    Индекс файлов архива.
+
+    Список файлов хранится в SQLite (переживает перезапуск), а в памяти -
+    словарь путь -> (размер, mtime), размеры по камерам и min-heap по mtime
+    для каждой камеры. Размер архива и камеры известен за O(1), удаление
+    k самых старых файлов - O(k log n). Записи в куче удаляются лениво:
+    при извлечении сверяются со словарём.
+    """
+
+    def __init__(self, root: Path, db_path: Path):
+        self.root = Path(root)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._migrate()
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+        self.files: Dict[str, Tuple[int, float]] = {}
+        self.heaps: Dict[str, List[Tuple[float, str]]] = defaultdict(list)
+        self.camera_sizes: Dict[str, int] = defaultdict(int)
+        self.camera_files: Dict[str, int] = defaultdict(int)
+        self.total_size = 0
+
+    def _migrate(self):
+        """ Переход со схемы, где путь был первичным ключом: номера записей (rowid) сохраняются """
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(files)')]
+        if not columns or 'id' in columns:
+            return
+        logger.info('Обновление схемы индекса архива')
+        rows = self.conn.execute('SELECT rowid, path, camera, size, mtime FROM files').fetchall()
+        self.conn.execute('BEGIN')
+        self.conn.execute('DROP TABLE files')
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                self.conn.execute(statement)
+        self.conn.executemany(
+            'INSERT INTO files (id, path, camera, size, mtime, start) VALUES (?, ?, ?, ?, ?, ?)',
+            [(rowid, path, camera, size, mtime, clip_start(path, mtime)) for rowid, path, camera, size, mtime in rows],
+        )
+        self.conn.commit()
+
+    def relative(self, path) -> str:
+        return str(Path(path).resolve().relative_to(self.root.resolve()))
+
+    @staticmethod
+    def camera_of(relative_path: str) -> str:
+        """ Первый уровень архива - ключ камеры """
+        return relative_path.split(os.sep, 1)[0]
+
+    def load(self):
+        """ Загрузка индекса при старте; при пустой базе - однократный обход архива """
+        rows = self.conn.execute('SELECT path, size, mtime FROM files').fetchall()
+        if not rows:
+            logger.info(f'Индекс архива пуст, строим по {self.root}')
+            self.reconcile()
+            return
+        for path, size, mtime in rows:
+            self._remember(path, size, mtime)
+        logger.info(f'Индекс архива загружен: {len(self.files)} файлов, {self.total_size / 1024 ** 3:.2f} GB')
+
+    def _remember(self, path: str, size: int, mtime: float):
+        camera = self.camera_of(path)
+        self._forget(path)
+        self.files[path] = (size, mtime)
+        self.total_size += size
+        self.camera_sizes[camera] += size
+        self.camera_files[camera] += 1
+        heapq.heappush(self.heaps[camera], (mtime, path))
+
+    def _forget(self, path: str) -> Optional[Tuple[int, float]]:
+        entry = self.files.pop(path, None)
+        if entry is not None:
+            camera = self.camera_of(path)
+            self.total_size -= entry[0]
+            self.camera_sizes[camera] -= entry[0]
+            self.camera_files[camera] -= 1
+        return entry
+
+    def add(self, path) -> bool:
+        """ Добавление (или обновление) закрытого файла записи """
+        try:
+            stat = Path(path).stat()
+            relative_path = self.relative(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Не удалось добавить в индекс {path}: {e}')
+            return False
+        with self.lock:
+            self._remember(relative_path, stat.st_size, stat.st_mtime)
+            self.conn.execute(
+                UPSERT,
+                (
+                    relative_path,
+                    self.camera_of(relative_path),
+                    stat.st_size,
+                    stat.st_mtime,
+                    clip_start(relative_path, stat.st_mtime),
+                ),
+            )
+            self.conn.commit()
+        return True
+
+    def remove(self, relative_path: str):
+        with self.lock:
+            self._forget(relative_path)
+            self.conn.execute('DELETE FROM files WHERE path = ?', (relative_path,))
+            self.conn.commit()
+
+    def _peek(self, camera: str) -> Optional[Tuple[float, str]]:
+        heap = self.heaps.get(camera)
+        while heap:
+            mtime, path = heap[0]
+            entry = self.files.get(path)
+            if entry is None or entry[1] != mtime:
+                heapq.heappop(heap)  # устаревшая запись
+                continue
+            return mtime, path
+        return None
+
+    def oldest_mtime(self, camera: str) -> Optional[float]:
+        with self.lock:
+            top = self._peek(camera)
+        return top[0] if top else None
+
+    def pop_oldest(self, camera: str = None) -> Optional[Tuple[str, int, float]]:
+        """
+        Самый старый файл (путь, размер, mtime) камеры или всего архива.
+        Из кучи извлекается, из индекса удаляется через remove()
+        """
+        with self.lock:
+            if camera is None:
+                tops = [top for top in (self._peek(key) for key in list(self.heaps)) if top is not None]
+                if not tops:
+                    return None
+                mtime, path = min(tops)
+                camera = self.camera_of(path)
+            elif self._peek(camera) is None:
+                return None
+            mtime, path = heapq.heappop(self.heaps[camera])
+            return path, self.files[path][0], mtime
+
+    def restore(self, path: str, mtime: float):
+        """ Возврат в кучу файла, извлечённого pop_oldest(), который не удалось удалить """
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None and entry[1] == mtime:
+                heapq.heappush(self.heaps[self.camera_of(path)], (mtime, path))
+
+    def cameras(self) -> List[str]:
+        return [camera for camera, count in self.camera_files.items() if count > 0]
+
+    def recent_bytes(self, since: float) -> Dict[str, int]:
+        """ Объём файлов по камерам, появившихся после since (для оценки скорости записи) """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT camera, SUM(size) FROM files WHERE mtime > ? GROUP BY camera', (since,)
+            ).fetchall()
+        return {camera: size for camera, size in rows}
+
+    def _walk(self) -> Iterable[Tuple[str, int, float]]:
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # Служебные каталоги (например, сам индекс) не индексируем
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError as e:
+                    logger.warning(f'Не удалось получить информацию о файле {filepath}: {e}')
+                    continue
+                yield os.path.relpath(filepath, self.root), stat.st_size, stat.st_mtime
+
+    def reconcile(self):
+        """ Сверка индекса с диском: файлы, появившиеся или исчезнувшие мимо индекса """
+        found = {path: (size, mtime) for path, size, mtime in self._walk()}
+        with self.lock:
+            added = [(path, entry) for path, entry in found.items() if self.files.get(path) != entry]
+            removed = [path for path in self.files if path not in found]
+            for path, (size, mtime) in added:
+                self._remember(path, size, mtime)
+            for path in removed:
+                self._forget(path)
+            self.conn.executemany(
+                UPSERT,
+                [(path, self.camera_of(path), size, mtime, clip_start(path, mtime)) for path, (size, mtime) in added],
+            )
+            self.conn.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+            self.conn.commit()
+            if sum(len(heap) for heap in self.heaps.values()) > 2 * len(self.files) + 1024:
+                # Слишком много устаревших записей - пересобираем кучи
+                self.heaps = defaultdict(list)
+                for path, (_, mtime) in self.files.items():
+                    self.heaps[self.camera_of(path)].append((mtime, path))
+                for heap in self.heaps.values():
+                    heapq.heapify(heap)
+        if added or removed:
+            logger.info(f'Сверка индекса архива: добавлено {len(added)}, удалено {len(removed)}')
+
+    def close(self):
+        self.conn.close()
+
+
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mkv')
+VIDEO_MIMETYPES = {
+    '.avi': 'video/x-msvideo',
+    '.mp4': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+}
+
+
+class ArchiveCatalog:
+    """
+    Поиск записей по индексу архива для веб-процесса (только чтение).
+
+    Индекс ведёт процесс архива; здесь на каждый запрос открывается
+    короткое соединение только для чтения, обхода папок нет.
+    """
+
+    def __init__(self, root, db_path):
+        self.root = Path(root).resolve()
+        self.db_path = Path(db_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+
+    @staticmethod
+    def _clip(row) -> dict:
+        clip_id, path, camera, size, mtime, start = row
+        return {'id': clip_id, 'path': path, 'camera': camera, 'size': size, 'start': start, 'mtime': mtime}
+
+    def list_clips(self, camera: str, start: float = None, end: float = None, limit: int = 1000) -> List[dict]:
+        """ Записи камеры, пересекающиеся с интервалом [start, end], от старых к новым """
+        query = 'SELECT id, path, camera, size, mtime, start FROM files WHERE camera = ? AND mtime >= ? AND start <= ?'
+        extensions = ' OR '.join('path LIKE ?' for _ in VIDEO_EXTENSIONS)
+        query += f' AND ({extensions}) ORDER BY start LIMIT ?'
+        params = [camera, start or 0, end or float('inf')]
+        params += [f'%{extension}' for extension in VIDEO_EXTENSIONS]
+        params.append(limit)
+        if not self.db_path.exists():
+            return []  # процесс архива ещё не создал индекс
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [self._clip(row) for row in rows]
+
+    def get_clip(self, clip_id: int) -> Optional[dict]:
+        if not self.db_path.exists():
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id, path, camera, size, mtime, start FROM files WHERE id = ?', (clip_id,)
+            ).fetchone()
+        return self._clip(row) if row else None
+
+    def clip_ids(self, paths: Iterable[str]) -> Dict[str, int]:
+        """ Идентификаторы записей по относительным путям """
+        paths = list(paths)
+        if not paths or not self.db_path.exists():
+            return {}
+        placeholders = ', '.join('?' for _ in paths)
+        with self._connect() as conn:
+            rows = conn.execute(f'SELECT path, id FROM files WHERE path IN ({placeholders})', paths).fetchall()
+        return dict(rows)
+
+    def clip_path(self, clip: dict) -> Optional[Path]:
+        """ Абсолютный путь записи; None, если путь выходит за пределы архива """
+        path = (self.root / clip['path']).resolve()
+        if not path.is_relative_to(self.root):
+            return None
+        return path
@@ -0,0 +1,383 @@
+"""
+Асинхронный (aiohttp) сервер панели камер.
+
+Те же маршруты, что и у Flask-приложения в main.py, но каждый MJPEG-поток -
+корутина, а не поток ОС. Включается настройкой SERVER_MODE=async.
+"""
+import asyncio
+import functools
+import time
+from pathlib import Path
+from typing import Dict, Set
+
+import jinja2
+from aiohttp import web
+
+import settings
+from archive_index import ArchiveCatalog, VIDEO_MIMETYPES
+from broadcaster import BroadcastHub, Subscriber
+from detection_store import DetectionCatalog
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, collect_viewers, render_prometheus
+from renditions import STANDARD, load_renditions, rendition_key, resolve_rendition
+from services import collect_resources, get_resource_usage, parse_time
+from thumbnails import PREVIEW_KINDS, read_preview
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / 'templates'
+# Как часто поток без новых кадров проверяет, не отключился ли зритель, секунд
+CLIENT_CHECK_INTERVAL = 5
+
+
+class LoopSubscriber(Subscriber):
+    """
+    Подписчик рассыльщика камеры от имени всех корутин-клиентов этой камеры.
+
+    Рассыльщик вызывает offer() из своего потока; фрагмент один раз
+    передаётся в цикл событий и там раздаётся в очереди клиентов.
+    """
+
+    def __init__(self, camera_key: str, loop: asyncio.AbstractEventLoop, max_queue: int):
+        super().__init__(camera_key, max_queue)
+        self.loop = loop
+        self.max_queue = max_queue
+        self.clients: Set[asyncio.Queue] = set()
+        self.client_dropped = 0
+
+    def offer(self, seq: int, chunk: bytes):
+        self.loop.call_soon_threadsafe(self._dispatch, seq, chunk)
+
+    def _dispatch(self, seq: int, chunk: bytes):
+        self.last_seq = seq
+        self.sent += 1
+        for client in self.clients:
+            if client.full():
+                # Медленный клиент теряет старый кадр, а не задерживает остальных
+                client.get_nowait()
+                self.client_dropped += 1
+            client.put_nowait(chunk)
+
+    def add_client(self) -> asyncio.Queue:
+        client = asyncio.Queue(maxsize=self.max_queue)
+        self.clients.add(client)
+        return client
+
+    def remove_client(self, client: asyncio.Queue):
+        self.clients.discard(client)
+
+    def viewers(self) -> int:
+        return len(self.clients)
+
+    def stats(self, latest_seq: int) -> dict:
+        stats = super().stats(latest_seq)
+        stats['clients'] = len(self.clients)
+        stats['client_dropped'] = self.client_dropped
+        return stats
+
+
+class AsyncStreams:
+    """ Подписки цикла событий на рассыльщики камер """
+
+    def __init__(self, hub: BroadcastHub):
+        self.hub = hub
+        self.subscribers: Dict[str, LoopSubscriber] = {}
+
+    def add_client(self, camera_key: str) -> asyncio.Queue:
+        subscriber = self.subscribers.get(camera_key)
+        if subscriber is None:
+            subscriber = LoopSubscriber(camera_key, asyncio.get_running_loop(), self.hub.max_queue)
+            self.hub.subscribe(camera_key, subscriber)
+            self.subscribers[camera_key] = subscriber
+        return subscriber.add_client()
+
+    def remove_client(self, camera_key: str, client: asyncio.Queue):
+        subscriber = self.subscribers.get(camera_key)
+        if subscriber is None:
+            return
+        subscriber.remove_client(client)
+        if not subscriber.clients:
+            # Последний клиент ушёл - отписываемся, чтобы камера не считалась просматриваемой
+            self.hub.unsubscribe(subscriber)
+            del self.subscribers[camera_key]
+
+
+def _url_for(app: web.Application):
+    def url_for(endpoint: str, **values) -> str:
+        # Как во Flask: параметры, которых нет в пути маршрута, уходят в строку запроса
+        resource = app.router[endpoint]
+        pattern = resource.get_info().get('pattern')
+        path_names = pattern.groupindex if pattern is not None else {}
+        url = resource.url_for(**{key: str(value) for key, value in values.items() if key in path_names})
+        query = {key: str(value) for key, value in values.items() if key not in path_names}
+        return str(url.with_query(query) if query else url)
+    return url_for
+
+
+async def index(request: web.Request) -> web.Response:
+    template = request.app['jinja'].get_template('main.html')
+    html = template.render(cameras=settings.cameras, additional=settings.additional_cameras)
+    return web.Response(text=html, content_type='text/html')
+
+
+async def video_feed(request: web.Request) -> web.StreamResponse:
+    camera_key = request.match_info['camera_key']
+    if camera_key not in settings.cameras:
+        return web.Response(text='Camera not found', status=404)
+    quality = resolve_rendition(request.query.get('q', STANDARD), request.app['renditions'])
+    stream_key = rendition_key(camera_key, quality)
+
+    response = web.StreamResponse()
+    response.content_type = 'multipart/x-mixed-replace; boundary=frame'
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    streams: AsyncStreams = request.app['streams']
+    client = streams.add_client(stream_key)
+    try:
+        while True:
+            try:
+                async with asyncio.timeout(CLIENT_CHECK_INTERVAL):
+                    chunk = await client.get()
+            except asyncio.TimeoutError:
+                # Камера молчит: отключение зрителя иначе заметно только при следующей записи
+                if request.transport is None or request.transport.is_closing():
+                    break
+                continue
+            await response.write(chunk)
+    except ConnectionResetError:
+        pass
+    finally:
+        streams.remove_client(stream_key, client)
+    return response
+
+
+async def resources(request: web.Request) -> web.Response:
+    try:
+        # ?window=секунд - история замеров для графиков
+        window = float(request.query['window']) if request.query.get('window') else None
+    except ValueError:
+        return web.Response(text='Invalid window', status=400)
+    loop = asyncio.get_running_loop()
+    # Статистика камер - словарь Manager, обращение к нему блокирующее
+    resource_usage = await loop.run_in_executor(
+        None,
+        collect_resources,
+        request.app['processes'],
+        request.app['camera_stats'],
+        request.app['resource_sampler'],
+        window,
+    )
+    return web.json_response(resource_usage)
+
+
+async def metrics(request: web.Request) -> web.Response:
+    loop = asyncio.get_running_loop()
+    # Статистика камер - словарь Manager, обращение к нему блокирующее
+    camera_stats = await loop.run_in_executor(None, dict, request.app['camera_stats'])
+    viewers = collect_viewers(
+        settings.cameras.keys(), request.app['streams'].hub.viewers(), request.app['renditions']
+    )
+    return web.Response(
+        body=render_prometheus(camera_stats, viewers).encode(), headers={'Content-Type': METRICS_CONTENT_TYPE}
+    )
+
+
+async def workers(request: web.Request) -> web.Response:
+    supervisor = request.app['supervisor']
+    placement = supervisor.describe() if supervisor else None
+    sampler = request.app['resource_sampler']
+    loop = asyncio.get_running_loop()
+    usage = await loop.run_in_executor(
+        None,
+        functools.partial(
+            get_resource_usage,
+            request.app['processes'],
+            summary=False,
+            placement=placement,
+            sample=sampler.latest() if sampler else None,
+        )
+    )
+    return web.json_response(usage)
+
+
+async def archive_stats_view(request: web.Request) -> web.Response:
+    loop = asyncio.get_running_loop()
+    # Статистика архива - словарь Manager, обращение к нему блокирующее
+    stats = await loop.run_in_executor(None, dict, request.app['archive_stats'])
+    return web.json_response(stats)
+
+
+async def archive_clips(request: web.Request) -> web.Response:
+    catalog: ArchiveCatalog = request.app['archive_catalog']
+    if catalog is None:
+        return web.Response(text='Archive index is disabled', status=404)
+    try:
+        start = parse_time(request.query.get('start'))
+        end = parse_time(request.query.get('end'))
+        limit = int(request.query.get('limit', 1000))
+    except ValueError:
+        return web.Response(text='Invalid time range', status=400)
+    loop = asyncio.get_running_loop()
+    clips = await loop.run_in_executor(
+        None, catalog.list_clips, request.match_info['camera_key'], start, end, limit
+    )
+    for clip in clips:
+        clip['url'] = str(request.app.router['archive_clip'].url_for(clip_id=str(clip['id'])))
+    return web.json_response(clips)
+
+
+def _find_clip_path(catalog: ArchiveCatalog, clip_id: int):
+    """ Путь к файлу записи по номеру (запрос к индексу - в пуле потоков) """
+    clip = catalog.get_clip(clip_id) if catalog else None
+    path = catalog.clip_path(clip) if clip else None
+    return path if path is not None and path.exists() else None
+
+
+async def archive_clip(request: web.Request) -> web.StreamResponse:
+    # FileResponse отдаёт файл через sendfile, поддерживает Range, ETag и Last-Modified
+    loop = asyncio.get_running_loop()
+    path = await loop.run_in_executor(
+        None, _find_clip_path, request.app['archive_catalog'], int(request.match_info['clip_id'])
+    )
+    if path is None:
+        return web.Response(text='Clip not found', status=404)
+    response = web.FileResponse(path, headers={'Cache-Control': 'max-age=3600'})
+    mimetype = VIDEO_MIMETYPES.get(path.suffix)
+    if mimetype:
+        response.content_type = mimetype
+    return response
+
+
+async def archive_clip_preview(request: web.Request) -> web.Response:
+    catalog: ArchiveCatalog = request.app['archive_catalog']
+    kind = request.match_info['kind']
+    clip_id = int(request.match_info['clip_id'])
+    if kind not in PREVIEW_KINDS:
+        return web.Response(text='Preview not found', status=404)
+
+    def find():
+        path = _find_clip_path(catalog, clip_id)
+        return read_preview(path, kind) if path else None
+
+    loop = asyncio.get_running_loop()
+    preview = await loop.run_in_executor(None, find)
+    if preview is None:
+        return web.Response(text='Preview not found', status=404)
+    data, mtime = preview
+    etag = f'"{clip_id}-{kind}-{int(mtime)}"'
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age=86400'}
+    if request.headers.get('If-None-Match') == etag:
+        return web.Response(status=304, headers=headers)
+    response = web.Response(body=data, content_type='image/jpeg', headers=headers)
+    response.last_modified = mtime
+    return response
+
+
+async def detections(request: web.Request) -> web.Response:
+    catalog: DetectionCatalog = request.app['detection_catalog']
+    if catalog is None:
+        return web.Response(text='Detection store is disabled', status=404)
+    try:
+        start = parse_time(request.query.get('start'))
+        end = parse_time(request.query.get('end'))
+        min_confidence = float(request.query.get('min_confidence', 0))
+        limit = int(request.query.get('limit', 100))
+    except ValueError:
+        return web.Response(text='Invalid query', status=400)
+    archive_catalog: ArchiveCatalog = request.app['archive_catalog']
+
+    def find():
+        found = catalog.find_clips(
+            request.query.get('camera'), request.query.get('class'), start, end, min_confidence, limit
+        )
+        ids = archive_catalog.clip_ids(clip['clip'] for clip in found if clip['clip']) if archive_catalog else {}
+        return found, ids
+
+    loop = asyncio.get_running_loop()
+    clips, clip_ids = await loop.run_in_executor(None, find)
+    router = request.app.router
+    for clip in clips:
+        clip['clip_id'] = clip_ids.get(clip['clip'])
+        clip['url'] = str(router['archive_clip'].url_for(clip_id=str(clip['clip_id']))) if clip['clip_id'] else None
+    return web.json_response(clips)
+
+
+async def camera_detections(request: web.Request) -> web.Response:
+    catalog: DetectionCatalog = request.app['detection_catalog']
+    if catalog is None:
+        return web.Response(text='Detection store is disabled', status=404)
+    try:
+        end = parse_time(request.query.get('end')) or time.time()
+        start = parse_time(request.query.get('start')) or end - 3600
+        limit = int(request.query.get('limit', 1000))
+    except ValueError:
+        return web.Response(text='Invalid query', status=400)
+    loop = asyncio.get_running_loop()
+    found = await loop.run_in_executor(
+        None, catalog.find_detections, request.match_info['camera_key'], start, end, limit
+    )
+    return web.json_response(found)
+
+
+async def streams_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app['streams'].hub.stats())
+
+
+@web.middleware
+async def cors_middleware(request: web.Request, handler):
+    response = await handler(request)
+    response.headers.setdefault('Access-Control-Allow-Origin', '*')
+    return response
+
+
+def create_app(
+        hub: BroadcastHub,
+        processes: list,
+        camera_stats: dict,
+        archive_stats: dict,
+        supervisor=None,
+        resource_sampler=None,
+) -> web.Application:
+    app = web.Application(middlewares=[cors_middleware])
+    app['streams'] = AsyncStreams(hub)
+    app['processes'] = processes
+    app['camera_stats'] = camera_stats
+    app['supervisor'] = supervisor
+    app['resource_sampler'] = resource_sampler
+    app['archive_stats'] = archive_stats
+    app['renditions'] = load_renditions()
+    app['detection_catalog'] = (
+        DetectionCatalog(settings.detection_store_path) if settings.detection_store_path else None
+    )
+    app['archive_catalog'] = (
+        ArchiveCatalog(settings.save_path, settings.archive_index_path) if settings.archive_index_path else None
+    )
+    app.router.add_get('/', index, name='index')
+    app.router.add_get('/video_feed/{camera_key}', video_feed, name='video_feed')
+    app.router.add_get('/resources', resources, name='resources')
+    app.router.add_get('/metrics', metrics, name='metrics')
+    app.router.add_get('/workers', workers, name='workers')
+    app.router.add_get('/archive/stats', archive_stats_view, name='archive_stats')
+    app.router.add_get('/archive/clips/{clip_id:\\d+}', archive_clip, name='archive_clip')
+    app.router.add_get(
+        '/archive/clips/{clip_id:\\d+}/{kind}.jpg', archive_clip_preview, name='archive_clip_preview'
+    )
+    app.router.add_get('/archive/{camera_key}/clips', archive_clips, name='archive_clips')
+    app.router.add_get('/detections', detections, name='detections')
+    app.router.add_get('/detections/{camera_key}', camera_detections, name='camera_detections')
+    app.router.add_get('/streams', streams_stats, name='streams')
+    jinja = jinja2.Environment(loader=jinja2.FileSystemLoader(str(TEMPLATES_DIR)), autoescape=True)
+    jinja.globals['url_for'] = _url_for(app)
+    app['jinja'] = jinja
+    return app
+
+
+def run_async_server(
+        hub: BroadcastHub,
+        processes: list,
+        camera_stats: dict,
+        archive_stats: dict,
+        port: int,
+        supervisor=None,
+        resource_sampler=None,
+):
+    app = create_app(hub, processes, camera_stats, archive_stats, supervisor, resource_sampler)
+    web.run_app(app, host='0.0.0.0', port=port, print=print)
@@ -0,0 +1,409 @@
+"""
+Офлайн-замер производительности обработки кадров.
+
+Через настоящий VideoHandler прогоняются кадры из видеофайла или из
+генератора с заданным сценарием движения (сеть и камеры не нужны).
+Каждая конфигурация (набор переменных окружения из --set) запускается в
+отдельном процессе со своим временным архивом, поэтому настройки
+читаются заново, а пиковая память не смешивается между прогонами.
+
+Результат - JSON: кадров в секунду, p50/p99 по этапам, пиковая память,
+записано байт. --compare сравнивает с результатом прошлой версии.
+
+    python src/benchmark.py --frames 600 --set NUMBER_OF_SKIP_FRAMES=0,9 --output bench.json
+    python src/benchmark.py --video clip.avi --detector scripted --compare bench.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CAMERA_KEY = 'bench'
+# Процентили длительности этапов в отчёте
+PERCENTILES = (50, 99)
+# Изменение p99 или кадров в секунду больше этой доли считается значимым при сравнении
+COMPARE_THRESHOLD = 0.1
+
+
+def synthetic_frames(count: int, width: int, height: int, seed: int = 0):
+    """
+    Кадры со сценарием: сцена без движения, объект пересекает кадр (с 20% до 70%
+    кадров), снова без движения. На фон накладывается слабый шум, как у камеры
+    """
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 8)
+    background = cv2.normalize(background, None, 40, 200, cv2.NORM_MINMAX)
+    noise = [rng.integers(0, 4, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    object_width, object_height = width // 8, height // 3
+    start, end = int(count * 0.2), int(count * 0.7)
+    for i in range(count):
+        frame = cv2.add(background, noise[i % len(noise)])
+        if start <= i < end:
+            x = int((width - object_width) * (i - start) / max(1, end - start - 1))
+            y = height // 2 - object_height // 2
+            cv2.rectangle(frame, (x, y), (x + object_width, y + object_height), (30, 30, 160), -1)
+        yield frame
+
+
+def video_frames(path: str, count: int = 0):
+    """ Кадры видеофайла (count > 0 - не больше count) """
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise SystemExit(f'Не удаётся открыть {path}')
+    read = 0
+    try:
+        while not count or read < count:
+            ret, frame = capture.read()
+            if not ret:
+                return
+            read += 1
+            yield frame
+    finally:
+        capture.release()
+
+
+class ScriptedInference:
+    """
+    Замена модели с тем же интерфейсом, что у клиента сервиса инференса:
+    scripted - всегда один человек в центре проверяемой области (запись включается
+    при движении), none - ничего не найдено
+    """
+    PERSON = 15
+
+    def __init__(self, detect: bool):
+        import numpy as np
+
+        if detect:
+            self.result = np.array([[[[0, self.PERSON, 0.9, 0.25, 0.25, 0.75, 0.75]]]], dtype=np.float32)
+        else:
+            self.result = np.zeros((1, 1, 0, 7), dtype=np.float32)
+
+    def infer(self, blob):
+        return self.result
+
+
+def _percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def _directory_usage(path: str):
+    """ Байт записано и число записей (видеофайлов) в архиве прогона """
+    from archive_index import VIDEO_EXTENSIONS
+
+    total = 0
+    recordings = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+            if name.endswith(VIDEO_EXTENSIONS):
+                recordings += 1
+    return total, recordings
+
+
+def run_configuration(job: dict) -> dict:
+    """ Один прогон (в отдельном процессе, переменные окружения уже заданы) """
+    import settings
+    from frame_bus import FrameBus
+    from handlers.video_handler import VideoHandler
+    from metrics import Histogram, STAGES
+    from renditions import rendition_key, slot_sizes
+
+    class SampledHistogram(Histogram):
+        """ Гистограмма, которая хранит и сами замеры - для точных процентилей """
+
+        def __init__(self):
+            super().__init__()
+            self.samples = []
+
+        def observe(self, seconds: float):
+            super().observe(seconds)
+            self.samples.append(seconds)
+
+    class FrameSource:
+        """
+        Кадры итератора вместо камеры, с интерфейсом cv2.VideoCapture. Служит и флагом
+        running обработчика: value - остались ли кадры, поэтому цикл run() заканчивается
+        на последнем кадре, а не уходит в переподключение
+        """
+
+        def __init__(self, frames):
+            self.frames = iter(frames)
+            self.next_frame = next(self.frames, None)
+
+        @property
+        def value(self) -> bool:
+            return self.next_frame is not None
+
+        def isOpened(self) -> bool:
+            return True
+
+        def read(self):
+            frame, self.next_frame = self.next_frame, next(self.frames, None)
+            return frame is not None, frame
+
+        def get(self, prop) -> float:
+            return 0.0
+
+        def set(self, prop, value) -> bool:
+            return False
+
+        def release(self):
+            pass
+
+    class BenchmarkHandler(VideoHandler):
+        """ VideoHandler, у которого заменён только источник кадров; между кадрами не ждём """
+
+        def __init__(self, source: FrameSource, *args, **kwargs):
+            super().__init__(*args, running=source, **kwargs)
+            self.source = source
+            self.metrics.stages = {stage: SampledHistogram() for stage in STAGES + ('frame',)}
+
+        def _create_capture(self):
+            self.capture = self.source  # кадры читаются без отдельного потока, как в CAPTURE_MODE=legacy
+
+        def _wait_next_frame(self):
+            pass
+
+        def _process_frame(self, frame, captured_at: float = None):
+            started = time.perf_counter()
+            super()._process_frame(frame, captured_at)
+            self.metrics.observe('frame', started)
+
+    if job['video']:
+        frames = video_frames(job['video'], job['frames'])
+    else:
+        frames = synthetic_frames(job['frames'], job['width'], job['height'])
+    inference_client = None
+    if job['detector'] != 'dnn':
+        inference_client = ScriptedInference(job['detector'] == 'scripted')
+
+    sizes = slot_sizes([CAMERA_KEY])
+    frame_bus = FrameBus.create(sizes.keys(), sizes)
+    for rendition in job['viewers']:
+        frame_bus.set_subscribers(rendition_key(CAMERA_KEY, rendition), 1)  # как будто поток смотрят
+    handler = BenchmarkHandler(
+        FrameSource(frames),
+        CAMERA_KEY,
+        job['video'] or 'synthetic',
+        frame_bus,
+        inference_client=inference_client,
+        stats={},
+    )
+    try:
+        started = time.perf_counter()
+        handler.run()  # после последнего кадра дожидается записи файлов
+        elapsed = time.perf_counter() - started
+    finally:
+        frame_bus.close()
+
+    counters = handler.metrics.counters
+    stages = {}
+    for stage, histogram in handler.metrics.stages.items():
+        if not histogram.samples:
+            continue
+        stages[stage] = {f'p{percent}_ms': _percentile(histogram.samples, percent) * 1000 for percent in PERCENTILES}
+        stages[stage]['mean_ms'] = histogram.sum / histogram.count * 1000
+        stages[stage]['count'] = histogram.count
+    bytes_written, recordings = _directory_usage(settings.save_path)
+    return {
+        'frames': counters['captured'],
+        'seconds': elapsed,
+        'fps': counters['captured'] / elapsed if elapsed else 0.0,
+        'analysed_fps': counters['analysed'] / elapsed if elapsed else 0.0,
+        'counters': dict(counters),
+        'stages': stages,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # ru_maxrss в Кб (Linux)
+        'bytes_written': bytes_written,
+        'recordings': recordings,
+    }
+
+
+def child_environment(config: dict, save_path: str, cameras_json: str) -> dict:
+    """
+    Окружение процесса прогона: значения из .env, поверх них - обязательные для
+    прогона (временный архив и камера) и переменные конфигурации
+    """
+    from environs import Env
+
+    Env().read_env(str(BASE_DIR / '.env'))  # переносит .env в os.environ, не перетирая заданное
+    environment = dict(os.environ)
+    environment.setdefault('AI_MODEL', 'ai_model/MobileNetSSD_deploy.caffemodel')
+    environment.setdefault('PROTO_TXT', 'ai_model/MobileNetSSD_deploy.prototxt.txt')
+    environment.setdefault('CONFIDENCE', '0.2')
+    environment.update({
+        'CAMERAS': cameras_json,
+        'SAVE_PATH': save_path,
+        'ARCHIVE_INDEX_PATH': os.path.join(save_path, '.index', 'archive.sqlite'),
+        'DETECTION_STORE_PATH': os.path.join(save_path, '.index', 'detections.sqlite'),
+        'RECORDING_MODE': 'reencode',
+        'INFERENCE_MODE': 'local',
+    })
+    environment.update(config)
+    return environment
+
+
+def _configurations(assignments):
+    """ Все сочетания значений из --set NAME=v1,v2 """
+    names = []
+    values = []
+    for assignment in assignments or []:
+        name, _, options = assignment.partition('=')
+        names.append(name)
+        values.append(options.split(','))
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def _version() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args) -> dict:
+    from environs import Env
+
+    Env().read_env(str(BASE_DIR / '.env'))  # переносит .env в os.environ, не перетирая заданное
+    detector = args.detector
+    model = BASE_DIR / os.getenv('AI_MODEL', 'ai_model/MobileNetSSD_deploy.caffemodel')
+    if detector == 'dnn' and not model.exists():
+        print(f'Нет файла модели {model}, детектор заменён на scripted', file=sys.stderr)
+        detector = 'scripted'
+
+    results = []
+    for config in _configurations(args.set):
+        work_dir = tempfile.mkdtemp(prefix='camera-bench-')
+        cameras_json = os.path.join(work_dir, 'cameras.json')
+        save_path = os.path.join(work_dir, 'archive')
+        result_path = os.path.join(work_dir, 'result.json')
+        with open(cameras_json, 'w') as f:
+            json.dump({CAMERA_KEY: args.video or 'synthetic'}, f)
+        job = {
+            'video': args.video,
+            'frames': args.frames,
+            'width': args.width,
+            'height': args.height,
+            'detector': detector,
+            'viewers': args.viewers,
+            'result': result_path,
+        }
+        try:
+            completed = subprocess.run(
+                [sys.executable, __file__, '--job', json.dumps(job)],
+                env=child_environment(config, save_path, cameras_json),
+                cwd=BASE_DIR,
+                capture_output=True,
+                text=True,
+            )
+            if completed.returncode != 0:
+                print(completed.stdout + completed.stderr, file=sys.stderr)
+                raise SystemExit(f'Прогон {config} завершился с кодом {completed.returncode}')
+            with open(result_path) as f:
+                result = json.load(f)
+        finally:
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        result['config'] = config
+        results.append(result)
+        print(_summary(result), file=sys.stderr)
+
+    import cv2
+
+    return {
+        'version': _version(),
+        'created': time.time(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'source': args.video or f'synthetic {args.width}x{args.height}',
+        'frames': args.frames,
+        'detector': detector,
+        'viewers': args.viewers,
+        'results': results,
+    }
+
+
+def _summary(result: dict) -> str:
+    stages = ', '.join(
+        f"{stage} {values['p50_ms']:.1f}/{values['p99_ms']:.1f}" for stage, values in result['stages'].items()
+    )
+    return (f"{result.get('config') or 'по умолчанию'}: {result['fps']:.1f} кадр/с, "
+            f"память {result['peak_rss_mb']:.0f} Мб, записано {result['bytes_written'] / 2 ** 20:.1f} Мб; "
+            f"p50/p99, мс: {stages}")
+
+
+def compare(current: dict, previous: dict):
+    """ Изменения кадров в секунду и p99 этапов относительно прошлого результата """
+    previous_results = {json.dumps(result['config'], sort_keys=True): result for result in previous['results']}
+    print(f"Сравнение {previous.get('version')} -> {current.get('version')}", file=sys.stderr)
+    for result in current['results']:
+        old = previous_results.get(json.dumps(result['config'], sort_keys=True))
+        if old is None:
+            continue
+        changes = [('кадр/с', old['fps'], result['fps'], True)]
+        for stage, values in result['stages'].items():
+            if stage in old['stages']:
+                changes.append((f'{stage} p99', old['stages'][stage]['p99_ms'], values['p99_ms'], False))
+        print(f"  {result['config'] or 'по умолчанию'}:", file=sys.stderr)
+        for name, before, after, higher_is_better in changes:
+            change = (after - before) / before if before else 0.0
+            worse = change < -COMPARE_THRESHOLD if higher_is_better else change > COMPARE_THRESHOLD
+            mark = ' (хуже)' if worse else ''
+            print(f'    {name}: {before:.2f} -> {after:.2f} ({change:+.0%}){mark}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер производительности обработки кадров')
+    parser.add_argument('--video', help='видеофайл вместо синтетических кадров')
+    parser.add_argument('--frames', type=int, default=600, help='число кадров (для файла - не больше)')
+    parser.add_argument('--width', type=int, default=1920, help='ширина синтетического кадра')
+    parser.add_argument('--height', type=int, default=1080, help='высота синтетического кадра')
+    parser.add_argument('--detector', choices=('dnn', 'scripted', 'none'), default='dnn',
+                        help='dnn - модель из AI_MODEL, scripted - человек при каждой проверке, none - ничего')
+    parser.add_argument('--viewers', type=lambda value: value.split(','), default=[],
+                        help='варианты потока со зрителями через запятую (например standard,full)')
+    parser.add_argument('--set', action='append', metavar='NAME=V1,V2',
+                        help='переменная окружения и её значения; прогоняются все сочетания')
+    parser.add_argument('--output', help='файл для JSON с результатами (по умолчанию - stdout)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--keep', action='store_true', help='не удалять временный архив прогонов')
+    parser.add_argument('--job', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.job:
+        job = json.loads(args.job)
+        result = run_configuration(job)
+        with open(job['result'], 'w') as f:
+            json.dump(result, f)
+        return
+
+    results = run_benchmark(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
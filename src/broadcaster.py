@@ -0,0 +1,187 @@
+import itertools
+import queue
+import threading
+from typing import Dict, Optional
+
+from frame_bus import FrameBus
+
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_PART_FOOTER = b'\r\n'
+
+_subscriber_ids = itertools.count(1)
+
+
+class Subscriber:
+    """
+    Клиент потока камеры с ограниченной очередью.
+
+    Если клиент не успевает забирать кадры, самый старый кадр в очереди
+    выбрасывается, а рассыльщик не ждёт клиента.
+    """
+
+    def __init__(self, camera_key: str, max_queue: int):
+        self.id = next(_subscriber_ids)
+        self.camera_key = camera_key
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.sent = 0
+        self.dropped = 0
+        self.last_seq = 0  # номер последнего отданного клиенту кадра
+
+    def offer(self, seq: int, chunk: bytes):
+        """ Вызывается рассыльщиком, никогда не блокируется """
+        try:
+            self.queue.put_nowait((seq, chunk))
+        except queue.Full:
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait((seq, chunk))
+            except queue.Full:
+                self.dropped += 1
+
+    def get(self, timeout: float = None) -> Optional[bytes]:
+        """ Следующий фрагмент multipart-потока или None по таймауту """
+        try:
+            seq, chunk = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.last_seq = seq
+        self.sent += 1
+        return chunk
+
+    def viewers(self) -> int:
+        """ Число клиентов, получающих кадры через этого подписчика """
+        return 1
+
+    def stats(self, latest_seq: int) -> dict:
+        return {
+            'id': self.id,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize(),
+            'lag': max(0, latest_seq - self.last_seq) if self.last_seq else 0,
+        }
+
+
+class FrameBroadcaster(threading.Thread):
+    """
+    Рассыльщик кадров одной камеры.
+
+    Просыпается по событию нового кадра в шине, один раз собирает
+    multipart-фрагмент и раздаёт его во все очереди подписчиков.
+    """
+
+    def __init__(self, camera_key: str, frame_bus: FrameBus):
+        super().__init__(name=f'Broadcaster_{camera_key}', daemon=True)
+        self.camera_key = camera_key
+        self.frame_bus = frame_bus
+        self.subscribers: Dict[int, Subscriber] = {}
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.frames_broadcast = 0
+        self._stopped = threading.Event()
+
+    def subscribe(self, subscriber: Subscriber):
+        with self.lock:
+            self.subscribers[subscriber.id] = subscriber
+            # Процесс камеры кодирует вариант потока, только пока есть подписчики
+            self.frame_bus.set_subscribers(self.camera_key, len(self.subscribers))
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            self.subscribers.pop(subscriber.id, None)
+            self.frame_bus.set_subscribers(self.camera_key, len(self.subscribers))
+
+    def stop(self):
+        self._stopped.set()
+        self.frame_bus.set_subscribers(self.camera_key, 0)
+
+    def _build_chunk(self) -> Optional[bytes]:
+        result = self.frame_bus.get_view(self.camera_key)
+        if result is None:
+            return None
+        seq, view = result
+        if seq == self.seq:
+            view.release()
+            return None
+        chunk = b''.join((MJPEG_PART_HEADER, view, MJPEG_PART_FOOTER))
+        view.release()
+        if not self.frame_bus.is_valid(self.camera_key, seq):
+            # Писатель успел перезаписать буфер, дождёмся следующего кадра
+            return None
+        self.seq = seq
+        return chunk
+
+    def run(self):
+        while not self._stopped.is_set():
+            if not self.frame_bus.wait(self.camera_key, self.seq, timeout=1):
+                continue
+            with self.lock:
+                subscribers = list(self.subscribers.values())
+            if not subscribers:
+                # Кадры без зрителей пропускаем, ждём следующего
+                self.seq = self.frame_bus.sequence(self.camera_key)
+                continue
+            chunk = self._build_chunk()
+            if chunk is None:
+                continue
+            for subscriber in subscribers:
+                subscriber.offer(self.seq, chunk)
+            self.frames_broadcast += 1
+
+    def viewers(self) -> int:
+        with self.lock:
+            return sum(subscriber.viewers() for subscriber in self.subscribers.values())
+
+    def stats(self) -> dict:
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+        return {
+            'sequence': self.seq,
+            'frames_broadcast': self.frames_broadcast,
+            'subscribers': [subscriber.stats(self.seq) for subscriber in subscribers],
+        }
+
+
+class BroadcastHub:
+    """ Рассыльщики всех камер веб-процесса, создаются при первом подписчике """
+
+    def __init__(self, frame_bus: FrameBus, max_queue: int = 2):
+        self.frame_bus = frame_bus
+        self.max_queue = max_queue
+        self.broadcasters: Dict[str, FrameBroadcaster] = {}
+        self.lock = threading.Lock()
+
+    def _get_broadcaster(self, camera_key: str) -> FrameBroadcaster:
+        with self.lock:
+            broadcaster = self.broadcasters.get(camera_key)
+            if broadcaster is None:
+                broadcaster = FrameBroadcaster(camera_key, self.frame_bus)
+                broadcaster.start()
+                self.broadcasters[camera_key] = broadcaster
+            return broadcaster
+
+    def subscribe(self, camera_key: str, subscriber: Subscriber = None) -> Subscriber:
+        if subscriber is None:
+            subscriber = Subscriber(camera_key, self.max_queue)
+        self._get_broadcaster(camera_key).subscribe(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        broadcaster = self.broadcasters.get(subscriber.camera_key)
+        if broadcaster is not None:
+            broadcaster.unsubscribe(subscriber)
+
+    def stop(self):
+        for broadcaster in self.broadcasters.values():
+            broadcaster.stop()
+
+    def viewers(self) -> Dict[str, int]:
+        """ Зрители по ключам шины кадров (камерам и вариантам потока) """
+        return {camera_key: broadcaster.viewers() for camera_key, broadcaster in self.broadcasters.items()}
+
+    def stats(self) -> dict:
+        return {camera_key: broadcaster.stats() for camera_key, broadcaster in self.broadcasters.items()}
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import cv2
+
+
+class FileCapture:
+    """
+    Видеофайл вместо камеры (проверка без камер, нагрузочный тест).
+
+    Кадры отдаются с частотой кадров файла, как с живой камеры; в конце
+    файл начинается заново. Остальные методы - как у cv2.VideoCapture.
+    """
+    # Частота кадров, если в файле она не указана
+    default_fps = 25
+
+    def __init__(self, path: str):
+        self.capture = cv2.VideoCapture(path)
+        self.period = 1 / (self.capture.get(cv2.CAP_PROP_FPS) or self.default_fps)
+        self.next_frame = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+    def grab(self) -> bool:
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        # Отставание не догоняем пачкой кадров
+        self.next_frame = max(self.next_frame, time.monotonic() - self.period) + self.period
+        if self.capture.grab():
+            return True
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self.capture.grab()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.capture.retrieve()
+
+
+class LatestFrameCapture(threading.Thread):
+    """
+    Поток чтения камеры.
+
+    Вызывает grab() для каждого кадра, чтобы буфер RTSP не отставал, а
+    декодирует (retrieve()) только кадры, которые пойдут в обработку.
+    Обработчику всегда отдаётся самый свежий декодированный кадр; кадры,
+    которые обработчик не успел забрать, считаются выброшенными.
+    """
+
+    def __init__(self, capture: cv2.VideoCapture, skip_frames: int, name: str = None):
+        super().__init__(name=name, daemon=True)
+        self.capture = capture
+        self.skip_frames = skip_frames
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_time = 0.0  # время захвата последнего кадра (time.time())
+        self.frame_id = 0
+        self.consumed_id = 0
+        self.captured_at = 0.0  # время захвата кадра, отданного последним read()
+        self.ok = True
+        self._stopped = threading.Event()
+
+        self.grabbed = 0
+        self.retrieved = 0
+        self.dropped = 0
+        self.retrieve_failures = 0
+        self.decode_time_total = 0.0
+        self.decode_time_max = 0.0
+
+    def run(self):
+        while not self._stopped.is_set():
+            if not self.capture.grab():
+                break
+            grabbed_at = time.time()
+            self.grabbed += 1
+            if self.grabbed % (self.skip_frames + 1) != 0:  # пропуск кадров без декодирования
+                continue
+
+            start = time.perf_counter()
+            ret, frame = self.capture.retrieve()
+            decode_time = time.perf_counter() - start
+            if not ret:
+                self.retrieve_failures += 1
+                continue
+            self.retrieved += 1
+            self.decode_time_total += decode_time
+            self.decode_time_max = max(self.decode_time_max, decode_time)
+
+            with self.condition:
+                if self.frame_id > self.consumed_id:
+                    self.dropped += 1  # предыдущий кадр так и не был обработан
+                self.frame = frame
+                self.frame_time = grabbed_at
+                self.frame_id += 1
+                self.condition.notify()
+
+        with self.condition:
+            self.ok = False
+            self.condition.notify()
+
+    def read(self, timeout: float = 10):
+        """
+        Самый свежий ещё не отданный кадр, как у VideoCapture.read().
+
+        (False, None) при живом потоке (ok) - за timeout нового кадра не было,
+        соединение при этом не потеряно
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame_id > self.consumed_id or not self.ok, timeout)
+            if self.frame_id > self.consumed_id:
+                self.consumed_id = self.frame_id
+                self.captured_at = self.frame_time
+                return True, self.frame
+            return False, None
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout=5)
+
+    def stats(self) -> dict:
+        return {
+            'grabbed': self.grabbed,
+            'retrieved': self.retrieved,
+            'dropped': self.dropped,
+            'retrieve_failures': self.retrieve_failures,
+            'decode_ms_avg': self.decode_time_total / self.retrieved * 1000 if self.retrieved else 0.0,
+            'decode_ms_max': self.decode_time_max * 1000,
+        }
@@ -0,0 +1,245 @@
+"""
+Хранилище результатов детекции (SQLite).
+
+Каждая детекция - строка: камера, время, класс, уверенность, рамка
+(в долях кадра), файл записи и смещение в нём. Процессы камер пишут
+пачками из фонового потока, веб-процесс читает через соединение
+только для чтения.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS detections (
+    camera TEXT NOT NULL,
+    ts REAL NOT NULL,
+    class TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    x1 REAL NOT NULL,
+    y1 REAL NOT NULL,
+    x2 REAL NOT NULL,
+    y2 REAL NOT NULL,
+    clip TEXT,
+    clip_offset_ms INTEGER
+);
+CREATE INDEX IF NOT EXISTS detections_camera_ts ON detections (camera, ts);
+CREATE INDEX IF NOT EXISTS detections_class_ts ON detections (class, ts);
+CREATE INDEX IF NOT EXISTS detections_ts ON detections (ts);
+"""
+
+INSERT = (
+    'INSERT INTO detections (camera, ts, class, confidence, x1, y1, x2, y2, clip, clip_offset_ms) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+# Не больше стольких смещений на файл в результатах find_clips
+MAX_CLIP_OFFSETS = 200
+
+# Признак остановки в очереди записи
+_STOP = object()
+
+
+def connect(db_path) -> sqlite3.Connection:
+    """ Соединение на запись: несколько процессов камер пишут в одну базу """
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class DetectionWriter(threading.Thread):
+    """
+    Фоновая запись детекций одной камеры.
+
+    add() только кладёт строки в очередь; поток сохраняет их одной
+    транзакцией, когда набралось batch_size строк или прошло flush_interval
+    секунд. При переполнении очереди новые строки отбрасываются.
+    """
+
+    def __init__(
+            self,
+            camera_key: str,
+            db_path,
+            batch_size: int = 256,
+            flush_interval: float = 2.0,
+            retention_days: float = 0,
+            max_queue: int = 10000,
+    ):
+        super().__init__(name=f'Detections_{camera_key}', daemon=True)
+        self.camera_key = camera_key
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.last_prune = 0.0
+
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batches = 0
+        self.flush_ms_max = 0.0
+
+    def add(self, timestamp: float, label: str, confidence: float, box, clip: str = None, clip_offset_ms: int = None):
+        """ box - (x1, y1, x2, y2) в долях ширины и высоты кадра """
+        try:
+            self.queue.put_nowait(
+                (self.camera_key, timestamp, label, confidence, *box, clip, clip_offset_ms)
+            )
+        except queue.Full:
+            self.rows_dropped += 1
+
+    def stop(self):
+        self.queue.put(_STOP)
+        if self.is_alive():
+            self.join(timeout=10)
+
+    def _flush(self, conn: sqlite3.Connection, rows: list):
+        start = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany(INSERT, rows)
+        except sqlite3.Error as e:
+            print(f'Камера {self.camera_key}: не удалось сохранить детекции: {e}')
+            self.rows_dropped += len(rows)
+            return
+        self.flush_ms_max = max(self.flush_ms_max, (time.perf_counter() - start) * 1000)
+        self.rows_written += len(rows)
+        self.batches += 1
+
+    def _prune(self, conn: sqlite3.Connection):
+        """ Удаление детекций старше retention_days (не чаще раза в час) """
+        now = time.time()
+        if self.retention_days <= 0 or now - self.last_prune < 3600:
+            return
+        self.last_prune = now
+        try:
+            with conn:
+                conn.execute(
+                    'DELETE FROM detections WHERE camera = ? AND ts < ?',
+                    (self.camera_key, now - self.retention_days * 86400),
+                )
+        except sqlite3.Error as e:
+            print(f'Камера {self.camera_key}: не удалось удалить старые детекции: {e}')
+
+    def run(self):
+        conn = connect(self.db_path)
+        rows = []
+        deadline = time.monotonic() + self.flush_interval
+        stopped = False
+        while not stopped:
+            try:
+                row = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if row is _STOP:
+                    stopped = True
+                else:
+                    rows.append(row)
+            except queue.Empty:
+                pass
+            if rows and (stopped or len(rows) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(conn, rows)
+                rows = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+                self._prune(conn)
+        conn.close()
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.rows_written,
+            'dropped': self.rows_dropped,
+            'batches': self.batches,
+            'flush_ms_max': self.flush_ms_max,
+        }
+
+
+class DetectionCatalog:
+    """ Поиск детекций для веб-процесса (только чтение) """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+
+    def find_clips(
+            self,
+            camera: str = None,
+            label: str = None,
+            start: float = None,
+            end: float = None,
+            min_confidence: float = 0,
+            limit: int = 100,
+    ) -> List[dict]:
+        """
+        Записи с детекциями по условиям, от новых к старым.
+
+        Returns:
+            по одной записи на файл: время первой и последней детекции,
+            их число, максимальная уверенность и смещения (мс) в файле
+            (первые MAX_CLIP_OFFSETS детекций)
+        """
+        if not self.db_path.exists():
+            return []
+        conditions = ['ts >= ?', 'ts <= ?', 'confidence >= ?']
+        params: list = [start or 0, end or float('inf'), min_confidence]
+        if camera:
+            conditions.append('camera = ?')
+            params.append(camera)
+        if label:
+            conditions.append('class = ?')
+            params.append(label)
+        # Номер детекции внутри файла ограничивает список смещений
+        query = (
+            'SELECT camera, clip, MIN(ts), MAX(ts), COUNT(*), MAX(confidence), '
+            'GROUP_CONCAT(DISTINCT class), GROUP_CONCAT(CASE WHEN n <= ? THEN clip_offset_ms END) '
+            'FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY camera, clip ORDER BY ts) AS n '
+            f'FROM detections WHERE {" AND ".join(conditions)}) '
+            'GROUP BY camera, clip ORDER BY MAX(ts) DESC LIMIT ?'
+        )
+        params = [MAX_CLIP_OFFSETS, *params, limit]
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        clips = []
+        for camera_key, clip, first_ts, last_ts, count, confidence, classes, offsets in rows:
+            clips.append({
+                'camera': camera_key,
+                'clip': clip,
+                'first_ts': first_ts,
+                'last_ts': last_ts,
+                'detections': count,
+                'max_confidence': confidence,
+                'classes': classes.split(',') if classes else [],
+                'offsets_ms': sorted({int(offset) for offset in offsets.split(',')}) if offsets else [],
+            })
+        return clips
+
+    def find_detections(self, camera: str, start: float, end: float, limit: int = 1000) -> List[dict]:
+        """ Отдельные детекции камеры за интервал (например, для разметки при просмотре) """
+        if not self.db_path.exists():
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT ts, class, confidence, x1, y1, x2, y2, clip, clip_offset_ms FROM detections '
+                'WHERE camera = ? AND ts >= ? AND ts <= ? ORDER BY ts LIMIT ?',
+                (camera, start, end, limit),
+            ).fetchall()
+        return [
+            {
+                'ts': ts,
+                'class': label,
+                'confidence': confidence,
+                'box': [x1, y1, x2, y2],
+                'clip': clip,
+                'clip_offset_ms': offset,
+            }
+            for ts, label, confidence, x1, y1, x2, y2, clip, offset in rows
+        ]
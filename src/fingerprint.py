@@ -0,0 +1,73 @@
+"""
+Дешёвые отпечатки кадров: повторный кадр можно не обрабатывать.
+
+Для HTTP-камер хэшируются сжатые байты (до декодирования), для
+декодированных кадров - редкая сетка пикселей. Повторы подряд считает
+StallDetector: долгий повтор означает зависший поток камеры.
+"""
+import hashlib
+import time
+
+# Шаг сетки пикселей для отпечатка декодированного кадра: ~64x36 точек
+SAMPLE_COLUMNS = 64
+SAMPLE_ROWS = 36
+
+
+def bytes_fingerprint(data) -> bytes:
+    """ Отпечаток сжатого кадра (JPEG из ответа камеры) """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def frame_fingerprint(frame) -> bytes:
+    """ Отпечаток декодированного кадра по сетке пикселей """
+    height, width = frame.shape[:2]
+    sample = frame[::max(1, height // SAMPLE_ROWS), ::max(1, width // SAMPLE_COLUMNS)]
+    return hashlib.blake2b(sample.tobytes(), digest_size=16).digest()
+
+
+class StallDetector:
+    """
+    Повторы кадров камеры.
+
+    update() возвращает True, если кадр совпал с предыдущим. Поток считается
+    зависшим, когда кадр не меняется дольше stall_seconds.
+    """
+
+    def __init__(self, camera_key: str, stall_seconds: float = 10):
+        self.camera_key = camera_key
+        self.stall_seconds = stall_seconds
+        self.fingerprint = None
+        self.changed_at = time.monotonic()
+        self.repeated = 0  # повторов подряд
+        self.repeated_total = 0
+        self.stalled = False
+        self.stalls = 0
+
+    def update(self, fingerprint: bytes) -> bool:
+        now = time.monotonic()
+        if fingerprint != self.fingerprint:
+            if self.stalled:
+                print(f'Камера {self.camera_key}: поток возобновился после {now - self.changed_at:.0f} с')
+            self.fingerprint = fingerprint
+            self.changed_at = now
+            self.repeated = 0
+            self.stalled = False
+            return False
+
+        self.repeated += 1
+        self.repeated_total += 1
+        if not self.stalled and now - self.changed_at > self.stall_seconds:
+            self.stalled = True
+            self.stalls += 1
+            print(f'Камера {self.camera_key}: кадр не меняется {now - self.changed_at:.0f} с, '
+                  f'повторов подряд: {self.repeated}')
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'stalled': self.stalled,
+            'unchanged_seconds': time.monotonic() - self.changed_at if self.fingerprint is not None else 0.0,
+            'repeated': self.repeated,
+            'repeated_total': self.repeated_total,
+            'stalls': self.stalls,
+        }
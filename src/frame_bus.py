@@ -0,0 +1,221 @@
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+from multiprocessing.synchronize import Event
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+# Заголовок слота: номер последовательности, время публикации, длины кадров в буферах,
+# число подписчиков (пишет веб-процесс). Размер заголовка зависит от числа буферов
+_SEQ = struct.Struct('<Q')
+_TIMESTAMP = struct.Struct('<d')
+_LENGTH = struct.Struct('<Q')
+_SUBSCRIBERS = struct.Struct('<Q')
+TIMESTAMP_OFFSET = 8
+LENGTHS_OFFSET = 16
+# Заголовок выравнивается на строку кэша
+HEADER_ALIGN = 64
+
+
+def header_layout(buffers: int) -> Tuple[int, int]:
+    """ Смещение числа подписчиков и размер заголовка слота для buffers буферов """
+    subscribers_offset = LENGTHS_OFFSET + buffers * _LENGTH.size
+    header_size = subscribers_offset + _SUBSCRIBERS.size
+    return subscribers_offset, -(-header_size // HEADER_ALIGN) * HEADER_ALIGN
+
+
+class FrameBus:
+    """
+    Шина кадров в разделяемой памяти.
+
+    Для каждой камеры выделяется слот: заголовок и несколько буферов под
+    закодированный кадр. Писатель (процесс камеры) пишет кадр в следующий буфер
+    и только после этого публикует новый номер последовательности, поэтому
+    читатель никогда не видит недописанный кадр. Буфер с опубликованным кадром
+    не перезаписывается, пока писатель не опубликует ещё buffers - 1 кадров.
+
+    Заменяет manager.dict() last_frame: поддерживает bus[camera_key] = data
+    и bus.get(camera_key). О новом кадре писатель сообщает через событие камеры,
+    которое ожидает wait(). Веб-процесс записывает в заголовок число
+    подписчиков, чтобы писатель мог не кодировать кадры, которые никто не смотрит.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            camera_keys: Iterable[str],
+            slot_size: Union[int, Dict[str, int]],
+            buffers: int = 3,
+            create: bool = False,
+            events: Dict[str, Event] = None,
+    ):
+        """
+        Args:
+            slot_size: размер буфера кадра в байтах, общий или по ключам
+        """
+        self.camera_keys = list(camera_keys)
+        self.slot_size = slot_size
+        if isinstance(slot_size, dict):
+            self.slot_sizes = {key: slot_size[key] for key in self.camera_keys}
+        else:
+            self.slot_sizes = {key: slot_size for key in self.camera_keys}
+        if buffers < 2:
+            raise ValueError('Шине кадров нужно не меньше двух буферов на слот')
+        self.buffers = buffers
+        self._subscribers_offset, self._header_size = header_layout(buffers)
+        self._owner = create
+        self._offsets = {}
+        total_size = 0
+        for key in self.camera_keys:
+            self._offsets[key] = total_size
+            total_size += self._header_size + buffers * self.slot_sizes[key]
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, total_size))
+        else:
+            self._shm = shared_memory.SharedMemory(name=name, create=False, track=False)
+        self.name = self._shm.name
+        if events is None:
+            events = {key: multiprocessing.Event() for key in self.camera_keys}
+        self._events = events
+
+    @classmethod
+    def create(
+            cls, camera_keys: Iterable[str], slot_size: Union[int, Dict[str, int]], buffers: int = 3
+    ) -> 'FrameBus':
+        """ Создание шины в главном процессе """
+        return cls(None, camera_keys, slot_size, buffers, create=True)
+
+    def __getstate__(self):
+        # В дочерний процесс передаём только имя сегмента, там он подключается заново
+        return {
+            'name': self.name,
+            'camera_keys': self.camera_keys,
+            'slot_size': self.slot_size,
+            'buffers': self.buffers,
+            'events': self._events,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(
+            state['name'], state['camera_keys'], state['slot_size'], state['buffers'], events=state['events']
+        )
+
+    def _slot(self, camera_key: str) -> int:
+        try:
+            return self._offsets[camera_key]
+        except KeyError:
+            raise KeyError(f'Камера {camera_key} не зарегистрирована в шине кадров') from None
+
+    def _data_offset(self, camera_key: str, slot: int, index: int) -> int:
+        return slot + self._header_size + index * self.slot_sizes[camera_key]
+
+    def sequence(self, camera_key: str) -> int:
+        """ Номер последнего опубликованного кадра (0 - кадров ещё не было) """
+        return _SEQ.unpack_from(self._shm.buf, self._slot(camera_key))[0]
+
+    def timestamp(self, camera_key: str) -> float:
+        """ Время публикации последнего кадра (time.time()) """
+        return _TIMESTAMP.unpack_from(self._shm.buf, self._slot(camera_key) + TIMESTAMP_OFFSET)[0]
+
+    def put(self, camera_key: str, data) -> bool:
+        """ Публикация кадра. У каждой камеры должен быть только один писатель """
+        size = len(data)
+        slot = self._slot(camera_key)
+        slot_size = self.slot_sizes[camera_key]
+        if size > slot_size:
+            print(f'Кадр камеры {camera_key} ({size} байт) не помещается в слот ({slot_size} байт)')
+            return False
+        buf = self._shm.buf
+        seq = _SEQ.unpack_from(buf, slot)[0] + 1
+        index = seq % self.buffers
+        start = self._data_offset(camera_key, slot, index)
+        buf[start:start + size] = data
+        _LENGTH.pack_into(buf, slot + LENGTHS_OFFSET + index * _LENGTH.size, size)
+        _TIMESTAMP.pack_into(buf, slot + TIMESTAMP_OFFSET, time.time())
+        # Публикуем кадр последним, после того как он полностью записан
+        _SEQ.pack_into(buf, slot, seq)
+        self._events[camera_key].set()
+        return True
+
+    def __setitem__(self, camera_key: str, data):
+        self.put(camera_key, data)
+
+    def get_view(self, camera_key: str) -> Optional[Tuple[int, memoryview]]:
+        """
+        Последний кадр без копирования.
+
+        Returns:
+            (номер кадра, memoryview) или None, если кадров ещё не было.
+            View остаётся корректным, пока is_valid(camera_key, seq) возвращает True.
+        """
+        buf = self._shm.buf
+        slot = self._slot(camera_key)
+        seq = _SEQ.unpack_from(buf, slot)[0]
+        if seq == 0:
+            return None
+        index = seq % self.buffers
+        size = _LENGTH.unpack_from(buf, slot + LENGTHS_OFFSET + index * _LENGTH.size)[0]
+        start = self._data_offset(camera_key, slot, index)
+        return seq, buf[start:start + size]
+
+    def subscribers(self, camera_key: str) -> int:
+        """ Число подписчиков потока (0 - кадры сейчас никто не смотрит) """
+        return _SUBSCRIBERS.unpack_from(self._shm.buf, self._slot(camera_key) + self._subscribers_offset)[0]
+
+    def set_subscribers(self, camera_key: str, count: int):
+        """ Вызывается только веб-процессом (единственный писатель этого поля) """
+        _SUBSCRIBERS.pack_into(self._shm.buf, self._slot(camera_key) + self._subscribers_offset, count)
+
+    def wait(self, camera_key: str, seq: int, timeout: float = None) -> bool:
+        """
+        Ожидание кадра новее seq. Событие сбрасывается, поэтому у камеры
+        должен быть только один ожидающий (рассыльщик в веб-процессе).
+
+        Событие сбрасывается до проверки номера: кадр, опубликованный после
+        проверки, снова установит событие, и уведомление не потеряется.
+        """
+        event = self._events[camera_key]
+        event.clear()
+        if self.sequence(camera_key) != seq:
+            return True
+        return event.wait(timeout)
+
+    def is_valid(self, camera_key: str, seq: int) -> bool:
+        """ Не начал ли писатель перезаписывать буфер кадра seq """
+        return self.sequence(camera_key) - seq <= self.buffers - 2
+
+    def get(self, camera_key: str, default=None):
+        """ Копия последнего кадра (bytes), как у dict.get """
+        if camera_key not in self._offsets:
+            return default
+        while True:
+            result = self.get_view(camera_key)
+            if result is None:
+                return default
+            seq, view = result
+            data = bytes(view)
+            view.release()
+            if self.is_valid(camera_key, seq):
+                return data
+
+    def __getitem__(self, camera_key: str):
+        data = self.get(camera_key)
+        if data is None:
+            raise KeyError(camera_key)
+        return data
+
+    def __contains__(self, camera_key: str) -> bool:
+        return camera_key in self._offsets and self.sequence(camera_key) > 0
+
+    def close(self):
+        """ Отключение от сегмента; владелец также удаляет сегмент """
+        try:
+            self._shm.close()
+        except BufferError:
+            # Остались живые memoryview, сегмент освободится при завершении процесса
+            pass
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
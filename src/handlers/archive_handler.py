@@ -1,17 +1,52 @@
 import os
+import queue
 import time
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 import logging
 
+from archive_index import ArchiveIndex
+from thumbnails import sidecar_paths
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+GB = 1024 * 1024 * 1024
+
 
 class ArchiveHandler:
-    def __init__(self, path: str, max_size_gb: float):
+    def __init__(
+            self,
+            path: str,
+            max_size_gb: float,
+            low_watermark_gb: Optional[float] = None,
+            index_path: Optional[str] = None,
+            events=None,
+            reconcile_interval: int = 3600,
+            quotas: Optional[Dict[str, dict]] = None,
+            stats=None,
+    ):
+        """
+        Args:
+            path: корень архива
+            max_size_gb: верхняя граница, при превышении начинается очистка
+            low_watermark_gb: очистка идёт до этого размера (по умолчанию 90% от max_size_gb)
+            index_path: файл SQLite-индекса архива; без него размер считается обходом папки
+            events: очередь путей закрытых и удалённых записей от процессов камер
+            reconcile_interval: период сверки индекса с диском в секундах
+            quotas: ограничения камер {камера: {'quota_gb': ..., 'max_age_days': ...}}
+            stats: общий (Manager) словарь для статистики архива
+        """
         self.path = Path(path)
         self.max_size_gb = max_size_gb
+        self.low_watermark_gb = low_watermark_gb if low_watermark_gb is not None else max_size_gb * 0.9
+        self.index_path = index_path
+        self.events = events
+        self.reconcile_interval = reconcile_interval
+        self.quotas = quotas or {}
+        self.stats = stats
+        self.index: Optional[ArchiveIndex] = None  # создаётся в процессе архива
+        self.failed: List[Tuple[str, int, float]] = []  # файлы, которые не удалось удалить за проход очистки
 
         # Создаем директорию, если её нет
         self.path.mkdir(parents=True, exist_ok=True)
@@ -21,6 +56,8 @@ class ArchiveHandler:
         total_size = 0
         try:
             for dirpath, dirnames, filenames in os.walk(self.path):
+                # Скрытые папки (.index с базами индекса и детекций) - не записи архива
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
                 for filename in filenames:
                     filepath = os.path.join(dirpath, filename)
                     try:
@@ -38,6 +75,8 @@ class ArchiveHandler:
         files = []
         try:
             for dirpath, dirnames, filenames in os.walk(self.path):
+                # Скрытые папки (.index с базами индекса и детекций) - не записи архива
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
                 for filename in filenames:
                     filepath = Path(dirpath) / filename
                     try:
@@ -121,6 +160,193 @@ class ArchiveHandler:
             size = self.calculate_folder_size()
             logger.info(f"Текущий размер архива: {size:.2f} GB")
 
+    def index_size_gb(self) -> float:
+        return self.index.total_size / GB
+
+    def _delete_indexed(self, oldest: Tuple[str, int, float]) -> bool:
+        relative_path, _, _ = oldest
+        filepath = self.path / relative_path
+        try:
+            filepath.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Не удалось удалить файл {filepath}: {e}")
+            # Файл остаётся в индексе; в кучу он вернётся после прохода очистки
+            self.failed.append(oldest)
+            return False
+        self.index.remove(relative_path)
+        # Превью удаляются вместе с записью
+        for sidecar in sidecar_paths(filepath):
+            try:
+                sidecar.unlink()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Не удалось удалить превью {sidecar}: {e}")
+                continue
+            self.index.remove(self.index.relative(sidecar))
+        self._remove_empty_dirs(filepath.parent)
+        return True
+
+    def _camera_share(self, camera: str) -> float:
+        """ Доля архива камеры в байтах: её квота или равная часть общего лимита """
+        quota_gb = self.quotas.get(camera, {}).get('quota_gb')
+        if quota_gb:
+            return quota_gb * GB
+        return self.max_size_gb * GB / max(1, len(set(self.index.cameras()) | set(self.quotas)))
+
+    def cleanup_by_age(self) -> int:
+        """ Удаление записей старше max_age_days камеры """
+        deleted_count = 0
+        now = time.time()
+        for camera, quota in self.quotas.items():
+            max_age_days = quota.get('max_age_days')
+            if not max_age_days:
+                continue
+            limit = now - max_age_days * 24 * 3600
+            while (self.index.oldest_mtime(camera) or now) < limit:
+                oldest = self.index.pop_oldest(camera)
+                if oldest is not None and self._delete_indexed(oldest):
+                    deleted_count += 1
+        return deleted_count
+
+    def cleanup_by_quota(self) -> int:
+        """ Камера, превысившая свою квоту, освобождает место только за свой счёт """
+        deleted_count = 0
+        for camera, quota in self.quotas.items():
+            quota_gb = quota.get('quota_gb')
+            if not quota_gb or self.index.camera_sizes.get(camera, 0) <= quota_gb * GB:
+                continue
+            low_watermark = quota_gb * GB * self.low_watermark_gb / self.max_size_gb
+            logger.warning(f"Камера {camera} превысила квоту {quota_gb} GB")
+            while self.index.camera_sizes.get(camera, 0) > low_watermark:
+                oldest = self.index.pop_oldest(camera)
+                if oldest is None:
+                    break
+                if self._delete_indexed(oldest):
+                    deleted_count += 1
+        return deleted_count
+
+    def cleanup_by_index(self):
+        """
+        Очистка по индексу с гистерезисом: начинается выше max_size_gb
+        и удаляет файлы, пока размер не опустится до low_watermark_gb.
+        Файл удаляется у камеры, сильнее всего превысившей свою долю архива,
+        поэтому шумная камера не вытесняет историю тихих.
+        """
+        try:
+            deleted_count = self._cleanup_by_index()
+        finally:
+            # Неудалённые файлы снова участвуют в очистке со следующего прохода
+            for path, _, mtime in self.failed:
+                self.index.restore(path, mtime)
+            self.failed = []
+        if deleted_count:
+            logger.info(f"Удалено файлов: {deleted_count}, текущий размер архива: {self.index_size_gb():.2f} GB")
+
+    def _cleanup_by_index(self) -> int:
+        deleted_count = self.cleanup_by_age() + self.cleanup_by_quota()
+        size = self.index_size_gb()
+        if size > self.max_size_gb:
+            logger.warning(
+                f"Размер архива ({size:.2f} GB) превышает лимит ({self.max_size_gb} GB). "
+                f"Удаляю старые файлы до {self.low_watermark_gb:.2f} GB..."
+            )
+            while self.index_size_gb() > self.low_watermark_gb:
+                cameras = [camera for camera in self.index.cameras() if self.index.oldest_mtime(camera) is not None]
+                if not cameras:
+                    logger.error("Не осталось файлов для удаления, но лимит все еще превышен")
+                    break
+                camera = max(cameras, key=lambda key: self.index.camera_sizes[key] / self._camera_share(key))
+                oldest = self.index.pop_oldest(camera)
+                if oldest is not None and self._delete_indexed(oldest):
+                    deleted_count += 1
+        return deleted_count
+
+    def collect_stats(self, window_seconds: int = 24 * 3600) -> dict:
+        """ Занятость архива по камерам и прогноз времени до заполнения по скорости записи за окно """
+        recent = self.index.recent_bytes(time.time() - window_seconds)
+        total_rate = sum(recent.values()) / window_seconds
+        free_total = self.max_size_gb * GB - self.index.total_size
+        cameras = {}
+        for camera in sorted(set(self.index.cameras()) | set(self.quotas)):
+            quota = self.quotas.get(camera, {})
+            size = self.index.camera_sizes.get(camera, 0)
+            rate = recent.get(camera, 0) / window_seconds
+            if quota.get('quota_gb'):
+                free, fill_rate = quota['quota_gb'] * GB - size, rate
+            else:
+                free, fill_rate = free_total, total_rate
+            cameras[camera] = {
+                'size_gb': size / GB,
+                'files': self.index.camera_files.get(camera, 0),
+                'quota_gb': quota.get('quota_gb'),
+                'max_age_days': quota.get('max_age_days'),
+                'oldest_mtime': self.index.oldest_mtime(camera),
+                'bytes_per_second': rate,
+                'time_to_full_seconds': max(0.0, free / fill_rate) if fill_rate > 0 else None,
+            }
+        return {
+            'total_size_gb': self.index_size_gb(),
+            'max_size_gb': self.max_size_gb,
+            'low_watermark_gb': self.low_watermark_gb,
+            'bytes_per_second': total_rate,
+            'time_to_full_seconds': max(0.0, free_total / total_rate) if total_rate > 0 else None,
+            'cameras': cameras,
+        }
+
+    def _publish_stats(self):
+        if self.stats is not None:
+            self.stats.update(self.collect_stats())
+
+    def _drain_events(self, timeout: float):
+        """
+        Добавление закрытых записей в индекс и удаление тех, которых уже нет на диске
+        (сегменты без событий); заодно служит паузой цикла
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if self.events is None:
+                time.sleep(remaining)
+                return
+            try:
+                path = self.events.get(timeout=remaining)
+            except queue.Empty:
+                return
+            if not os.path.exists(path):
+                self.index.remove(self.index.relative(path))
+                continue
+            self.index.add(path)
+            for sidecar in sidecar_paths(path):
+                if sidecar.exists():
+                    self.index.add(sidecar)
+
+    def check_archive_indexed(self, interval_seconds: int = 60):
+        """ Цикл мониторинга архива по индексу: без обхода папки на каждой проверке """
+        self.index = ArchiveIndex(self.path, Path(self.index_path))
+        self.index.load()
+        last_reconcile = time.monotonic()
+        logger.info(
+            f"Запущен мониторинг архива по индексу: путь={self.path}, "
+            f"лимит={self.max_size_gb} GB, нижняя граница={self.low_watermark_gb:.2f} GB"
+        )
+
+        while True:
+            try:
+                if time.monotonic() - last_reconcile > self.reconcile_interval:
+                    self.index.reconcile()
+                    last_reconcile = time.monotonic()
+                self.cleanup_by_index()
+                self._publish_stats()
+            except Exception as e:
+                logger.error(f"Ошибка в цикле мониторинга: {e}")
+
+            self._drain_events(interval_seconds)
+
     def check_archive(self, interval_seconds: int = 60):
         """
         Основной цикл мониторинга архива
@@ -128,10 +354,21 @@ class ArchiveHandler:
         Args:
             interval_seconds: интервал проверки в секундах
         """
+        if self.index_path:
+            return self.check_archive_indexed(interval_seconds)
+
         logger.info(
             f"Запущен мониторинг архива: путь={self.path}, "
             f"лимит={self.max_size_gb} GB, интервал={interval_seconds}s"
         )
+        limited = sorted(
+            camera for camera, quota in self.quotas.items() if quota.get('quota_gb') or quota.get('max_age_days')
+        )
+        if limited:
+            logger.warning(
+                f"Квоты и срок хранения камер ({', '.join(limited)}) работают только с индексом архива "
+                "(ARCHIVE_INDEX_PATH) и сейчас не применяются"
+            )
 
         while True:
             try:
@@ -0,0 +1,254 @@
+"""
+Опрос HTTP-камер в одном процессе.
+
+Все HTTP-камеры опрашиваются из одного цикла событий через общий пул
+keep-alive соединений. Запросы идут по сетке времени (deadline), а не
+"пауза после работы", поэтому период не уплывает на время запроса и
+обработки. Камера, которая отвечает multipart/x-mixed-replace (MJPEG),
+читается как поток без повторных запросов. Обработка кадров идёт в пуле
+потоков; если камера присылает кадры быстрее, чем они обрабатываются,
+обрабатывается самый свежий, остальные выбрасываются.
+"""
+import asyncio
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import aiohttp
+
+import settings
+
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+MJPEG_CONTENT_TYPE = 'multipart/x-mixed-replace'
+HEADERS_END = b'\r\n\r\n'
+CONTENT_LENGTH = re.compile(rb'^content-length:\s*(\d+)\s*$', re.IGNORECASE | re.MULTILINE)
+# Предел буфера MJPEG-потока без найденного конца кадра
+MAX_MJPEG_BUFFER = 16 * 1024 * 1024
+
+
+class MJPEGParser:
+    """
+    Выделение кадров из тела multipart/x-mixed-replace.
+
+    Если в заголовках части есть Content-Length, кадр - ровно столько байт
+    после заголовков: внутри JPEG может быть миниатюра EXIF со своими
+    маркерами начала и конца. Без Content-Length кадр ищется по маркерам.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.length: Optional[int] = None  # длина тела текущей части из заголовков
+
+    def reset(self):
+        self.buffer.clear()
+        self.length = None
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """ Добавляет прочитанный кусок, возвращает полностью полученные кадры """
+        buffer = self.buffer
+        buffer += chunk
+        frames = []
+        while True:
+            if self.length is not None:
+                if len(buffer) < self.length:
+                    break
+                frames.append(bytes(buffer[:self.length]))
+                del buffer[:self.length]
+                self.length = None
+                continue
+            headers_end = buffer.find(HEADERS_END)
+            start = buffer.find(JPEG_START)
+            if headers_end >= 0 and (start < 0 or headers_end < start):
+                # Граница и заголовки части; тело начинается после пустой строки
+                match = CONTENT_LENGTH.search(bytes(buffer[:headers_end]))
+                del buffer[:headers_end + len(HEADERS_END)]
+                if match and 0 < int(match.group(1)) <= MAX_MJPEG_BUFFER:
+                    self.length = int(match.group(1))
+                continue
+            if start < 0:
+                break  # заголовки части ещё не дочитаны
+            end = buffer.find(JPEG_END, start + len(JPEG_START))
+            if end < 0:
+                del buffer[:start]
+                break
+            frames.append(bytes(buffer[start:end + len(JPEG_END)]))
+            del buffer[:end + len(JPEG_END)]
+        return frames
+
+
+class CameraIngest:
+    """ Опрос одной камеры: последний необработанный кадр и счётчики """
+
+    def __init__(self, handler, interval: float, timeout: float):
+        self.handler = handler
+        self.camera_key = handler.camera_key
+        self.url = handler.camera_source
+        self.interval = interval
+        self.timeout = timeout
+        self.mode = 'snapshot'
+        self.metrics = getattr(handler, 'metrics', None)  # PipelineMetrics обработчика, если есть
+        self.latest: Optional[bytes] = None
+        self.ready: Optional[asyncio.Event] = None  # создаётся в цикле событий
+
+        self.received = 0
+        self.processed = 0
+        self.replaced = 0  # кадры, вытесненные более свежими до обработки
+        self.missed_ticks = 0  # такты опроса, пропущенные из-за медленной камеры
+        self.errors = 0
+        self.fetch_ms_max = 0.0
+        self.process_ms_max = 0.0
+
+    def offer(self, data: bytes):
+        if self.latest is not None:
+            self.replaced += 1
+        self.latest = data
+        self.received += 1
+        self.ready.set()
+
+    def stats(self) -> dict:
+        return {
+            'mode': self.mode,
+            'received': self.received,
+            'processed': self.processed,
+            'replaced': self.replaced,
+            'missed_ticks': self.missed_ticks,
+            'errors': self.errors,
+            'fetch_ms_max': self.fetch_ms_max,
+            'process_ms_max': self.process_ms_max,
+        }
+
+
+class HTTPIngestEngine:
+    """
+    Опрос всех HTTP-камер процесса.
+
+    От обработчика нужны camera_key, camera_source, start_ingest(),
+    process_image(bytes) и stop_ingest() (см. HTTPVideoHandler).
+    """
+
+    def __init__(self, handlers: List, running, workers: int = None):
+        self.handlers = handlers
+        self.running = running
+        self.workers = workers or settings.http_ingest_workers
+        self.cameras: Dict[str, CameraIngest] = {}
+
+    def run(self):
+        print(f'Опрос {len(self.handlers)} HTTP-камер в одном процессе')
+        for handler in self.handlers:
+            handler.start_ingest()
+            camera = CameraIngest(
+                handler,
+                interval=getattr(handler, 'interval', settings.http_request_interval),
+                timeout=getattr(handler, 'timeout', settings.http_request_timeout),
+            )
+            handler.ingest = camera
+            self.cameras[handler.camera_key] = camera
+        try:
+            asyncio.run(self._main())
+        finally:
+            for handler in self.handlers:
+                handler.stop_ingest()
+
+    async def _main(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='HTTPIngest')
+        # Соединения с камерами переиспользуются между запросами
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=2, keepalive_timeout=60)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = []
+            for camera in self.cameras.values():
+                camera.ready = asyncio.Event()
+                tasks.append(asyncio.create_task(self._poll(session, camera), name=f'poll_{camera.camera_key}'))
+                tasks.append(asyncio.create_task(
+                    self._process(camera, executor), name=f'process_{camera.camera_key}'
+                ))
+            try:
+                await self._wait_stopped()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown(wait=True)
+
+    async def _wait_stopped(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # running - значение Manager, обращение к нему блокирующее
+            running = await loop.run_in_executor(None, lambda: self.running.value)
+            if not running:
+                return
+            await asyncio.sleep(1)
+
+    async def _poll(self, session: aiohttp.ClientSession, camera: CameraIngest):
+        loop = asyncio.get_running_loop()
+        # Таймауты на подключение и на чтение очередного куска, а не на весь ответ:
+        # MJPEG-поток не заканчивается
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=camera.timeout, sock_read=camera.timeout)
+        deadline = loop.time()
+        while True:
+            start = time.perf_counter()
+            try:
+                async with session.get(camera.url, timeout=timeout) as response:
+                    response.raise_for_status()
+                    if response.content_type == MJPEG_CONTENT_TYPE:
+                        if camera.mode != 'mjpeg':
+                            print(f'Камера {camera.camera_key}: MJPEG-поток')
+                        camera.mode = 'mjpeg'
+                        await self._read_mjpeg(response, camera)
+                    else:
+                        camera.mode = 'snapshot'
+                        async with asyncio.timeout(camera.timeout):
+                            camera.offer(await response.read())
+                        camera.fetch_ms_max = max(camera.fetch_ms_max, (time.perf_counter() - start) * 1000)
+                        if camera.metrics is not None:
+                            camera.metrics.observe('capture', start)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                camera.errors += 1
+                print(f'Камера {camera.camera_key}: ошибка запроса кадра: {e!r}')
+
+            # Следующий запрос - по сетке времени; опоздавшие такты пропускаем, а не догоняем
+            now = loop.time()
+            if camera.mode == 'mjpeg':
+                deadline = now  # поток оборвался - переподключаемся через interval
+            deadline += camera.interval
+            if deadline < now:
+                missed = int((now - deadline) // camera.interval) + 1
+                camera.missed_ticks += missed
+                deadline += missed * camera.interval
+            await asyncio.sleep(deadline - now)
+
+    @staticmethod
+    async def _read_mjpeg(response: aiohttp.ClientResponse, camera: CameraIngest):
+        """ Кадры MJPEG-потока выделяются по мере чтения (см. MJPEGParser) """
+        parser = MJPEGParser()
+        async for chunk in response.content.iter_any():
+            for frame in parser.feed(chunk):
+                camera.offer(frame)
+            if len(parser.buffer) > MAX_MJPEG_BUFFER:
+                print(f'Камера {camera.camera_key}: в MJPEG-потоке не найден конец кадра')
+                parser.reset()
+
+    async def _process(self, camera: CameraIngest, executor: ThreadPoolExecutor):
+        """ Обработка кадров камеры по одному; пока идёт обработка, копится только самый свежий кадр """
+        loop = asyncio.get_running_loop()
+        min_period = 1 / settings.http_mjpeg_max_fps if settings.http_mjpeg_max_fps > 0 else 0
+        while True:
+            await camera.ready.wait()
+            camera.ready.clear()
+            data, camera.latest = camera.latest, None
+            if data is None:
+                continue
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(executor, camera.handler.process_image, data)
+            except Exception as e:
+                camera.errors += 1
+                print(f'Камера {camera.camera_key}: ошибка обработки кадра: {e!r}')
+            elapsed = time.perf_counter() - start
+            camera.processed += 1
+            camera.process_ms_max = max(camera.process_ms_max, elapsed * 1000)
+            if camera.mode == 'mjpeg' and elapsed < min_period:
+                # Поток камеры может быть быстрее, чем нужно для детекции
+                await asyncio.sleep(min_period - elapsed)
+
@@ -1,11 +1,14 @@
 import time
+from typing import Optional
 
 import cv2
 import numpy as np
 import requests
 
+from fingerprint import bytes_fingerprint
+from frame_bus import FrameBus
 from handlers.video_handler import VideoHandler
-from real_time_object_detection import object_detection
+from motion import create_motion_detector
 
 
 class HTTPVideoHandler(VideoHandler):
@@ -15,64 +18,105 @@ class HTTPVideoHandler(VideoHandler):
     # Запрос к камере в секундах
     interval = 1
 
-    def __init__(self, camera_key: str, camera_source: str, last_frame: dict, running, interval):
-        super().__init__(camera_key, camera_source, last_frame, running)
+    def __init__(
+            self,
+            camera_key: str,
+            camera_source: str,
+            last_frame: FrameBus,
+            running,
+            interval,
+            inference_client=None,
+            stats: dict = None,
+            archive_events=None,
+            timeout: float = 10,
+            record_source: str = None,
+            live_source: str = None,
+    ):
+        super().__init__(
+            camera_key,
+            camera_source,
+            last_frame,
+            running,
+            inference_client,
+            stats,
+            archive_events,
+            record_source=record_source,
+            live_source=live_source,
+        )
         self.interval = interval
+        self.timeout = timeout  # таймаут запроса к камере, секунд
+        self.session = None
+        self.ingest = None  # состояние опроса в HTTPIngestEngine (для статистики)
 
     def _setup_frame(self):
-        self.previous_gray_frame = None
-        self.previous_color_frame = None
+        self.motion_detector = create_motion_detector()
         self.video_writer = None
         self.frames_recorded = 0
-        self.counter_equal_frames = 0
 
-    def _retrieve_frame(self):
+    def _retrieve_image(self) -> Optional[bytes]:
+        """ Сжатый кадр (JPEG) с камеры """
         try:
-            response = requests.get(self.camera_source, stream=True)
+            # Сессия держит соединение с камерой открытым между запросами
+            response = self.session.get(self.camera_source, timeout=self.timeout)
             response.raise_for_status()
-
-            # Конвертируем ответ в массив numpy
-            arr = np.asarray(bytearray(response.content), dtype=np.uint8)
-            # Декодируем изображение из массива
-            frame = cv2.imdecode(arr, -1)
-            if np.array_equal(frame, self.previous_color_frame):
-                if self.counter_equal_frames > 20:
-                    print(f'Equal: {self.counter_equal_frames}')
-                self.counter_equal_frames += 1
-            else:
-                self.counter_equal_frames = 0
-            self.previous_color_frame = frame
-
-            return frame
+            return response.content
 
         except requests.RequestException as e:
             print(f'Error retrieving frame: {e}')
             return None
 
-    def run(self):
+    def _collect_stats(self) -> dict:
+        stats = super()._collect_stats()
+        if self.ingest is not None:
+            stats['ingest'] = self.ingest.stats()
+        return stats
+
+    def start_ingest(self):
+        """ Подготовка к приёму кадров от HTTPIngestEngine (в его процессе) """
+        self._setup_inference()
+        self._setup_detection_store()
+        self._setup_frame()
+
+    def process_image(self, content: bytes):
+        """ Обработка сжатого кадра камеры (в режиме engine - из пула потоков HTTPIngestEngine) """
+        self.metrics.count('captured')
+        # Повтор узнаём по байтам ответа, ещё до декодирования
+        if self._is_repeat(bytes_fingerprint(content)):
+            return
+        started = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), -1)
+        self.metrics.observe('decode', started)
+        if frame is None:
+            print(f'Камера {self.camera_key}: не удалось декодировать кадр')
+            return
+        self.frame_count += 1
+        self._process_frame(frame)
+
+    def stop_ingest(self):
+        self._stop_recording()
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        super().close()
+
+    def _run(self):
         print('Running camera with HTTPVideoSource')
+        self._setup_inference()
+        self._setup_detection_store()
         self._setup_frame()
+        self.session = requests.Session()
         while self.running.value:
             time.sleep(self.interval)
-            frame = self._retrieve_frame()
+            started = time.perf_counter()
+            content = self._retrieve_image()
+            self.metrics.observe('capture', started)
 
             # Если не удалось извлечь кадр, пропустить оставшуюся часть цикла
-            if frame is None:
+            if content is None:
                 continue
 
-            self.frame_count += 1
             # Тут остается логика детекции движения/объектов из метода run() родительского класса,
             # но теперь с кадром, полученным через HTTP
-
-            # Реализация детекции движения
-            frame = self._motion_detected(frame)
-            # конец детекции
-            frame = cv2.resize(frame, (640, 360))  # Изменение размера кадра, по необходимости
-            objects_detected, new_frame = object_detection(frame)
-            _, buffer = cv2.imencode(
-                '.jpg',
-                new_frame,
-                [int(cv2.IMWRITE_JPEG_QUALITY), 85]
-            )  # Кодирование кадра в JPEG
-            self._manage_recording(objects_detected, new_frame)
-            self.last_frame[self.camera_key] = buffer.tobytes()  # Кэширование кадра
+            self.process_image(content)
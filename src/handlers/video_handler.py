@@ -1,32 +1,126 @@
-import cv2
-import asyncio
+import os
 import time
 
+import cv2
 import numpy as np
 
 import settings
+from capture import FileCapture, LatestFrameCapture
+from detection_store import DetectionWriter
+from fingerprint import StallDetector, frame_fingerprint
+from frame_bus import FrameBus
+from metrics import PipelineMetrics
+from motion import create_motion_detector
+from pre_event_buffer import PreEventBuffer
+from record_stream import RecordStream
+from renditions import STANDARD, load_renditions, rendition_key
 from video_writer import AsyncVideoWriter
-from real_time_object_detection import object_detection
+from real_time_object_detection import (
+    CLASSES,
+    detect_objects,
+    detect_objects_regions,
+    draw_detections,
+    set_inference_client,
+)
 
 
 class VideoHandler:
-    def __init__(self, camera_key: str, camera_source: str, last_frame: dict, running):
+    # Как часто печатать статистику потока чтения, секунд
+    capture_stats_interval = 60
+    # Как часто публиковать статистику камеры в общий словарь, секунд
+    stats_interval = 1
+
+    def __init__(
+            self,
+            camera_key: str,
+            camera_source: str,
+            last_frame: FrameBus,
+            running,
+            inference_client=None,
+            stats: dict = None,
+            archive_events=None,
+            record_source: str = None,
+            live_source: str = None,
+    ):
+        """
+        Args:
+            camera_source: поток для движения и детекции (дополнительный поток камеры)
+            record_source: основной поток для записи; открывается только на время записи
+            live_source: поток для просмотра; если совпадает с record_source, варианты
+                больше стандартного строятся из основного потока
+        """
         self.camera_key = camera_key
         self.camera_source = camera_source
+        self.record_source = record_source if record_source != camera_source else None
+        self.live_from_record = self.record_source is not None and live_source == self.record_source
+        self.record_stream = None
+        self.record_retry_at = 0.0
+        self.record_fps = None  # параметры основного потока с прошлого подключения
+        self.record_size = None
+        self.frame_time = 0.0  # время захвата обрабатываемого кадра (time.time())
+        self.captured_at = 0.0  # время захвата кадра, полученного _retrieve_frame()
         self.last_frame = last_frame
         self.running = running
+        self.inference_client = inference_client
+        self.stats = stats  # общий (Manager) словарь статистики камер
+        self.archive_events = archive_events  # очередь закрытых и удалённых записей для индекса архива
+        self.last_published_stats = 0.0
+        self.passthrough_recorder = None
+        self.pre_event_buffer = None
+        # При записи без перекодирования запись до события дают соседние сегменты
+        if settings.pre_event_seconds > 0 and settings.recording_mode != 'passthrough':
+            self.pre_event_buffer = PreEventBuffer(settings.pre_event_seconds, settings.pre_event_max_mb * 1024 * 1024)
 
         self.frame_count = 0
         self.capture = None
+        self.reader = None
+        self.last_stats_time = time.monotonic()
         self.fps = 0
-        self.previous_gray_frame = None
+        self.motion_detector = None
         self.video_writer = None
         self.frames_recorded = 0
         self.motion_detected = False
+        self.motion_boxes = []  # зоны движения (x, y, w, h) в координатах исходного кадра
+        self.last_detection_time = 0.0
+        self.detections = []  # детекции последнего кадра в координатах уменьшенного кадра
+        self.detection_writer = None
+        self.renditions = load_renditions()
+        self.rendition_frames = {name: 0 for name in self.renditions}  # закодировано кадров по вариантам
+        self.idle = False  # поток камеры сейчас никто не смотрит
+        self.stall = StallDetector(camera_key, settings.stall_seconds)
+        self.busy_seconds = 0.0  # время обработки кадров
+        self.busy_published = 0.0
+        self.load = None  # доля одного ядра, занятая обработкой кадров
+        self.frames_idle = 0
+        self.metrics = PipelineMetrics()  # длительность этапов и счётчики кадров
 
     def _create_capture(self):
         """ Создание объекта VideoCapture """
-        self.capture = cv2.VideoCapture(self.camera_source)
+        if os.path.isfile(self.camera_source):
+            self.capture = FileCapture(self.camera_source)  # видеофайл вместо камеры
+        else:
+            self.capture = cv2.VideoCapture(self.camera_source)
+        if settings.capture_mode == 'threaded' and self.capture.isOpened():
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self.reader = LatestFrameCapture(
+                self.capture, settings.number_of_skip_frames, name=f'Reader_{self.camera_key}'
+            )
+            self.reader.start()
+
+    def _release_capture(self):
+        if self.reader is not None:
+            self._report_capture_stats()
+            self.reader.stop()
+            self.reader = None
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def _report_capture_stats(self):
+        stats = self.reader.stats()
+        print(f"Камера {self.camera_key}: декодирование {stats['decode_ms_avg']:.1f} мс "
+              f"(макс. {stats['decode_ms_max']:.1f} мс), получено {stats['grabbed']}, "
+              f"декодировано {stats['retrieved']}, выброшено {stats['dropped']}")
 
     def _setup_frame(self):
         if not self.capture.isOpened():
@@ -34,104 +128,470 @@ class VideoHandler:
             self.fps = self.capture.get(cv2.CAP_PROP_FPS)
         else:
             print(f'Камера {self.camera_key} подключена')
-        self.previous_gray_frame = None
-        self.previous_color_frame = None
+        self.motion_detector = create_motion_detector()
         self.video_writer = None
         self.frames_recorded = 0
-        self.counter_equal_frames = 0
+
+    def _wait_next_frame(self):
+        """ Интервал между кадрами при чтении без отдельного потока """
+        time.sleep(1 / (self.fps + 1))
 
     def _retrieve_frame(self):
-        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # избавляемся от старых кадров
-        ret, frame = self.capture.read()  # Чтение кадра
-        if np.array_equal(frame, self.previous_color_frame):
-            if self.counter_equal_frames > 20:
-                print(f'Equal: {self.counter_equal_frames}')
-            self.counter_equal_frames += 1
+        if self.reader is not None:
+            ret, frame = self.reader.read()  # Самый свежий кадр из потока чтения
+            self.captured_at = self.reader.captured_at
         else:
-            self.counter_equal_frames = 0
-        self.previous_color_frame = frame
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # избавляемся от старых кадров
+            ret, frame = self.capture.read()  # Чтение кадра
+            self.captured_at = time.time()
         return ret, frame
 
-    def _frame_to_gray(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (21, 21), 0)
-        return gray
+    def _has_viewers(self) -> bool:
+        return any(
+            self.last_frame.subscribers(rendition_key(self.camera_key, name)) for name in self.renditions
+        )
+
+    def _is_repeat(self, fingerprint: bytes) -> bool:
+        """
+        Кадр совпал с предыдущим - движение, детекцию и кодирование можно пропустить.
+        Повторы подряд отслеживает StallDetector (зависание потока камеры)
+        """
+        if not self.stall.update(fingerprint) or not settings.skip_unchanged_frames:
+            return False
+        if self.idle and self._has_viewers():
+            return False  # зритель подключился, пока кадры не кодировались - публикуем
+        self.metrics.count('skipped')
+        self._publish_stats()
+        return True
 
     def _motion_detected(self, frame):
-        gray = self._frame_to_gray(frame)
+        self.motion_detected, self.motion_boxes = self.motion_detector.detect(frame)
+        if settings.display_frame_change_zones:
+            # Рисуем прямоугольники зон изменения кадра
+            for (x, y, w, h) in self.motion_boxes:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        return frame
 
-        # В первый раз устанавливаем доминантный кадр
-        if self.previous_gray_frame is None:
-            self.previous_gray_frame = gray
-            return frame
+    def _detection_regions(self, source_shape, frame_shape):
+        """
+        Области для детекции вокруг зон движения в координатах уменьшенного кадра.
+        None - если выгоднее проверить весь кадр
+        """
+        if not self.motion_boxes:
+            return None
+        frame_height, frame_width = frame_shape[:2]
+        scale_x = frame_width / source_shape[1]
+        scale_y = frame_height / source_shape[0]
+        padding = settings.detection_roi_padding
+        min_size = settings.detection_roi_min_size
+        regions = []
+        for x, y, w, h in self.motion_boxes:
+            # Расширяем зону движения, чтобы объект попал в неё целиком
+            pad_x = max(w * scale_x * padding, (min_size - w * scale_x) / 2)
+            pad_y = max(h * scale_y * padding, (min_size - h * scale_y) / 2)
+            regions.append([
+                max(0, int(x * scale_x - pad_x)),
+                max(0, int(y * scale_y - pad_y)),
+                min(frame_width, int((x + w) * scale_x + pad_x)),
+                min(frame_height, int((y + h) * scale_y + pad_y)),
+            ])
 
-        frame_delta = cv2.absdiff(self.previous_gray_frame, gray)
-        thresh = cv2.threshold(frame_delta, 25, 255, cv2.THRESH_BINARY)[1]
-        thresh = cv2.dilate(thresh, None, iterations=2)
+        # Объединяем пересекающиеся области, чтобы не искать объект дважды
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
 
-        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        self.motion_detected = False
-        if contours is not None:
-            for contour in contours:
-                contour_area = cv2.contourArea(contour)
-                if contour_area < settings.min_detection_aria:  # можно регулировать размер области детектирования
-                    return frame
-                if settings.display_frame_change_zones:
-                    # Рисуем прямоугольники зон изменения кадра
-                    (x, y, w, h) = cv2.boundingRect(contour)
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                self.motion_detected = True
-        self.previous_gray_frame = gray
-        return frame
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+        if len(regions) > settings.detection_roi_max_regions or area > frame_width * frame_height * 0.6:
+            return None
+        return regions
+
+    def _detect_objects(self, frame, source_frame):
+        """
+        Детекция объектов с учётом движения.
+
+        Без движения детектор запускается не чаще раза в DETECTION_IDLE_INTERVAL секунд
+        (0 - на каждом кадре, отрицательное значение - никогда). При движении и включённом
+        DETECTION_ROI проверяются только области вокруг зон движения.
+        """
+        now = time.monotonic()
+        self.detections = []
+        if not self.motion_detected:
+            idle_interval = settings.detection_idle_interval
+            if idle_interval < 0 or now - self.last_detection_time < idle_interval:
+                return False, frame
+        self.last_detection_time = now
+
+        regions = None
+        if self.motion_detected and settings.detection_roi:
+            regions = self._detection_regions(source_frame.shape, frame.shape)
+        if regions is not None:
+            self.detections = detect_objects_regions(frame, regions, source_frame, self.inference_client)
+        else:
+            self.detections = detect_objects(frame, self.inference_client)
+        draw_detections(frame, self.detections)
+        return bool(self.detections), frame
+
+    def _setup_detection_store(self):
+        """ Поток записи детекций создаётся уже в процессе камеры """
+        if not settings.detection_store_path:
+            return
+        self.detection_writer = DetectionWriter(
+            self.camera_key,
+            settings.detection_store_path,
+            batch_size=settings.detection_store_batch,
+            flush_interval=settings.detection_store_flush_interval,
+            retention_days=settings.detection_store_days,
+        )
+        self.detection_writer.start()
+
+    def _current_clip(self):
+        """ Файл текущей записи (относительно архива) и смещение в нём, мс """
+        if self.passthrough_recorder is not None:
+            path, offset = self.passthrough_recorder.position()
+        elif self.video_writer is not None:
+            path, offset = self.video_writer.filename, self.video_writer.position_ms()
+        else:
+            return None, None
+        if path is None:
+            return None, None
+        return os.path.relpath(path, settings.save_path), offset
+
+    def _store_detections(self, frame_shape):
+        if self.detection_writer is None or not self.detections:
+            return
+        clip, offset = self._current_clip()
+        if clip is None and not settings.detection_store_unrecorded:
+            return  # Кадр не записывается, смотреть детекцию будет не в чем
+        frame_height, frame_width = frame_shape[:2]
+        for detection in self.detections:
+            x1, y1, x2, y2 = detection.box
+            self.detection_writer.add(
+                self.frame_time,  # время захвата кадра, как и смещение в записи
+                CLASSES[detection.class_id],
+                detection.confidence,
+                (x1 / frame_width, y1 / frame_height, x2 / frame_width, y2 / frame_height),
+                clip,
+                offset,
+            )
+
+    def _on_recording_closed(self, filename: str):
+        """
+        Сообщаем процессу архива о новом файле. Путь удалённого файла отправляется
+        так же - процесс архива убирает из индекса файлы, которых нет на диске
+        """
+        if self.archive_events is not None:
+            self.archive_events.put(filename)
+
+    def _start_passthrough_recorder(self):
+        """ Запись исходного потока камеры сегментами, детектор только отмечает события """
+        if settings.recording_mode != 'passthrough':
+            return
+        # PyAV нужен только в этом режиме
+        from passthrough_recorder import PassthroughRecorder
+
+        self.passthrough_recorder = PassthroughRecorder(
+            self.camera_key,
+            self.record_source or self.camera_source,
+            segment_seconds=settings.segment_seconds,
+            container_format=settings.segment_format,
+            keep_margin=settings.segment_keep_margin,
+            on_segment_kept=self._on_recording_closed,
+            on_segment_removed=self._on_recording_closed,
+        )
+        self.passthrough_recorder.start()
 
     def _manage_recording(self, objects_detected, new_frame):
+        if self.passthrough_recorder is not None:
+            if self.motion_detected and objects_detected:
+                self.passthrough_recorder.mark_activity()
+            return
         if self.motion_detected and self.frames_recorded <= 500:  # Если обнаружено движение
             # detect objects:
             if objects_detected:
+                record_stream = self._open_record_stream()
                 if self.video_writer is None:  # Инициализировать записывающее устройство, если его нет
-                    self.video_writer = AsyncVideoWriter(self.camera_key)
-                    asyncio.run(self.video_writer.write_frame(new_frame))
+                    self.video_writer = AsyncVideoWriter(
+                        self.camera_key,
+                        on_closed=self._on_recording_closed,
+                        metrics=self.metrics,
+                        fps=self.record_fps,
+                        frame_size=self.record_size,
+                    )
+                    self._flush_pre_event_buffer()
+                    self.video_writer.write_frame(new_frame, poster=True)  # кадр срабатывания - постер
 
-                asyncio.run(self.video_writer.write_frame(new_frame))  # Запись кадра
+                if record_stream is not None and record_stream.writer is not self.video_writer:
+                    # Кадры основного потока пишутся из его потока, начиная с этого кадра
+                    record_stream.attach(self.video_writer, since=self.frame_time)
+                if record_stream is None or not record_stream.delivering:
+                    # Пока основной поток не подключился, пишем кадры анализа
+                    self.video_writer.write_frame(new_frame)  # Запись кадра
                 self.frames_recorded += 1
 
         else:  # Если нет движения
             if self.video_writer is not None:  # Если записывающее устройство инициализировано
-                asyncio.run(self.video_writer.stop_recording())
+                if self.record_stream is not None:
+                    self.record_stream.detach()  # основной поток закроется сам, когда станет не нужен
+                self.video_writer.stop_recording()  # Файл закроется в потоке записи
                 self.video_writer = None
                 self.frames_recorded = 0
 
+    def _open_record_stream(self):
+        """
+        Основной поток камеры (None, если его нет или он недоступен).
+
+        Открывается только при записи или просмотре с него. Размер и частота кадров
+        запоминаются с прошлого подключения; до первого подключения файл записи
+        получает размер кадров анализа
+        """
+        if self.record_source is None:
+            return None
+        if self.record_stream is not None and self.record_stream.frame_size:
+            self.record_fps = self.record_stream.fps
+            self.record_size = self.record_stream.frame_size
+        if self.record_stream is not None and self.record_stream.is_alive():
+            return self.record_stream
+        if self.record_stream is not None:
+            if not self.record_stream.frame_size and time.monotonic() < self.record_retry_at:
+                return None  # поток не открылся - не переподключаемся на каждом кадре
+            self.record_stream = None
+        standard = self.renditions[STANDARD]
+        self.record_stream = RecordStream(
+            self.camera_key,
+            self.record_source,
+            # Рамки детекций найдены на кадре стандартного размера
+            annotate=lambda frame: self._annotate_source(frame, (standard.height, standard.width)),
+            idle_timeout=settings.record_stream_idle_seconds,
+        )
+        self.record_stream.start()
+        self.record_retry_at = time.monotonic() + settings.record_stream_retry_seconds
+        return self.record_stream
+
+    def _close_record_stream(self):
+        if self.record_stream is not None:
+            self.record_stream.stop()
+            self.record_stream.join(timeout=5)
+            self.record_stream = None
+
+    def _flush_pre_event_buffer(self):
+        """ Кадры, накопленные до срабатывания, пишутся в начало нового файла """
+        if self.pre_event_buffer is None:
+            return
+        for _, data in self.pre_event_buffer.drain():
+            frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                self.video_writer.write_frame(frame, block=True)  # Эти кадры не выбрасываем
+
+    def _collect_stats(self) -> dict:
+        stats = {}
+        if self.reader is not None:
+            stats['capture'] = self.reader.stats()
+        if self.pre_event_buffer is not None:
+            stats['pre_event_buffer'] = self.pre_event_buffer.stats()
+        if self.video_writer is not None:
+            stats['recording'] = self.video_writer.stats()
+        if self.passthrough_recorder is not None:
+            stats['passthrough'] = self.passthrough_recorder.stats()
+        if self.detection_writer is not None:
+            stats['detections'] = self.detection_writer.stats()
+        if self.record_stream is not None:
+            stats['record_stream'] = self.record_stream.stats()
+        stats['renditions'] = dict(self.rendition_frames)
+        stats['idle'] = self.idle
+        stats['stall'] = self.stall.stats()
+        if self.load is not None:
+            stats['load'] = self.load
+        stats['frames_idle'] = self.frames_idle
+        stats['metrics'] = self.metrics.snapshot()
+        return stats
+
+    def _stop_recording(self):
+        """ Остановка записи при завершении работы: дописываем очередь """
+        if self.passthrough_recorder is not None:
+            self.passthrough_recorder.stop()
+            self.passthrough_recorder = None
+        self._close_record_stream()
+        if self.video_writer is not None:
+            self.video_writer.stop_recording(wait=True)
+            self.video_writer = None
+            self.frames_recorded = 0
+        if self.detection_writer is not None:
+            self.detection_writer.stop()  # сохраняем накопленные детекции
+            self.detection_writer = None
+
+    def _publish_stats(self):
+        if self.stats is None:
+            return
+        now = time.monotonic()
+        if now - self.last_published_stats < self.stats_interval:
+            return
+        if self.last_published_stats:
+            # Доля времени, занятого обработкой кадров (сглаженная), - для размещения камер по процессам
+            load = (self.busy_seconds - self.busy_published) / (now - self.last_published_stats)
+            self.load = load if self.load is None else 0.9 * self.load + 0.1 * load
+        self.busy_published = self.busy_seconds
+        self.last_published_stats = now
+        self.stats[self.camera_key] = self._collect_stats()
+
+    def _process_frame(self, frame, captured_at: float = None):
+        """
+        Обработка кадра: движение, объекты, запись и публикация для просмотра.
+
+        captured_at - время захвата кадра; с него начинается запись основного потока,
+        поэтому время ожидания в очереди и обработки к нему не добавляется
+        """
+        started = time.perf_counter()
+        self.frame_time = captured_at or time.time()
+        self.metrics.count('analysed')
+        # Реализация детекции движения
+        source_frame = self._motion_detected(frame)
+        # конец детекции
+        stage = self.metrics.observe('motion', started)
+        standard = self.renditions[STANDARD]
+        frame = cv2.resize(source_frame, (standard.width, standard.height))  # Изменение размера кадра
+        stage = self.metrics.observe('resize', stage)
+        objects_detected, new_frame = self._detect_objects(frame, source_frame)
+        stage = self.metrics.observe('detection', stage)
+        self._manage_recording(objects_detected, new_frame)
+        self._store_detections(new_frame.shape)
+        stage = self.metrics.observe('recording', stage)
+
+        buffer_pre_event = self.pre_event_buffer is not None and self.video_writer is None
+        watched = self.last_frame.subscribers(self.camera_key) > 0
+        # Без зрителей кадр для просмотра не кодируется, если он не нужен буферу до события
+        encode = watched or buffer_pre_event or not settings.live_idle_skip
+        if encode:
+            _, buffer = cv2.imencode(
+                '.jpg',
+                new_frame,
+                [int(cv2.IMWRITE_JPEG_QUALITY), standard.quality]
+            )  # Кодирование кадра в JPEG
+            data = buffer.tobytes()
+            self.rendition_frames[STANDARD] += 1
+            if buffer_pre_event:
+                self.pre_event_buffer.append(data)  # Тот же JPEG, что и для просмотра
+            self.last_frame[self.camera_key] = data  # Кэширование кадра
+        published = self._publish_renditions(source_frame, new_frame)
+        if encode or published:
+            self.metrics.observe('encode', stage)
+        # Простой: ни один вариант потока не кодировался
+        self.idle = not encode and not published
+        if self.idle:
+            self.frames_idle += 1
+        self.busy_seconds += time.perf_counter() - started
+        self._publish_stats()
+
+    def _annotate_source(self, source_frame, frame_shape):
+        """ Рамки детекций (найденные на уменьшенном кадре) на кадре исходного разрешения """
+        scale_x = source_frame.shape[1] / frame_shape[1]
+        scale_y = source_frame.shape[0] / frame_shape[0]
+        draw_detections(source_frame, [
+            detection._replace(box=(
+                int(detection.box[0] * scale_x),
+                int(detection.box[1] * scale_y),
+                int(detection.box[2] * scale_x),
+                int(detection.box[3] * scale_y),
+            ))
+            for detection in self.detections
+        ])
+        return source_frame
+
+    def _live_source(self, source_frame, frame_shape):
+        """ Кадр для вариантов больше стандартного: из основного потока, если просмотр идёт с него """
+        if self.live_from_record:
+            record_stream = self._open_record_stream()
+            latest = record_stream.latest() if record_stream is not None else None
+            # Пока основной поток подключается, показываем кадр анализа
+            if latest is not None and self.frame_time - latest[0] < 1:
+                _, record_frame, annotated = latest
+                return record_frame if annotated else self._annotate_source(record_frame.copy(), frame_shape)
+        return self._annotate_source(source_frame, frame_shape)
+
+    def _publish_renditions(self, source_frame, frame) -> int:
+        """ Остальные варианты потока кодируются, только пока их кто-то смотрит; возвращает их число """
+        annotated_source = None
+        published = 0
+        for rendition in self.renditions.values():
+            if rendition.name == STANDARD:
+                continue
+            key = rendition_key(self.camera_key, rendition.name)
+            if not self.last_frame.subscribers(key):
+                continue
+            if rendition.width and rendition.width <= frame.shape[1]:
+                image = cv2.resize(frame, (rendition.width, rendition.height), interpolation=cv2.INTER_AREA)
+            else:
+                # Вариант больше стандартного строим из исходного кадра
+                if annotated_source is None:
+                    annotated_source = self._live_source(source_frame, frame.shape)
+                image = annotated_source
+                if rendition.width:
+                    image = cv2.resize(image, (rendition.width, rendition.height), interpolation=cv2.INTER_AREA)
+            _, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), rendition.quality])
+            self.last_frame[key] = buffer.tobytes()
+            self.rendition_frames[rendition.name] += 1
+            published += 1
+        return published
+
+    def _setup_inference(self):
+        if self.inference_client is not None:
+            set_inference_client(self.inference_client)
+
+    def close(self):
+        """ Остановка записи и освобождение захвата; run() вызывает её и при исключении """
+        self._stop_recording()
+        self._release_capture()
+
     def run(self):
+        try:
+            self._run()
+        finally:
+            self.close()  # перезапуск после ошибки не должен оставлять потоки и захват прошлого запуска
+
+    def _run(self):
+        self._setup_inference()
+        self._setup_detection_store()
         self._create_capture()
         self._setup_frame()
+        self._start_passthrough_recorder()
 
         print('services.py, cache_frames, source:', self.camera_source)
         # while self.running.value:
 
         while self.running.value:
+            started = time.perf_counter()
             ret, frame = self._retrieve_frame()
+            if not ret and self.reader is not None and self.reader.ok:
+                continue  # за время ожидания нового кадра не было, но поток чтения жив
 
             self.frame_count += 1
             if ret:  # Если кадр считан
-                if self.frame_count % (settings.number_of_skip_frames + 1) != 0:  # пропуск кадров
+                self.metrics.observe('capture', started)
+                self.metrics.count('captured')
+                # В потоке чтения кадры пропускаются без декодирования
+                if self.reader is None and self.frame_count % (settings.number_of_skip_frames + 1) != 0:
+                    self.metrics.count('skipped')
                     continue
-                # Реализация детекции движения
-                frame = self._motion_detected(frame)
-                # конец детекции
-                frame = cv2.resize(frame, (640, 360))  # Изменение размера кадра, по необходимости
-                objects_detected, new_frame = object_detection(frame)
-                _, buffer = cv2.imencode(
-                    '.jpg',
-                    new_frame,
-                    [int(cv2.IMWRITE_JPEG_QUALITY), 85]
-                )  # Кодирование кадра в JPEG
-                self._manage_recording(objects_detected, new_frame)
-                self.last_frame[self.camera_key] = buffer.tobytes()  # Кэширование кадра
+                if not self._is_repeat(frame_fingerprint(frame)):
+                    self._process_frame(frame, self.captured_at)
             else:
                 print(f"Потеряно соединение с камерой {self.camera_key}. Попытка переподключения через 60 секунд.")
-                self.capture.release()  # Высвобождаем захват перед тем, как пытаться переподключиться
+                self._release_capture()  # Высвобождаем захват перед тем, как пытаться переподключиться
                 time.sleep(60)
                 self._create_capture()
                 self._setup_frame()
-            time.sleep(1 / (self.fps + 1))  # Интервал между кадрами
-        self.capture.release()
+            if self.reader is None:
+                self._wait_next_frame()
+            elif time.monotonic() - self.last_stats_time > self.capture_stats_interval:
+                self._report_capture_stats()
+                self.last_stats_time = time.monotonic()
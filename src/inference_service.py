@@ -0,0 +1,167 @@
+"""
+Общий процесс DNN-инференса для всех камер.
+
+Модель загружается один раз. Процессы камер кладут blob в свой слот
+разделяемой памяти, а номер слота и номер запроса - в очередь запросов; сервис
+собирает запросы в пакет (не больше max_batch, ждёт не дольше max_wait) и
+прогоняет их через net.forward() одним вызовом, а детекции возвращает в слоты
+результатов вместе с номером запроса. Запоздавший ответ на запрос, который
+клиент уже перестал ждать, распознаётся по номеру и отбрасывается.
+"""
+import multiprocessing
+import queue
+import time
+from multiprocessing import shared_memory
+from typing import Iterable, Optional
+
+import numpy as np
+
+BLOB_SHAPE = (1, 3, 300, 300)
+BLOB_BYTES = int(np.prod(BLOB_SHAPE)) * np.dtype(np.float32).itemsize
+MAX_DETECTIONS = 100
+# Слот результата: номер запроса и количество детекций (int64), до MAX_DETECTIONS строк по 7 чисел
+RESULT_HEADER_BYTES = 2 * np.dtype(np.int64).itemsize
+RESULT_BYTES = RESULT_HEADER_BYTES + MAX_DETECTIONS * 7 * np.dtype(np.float32).itemsize
+
+
+class InferenceService:
+    def __init__(self, camera_keys: Iterable[str], max_batch: int = 8, max_wait: float = 0.02):
+        self.camera_keys = list(camera_keys)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.slots = {key: i for i, key in enumerate(self.camera_keys)}
+        self.requests = multiprocessing.Queue()
+        self.ready = [multiprocessing.Event() for _ in self.camera_keys]
+        self.running = multiprocessing.Value('i', 1)
+        count = max(1, len(self.camera_keys))
+        self._blobs = shared_memory.SharedMemory(create=True, size=count * BLOB_BYTES)
+        self._results = shared_memory.SharedMemory(create=True, size=count * RESULT_BYTES)
+        self._owner = True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_blobs'] = self._blobs.name
+        state['_results'] = self._results.name
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._blobs = shared_memory.SharedMemory(name=state['_blobs'], create=False, track=False)
+        self._results = shared_memory.SharedMemory(name=state['_results'], create=False, track=False)
+
+    def blob_view(self, slot: int) -> np.ndarray:
+        return np.ndarray(BLOB_SHAPE, dtype=np.float32, buffer=self._blobs.buf, offset=slot * BLOB_BYTES)
+
+    def _header_view(self, slot: int) -> np.ndarray:
+        """ [номер запроса, количество детекций] """
+        return np.ndarray((2,), dtype=np.int64, buffer=self._results.buf, offset=slot * RESULT_BYTES)
+
+    def _rows_view(self, slot: int) -> np.ndarray:
+        return np.ndarray(
+            (MAX_DETECTIONS, 7),
+            dtype=np.float32,
+            buffer=self._results.buf,
+            offset=slot * RESULT_BYTES + RESULT_HEADER_BYTES,
+        )
+
+    def _publish(self, slot: int, request_id: int, count: int):
+        """ Номер запроса пишется последним - после строк и количества """
+        header = self._header_view(slot)
+        header[1] = count
+        header[0] = request_id
+        self.ready[slot].set()
+
+    def client(self, camera_key: str) -> 'InferenceClient':
+        return InferenceClient(self, self.slots[camera_key])
+
+    def _collect_batch(self) -> list:
+        """ Первый запрос ждём без ограничения, остальные - не дольше max_wait """
+        try:
+            batch = [self.requests.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _forward(self, net, batch: list):
+        blobs = np.concatenate([self.blob_view(slot) for slot, _ in batch])
+        net.setInput(blobs)
+        detections = net.forward()[0, 0]
+        for image_id, (slot, request_id) in enumerate(batch):
+            # В выходе DetectionOutput первая колонка - номер изображения в пакете
+            rows = detections[detections[:, 0] == image_id][:MAX_DETECTIONS]
+            rows_view = self._rows_view(slot)
+            rows_view[:len(rows)] = rows
+            rows_view[:len(rows), 0] = 0
+            self._publish(slot, request_id, len(rows))
+
+    def run(self):
+        # Импорт здесь, чтобы модель загружалась только в процессе сервиса
+        from real_time_object_detection import load_net
+
+        net = load_net()
+        print(f'Сервис инференса запущен: камер {len(self.camera_keys)}, '
+              f'пакет до {self.max_batch}, ожидание до {self.max_wait * 1000:.0f} мс')
+        while self.running.value:
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            try:
+                self._forward(net, batch)
+            except Exception as e:
+                print(f'Ошибка инференса: {e}')
+                for slot, request_id in batch:
+                    self._publish(slot, request_id, 0)
+
+    def stop(self):
+        self.running.value = 0
+
+    def close(self):
+        self._blobs.close()
+        self._results.close()
+        if self._owner:
+            self._blobs.unlink()
+            self._results.unlink()
+
+
+class InferenceClient:
+    """ Клиентская сторона в процессе камеры: один запрос за раз на камеру """
+
+    def __init__(self, service: InferenceService, slot: int, timeout: float = 5):
+        self.service = service
+        self.slot = slot
+        self.timeout = timeout
+        self._next_request_id = 0  # обычное число: клиент передаётся в процесс камеры через pickle
+
+    def infer(self, blob: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Детекции в формате net.forward() ([1, 1, N, 7]) или None, если сервис не ответил
+        """
+        self._next_request_id += 1
+        request_id = self._next_request_id
+        self.service.blob_view(self.slot)[:] = blob
+        ready = self.service.ready[self.slot]
+        header = self.service._header_view(self.slot)
+        self.service.requests.put((self.slot, request_id))
+        deadline = time.monotonic() + self.timeout
+        while True:
+            # Событие сбрасывается до проверки номера, иначе можно пропустить свой ответ
+            ready.clear()
+            if header[0] == request_id:
+                break
+            # Ответ на прошлый (просроченный) запрос - ждём свой
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not ready.wait(remaining):
+                print(f'Сервис инференса не ответил за {self.timeout} с')
+                return None
+        count = int(header[1])
+        return self.service._rows_view(self.slot)[:count].copy().reshape(1, 1, count, 7)
@@ -0,0 +1,493 @@
+"""
+Нагрузочный тест: сколько камер и зрителей выдерживает машина.
+
+Запускает N имитаций камер - HTTP-снимки и MJPEG-потоки (путь
+HTTPVideoHandler) и видеофайлы (путь VideoHandler, вместо RTSP), -
+приложение main.py со сгенерированным списком камер и M зрителей
+/video_feed. Имитации HTTP-камер рисуют в углу кадра время съёмки
+(двоичный код), зритель читает его из полученного кадра - так меряется
+задержка от съёмки до клиента. Для каждой пары (N, M) из перебора
+фиксируются кадров в секунду у зрителей, задержка и процессор/память
+процессов приложения. Приложение запускается с настоящей моделью детектора
+(AI_MODEL и PROTO_TXT из .env или --set), поэтому файлы модели проверяются
+до запуска.
+
+    python src/load_test.py --cameras 2,8 --viewers 0,10,50 --kinds snapshot,mjpeg,file --output load.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+import cv2
+import numpy as np
+import psutil
+from aiohttp import web
+
+# Модули приложения читают настройки при импорте; benchmark - нет
+from benchmark import BASE_DIR, child_environment, synthetic_frames
+
+KINDS = ('snapshot', 'mjpeg', 'file')
+# Код времени съёмки: 40 бит миллисекунд и 8 бит контрольной суммы, блоки 12x4 в левом верхнем углу
+CODE_COLUMNS = 12
+CODE_ROWS = 4
+CODE_WIDTH = 0.36  # доля ширины кадра
+CODE_HEIGHT = 0.12  # доля высоты кадра
+TIMESTAMP_BITS = 40
+# Видеофайл для камер-файлов, секунд
+FILE_SECONDS = 20
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+
+
+def _code_bits(timestamp_ms: int) -> List[int]:
+    value = timestamp_ms % (1 << TIMESTAMP_BITS)
+    checksum = sum(value.to_bytes(TIMESTAMP_BITS // 8, 'big')) % 256
+    value = (value << 8) | checksum
+    return [(value >> (CODE_COLUMNS * CODE_ROWS - 1 - i)) & 1 for i in range(CODE_COLUMNS * CODE_ROWS)]
+
+
+def draw_timestamp(frame, timestamp: float):
+    """ Время съёмки (time.time()) блоками в углу кадра - переживает уменьшение и JPEG """
+    height, width = frame.shape[:2]
+    block_width = width * CODE_WIDTH / CODE_COLUMNS
+    block_height = height * CODE_HEIGHT / CODE_ROWS
+    for i, bit in enumerate(_code_bits(int(timestamp * 1000))):
+        row, column = divmod(i, CODE_COLUMNS)
+        top_left = (int(column * block_width), int(row * block_height))
+        bottom_right = (int((column + 1) * block_width) - 1, int((row + 1) * block_height) - 1)
+        cv2.rectangle(frame, top_left, bottom_right, (255, 255, 255) if bit else (0, 0, 0), -1)
+
+
+def read_timestamp(gray) -> Optional[float]:
+    """ Время съёмки из кадра в оттенках серого; None - если код не читается """
+    height, width = gray.shape[:2]
+    block_width = width * CODE_WIDTH / CODE_COLUMNS
+    block_height = height * CODE_HEIGHT / CODE_ROWS
+    value = 0
+    for i in range(CODE_COLUMNS * CODE_ROWS):
+        row, column = divmod(i, CODE_COLUMNS)
+        pixel = gray[int((row + 0.5) * block_height), int((column + 0.5) * block_width)]
+        value = (value << 1) | int(pixel > 127)
+    checksum = value & 0xFF
+    value >>= 8
+    if sum(value.to_bytes(TIMESTAMP_BITS // 8, 'big')) % 256 != checksum:
+        return None
+    # Восстанавливаем старшие биты по текущему времени
+    now_ms = int(time.time() * 1000)
+    period = 1 << TIMESTAMP_BITS
+    timestamp_ms = now_ms - (now_ms - value) % period
+    return timestamp_ms / 1000
+
+
+class CameraScene:
+    """ Кадр имитации камеры: неподвижный фон, движущийся объект и время съёмки """
+
+    def __init__(self, width: int, height: int, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 8)
+        self.background = cv2.normalize(background, None, 40, 200, cv2.NORM_MINMAX)
+        self.width = width
+        self.height = height
+
+    def render_jpeg(self, index: int, quality: int = 85) -> bytes:
+        frame = self.background.copy()
+        object_width, object_height = self.width // 8, self.height // 3
+        x = int((self.width - object_width) * (index % 100) / 99)
+        y = self.height // 2 - object_height // 2
+        cv2.rectangle(frame, (x, y), (x + object_width, y + object_height), (30, 30, 160), -1)
+        draw_timestamp(frame, time.time())
+        _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        return buffer.tobytes()
+
+
+def serve_cameras(port: int, count: int, width: int, height: int, fps: float, ready):
+    """ Процесс имитаций HTTP-камер: /camera/<номер>/snapshot.jpg и /camera/<номер>/mjpeg """
+    scenes = [CameraScene(width, height, seed=i) for i in range(count)]
+    frame_index = [0] * count
+
+    def render(camera: int) -> bytes:
+        frame_index[camera] += 1
+        return scenes[camera].render_jpeg(frame_index[camera])
+
+    def camera_number(request: web.Request) -> int:
+        camera = int(request.match_info['camera'])
+        if not 0 <= camera < count:
+            raise web.HTTPNotFound()
+        return camera
+
+    async def snapshot(request: web.Request) -> web.Response:
+        camera = camera_number(request)
+        image = await asyncio.get_running_loop().run_in_executor(None, render, camera)
+        return web.Response(body=image, content_type='image/jpeg')
+
+    async def mjpeg(request: web.Request) -> web.StreamResponse:
+        camera = camera_number(request)
+        loop = asyncio.get_running_loop()
+        response = web.StreamResponse()
+        response.content_type = 'multipart/x-mixed-replace; boundary=frame'
+        await response.prepare(request)
+        deadline = loop.time()
+        while True:
+            image = await loop.run_in_executor(None, render, camera)
+            await response.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + image + b'\r\n')
+            deadline = max(deadline + 1 / fps, loop.time())
+            await asyncio.sleep(deadline - loop.time())
+
+    async def on_startup(app):
+        ready.set()
+
+    app = web.Application()
+    app.router.add_get('/camera/{camera:\\d+}/snapshot.jpg', snapshot)
+    app.router.add_get('/camera/{camera:\\d+}/mjpeg', mjpeg)
+    app.on_startup.append(on_startup)
+    web.run_app(app, host='127.0.0.1', port=port, print=None, handle_signals=True)
+
+
+def write_file_camera(path: str, width: int, height: int, fps: float):
+    """ Видеофайл для камер-файлов (воспроизводится приложением по кругу) """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for frame in synthetic_frames(int(FILE_SECONDS * fps), width, height):
+        writer.write(frame)
+    writer.release()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def camera_config(count: int, kinds: List[str], camera_port: int, video_path: str, fps: float) -> Dict[str, dict]:
+    """ Список камер для приложения: виды камер чередуются """
+    cameras = {}
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        if kind == 'snapshot':
+            config = {'url': f'http://127.0.0.1:{camera_port}/camera/{i}/snapshot.jpg', 'interval': 1 / fps}
+        elif kind == 'mjpeg':
+            config = {'url': f'http://127.0.0.1:{camera_port}/camera/{i}/mjpeg'}
+        else:
+            config = {'url': video_path}
+        config['kind'] = kind
+        cameras[f'load{i:03d}'] = config
+    return cameras
+
+
+class Viewer:
+    """ Зритель /video_feed: кадры, кадров в секунду и задержка от съёмки """
+
+    def __init__(self, camera_key: str, measure_latency: bool, sample_interval: float):
+        self.camera_key = camera_key
+        self.measure_latency = measure_latency
+        self.sample_interval = sample_interval
+        self.frames = 0
+        self.latencies: List[float] = []
+        self.unreadable = 0
+        self.errors = 0
+        self.last_sample = 0.0
+
+    def reset(self):
+        self.frames = 0
+        self.latencies.clear()
+        self.unreadable = 0
+
+    def offer(self, data: bytes):
+        """ Вызывается разбором MJPEG-потока на каждый кадр """
+        received = time.time()
+        self.frames += 1
+        if not self.measure_latency or received - self.last_sample < self.sample_interval:
+            return
+        self.last_sample = received
+        gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        captured = read_timestamp(gray) if gray is not None else None
+        if captured is None or not 0 <= received - captured < 60:
+            self.unreadable += 1
+            return
+        self.latencies.append(received - captured)
+
+    async def _read(self, response: aiohttp.ClientResponse):
+        """ Кадры multipart-потока по маркерам начала и конца JPEG """
+        buffer = bytearray()
+        async for chunk in response.content.iter_any():
+            buffer += chunk
+            while True:
+                start = buffer.find(JPEG_START)
+                end = buffer.find(JPEG_END, start + len(JPEG_START)) if start >= 0 else -1
+                if end < 0:
+                    if start > 0:
+                        del buffer[:start]
+                    break
+                self.offer(bytes(buffer[start:end + len(JPEG_END)]))
+                del buffer[:end + len(JPEG_END)]
+
+    async def watch(self, session: aiohttp.ClientSession, url: str):
+        while True:
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=None, sock_read=30)) as response:
+                    response.raise_for_status()
+                    await self._read(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.errors += 1
+                print(f'Зритель {self.camera_key}: {e!r}', file=sys.stderr)
+                await asyncio.sleep(1)
+
+
+class ProcessTreeSampler:
+    """ Процессор (в процентах одного ядра) и память процесса приложения вместе с дочерними """
+
+    def __init__(self, pid: int):
+        self.root = psutil.Process(pid)
+        self.processes: Dict[int, psutil.Process] = {}
+        self.cpu: List[float] = []
+        self.rss: List[float] = []
+
+    def sample(self):
+        cpu = 0.0
+        rss = 0
+        for process in [self.root] + self.root.children(recursive=True):
+            cached = self.processes.get(process.pid)
+            try:
+                if cached is None:
+                    process.cpu_percent(None)  # точка отсчёта
+                    self.processes[process.pid] = process
+                    continue
+                cpu += cached.cpu_percent(None)
+                rss += cached.memory_info().rss
+            except psutil.NoSuchProcess:
+                self.processes.pop(process.pid, None)
+        self.cpu.append(cpu)
+        self.rss.append(rss / 2 ** 20)
+
+    def reset(self):
+        self.cpu.clear()
+        self.rss.clear()
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+async def measure(
+        app_port: int, cameras: Dict[str, dict], viewers: int, args, sampler: ProcessTreeSampler
+) -> dict:
+    """ M зрителей по камерам по кругу: разогрев, затем замер в течение args.duration секунд """
+    camera_keys = list(cameras)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        clients = []
+        tasks = []
+        for i in range(viewers):
+            camera_key = camera_keys[i % len(camera_keys)]
+            viewer = Viewer(camera_key, cameras[camera_key]['kind'] != 'file', args.latency_interval)
+            url = f'http://127.0.0.1:{app_port}/video_feed/{camera_key}?q={args.quality}'
+            clients.append(viewer)
+            tasks.append(asyncio.create_task(viewer.watch(session, url)))
+        await asyncio.sleep(args.warmup)
+        for viewer in clients:
+            viewer.reset()
+        sampler.reset()
+        started = time.monotonic()
+        while time.monotonic() - started < args.duration:
+            await asyncio.sleep(1)
+            sampler.sample()
+        elapsed = time.monotonic() - started
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    fps = [viewer.frames / elapsed for viewer in clients]
+    latencies = [latency for viewer in clients for latency in viewer.latencies]
+    return {
+        'cameras': len(cameras),
+        'viewers': viewers,
+        'kinds': sorted({config['kind'] for config in cameras.values()}),
+        'seconds': elapsed,
+        'viewer_fps_mean': sum(fps) / len(fps) if fps else None,
+        'viewer_fps_min': min(fps) if fps else None,
+        'latency_p50_ms': _percentile(latencies, 50) * 1000 if latencies else None,
+        'latency_p99_ms': _percentile(latencies, 99) * 1000 if latencies else None,
+        'latency_samples': len(latencies),
+        'unreadable_frames': sum(viewer.unreadable for viewer in clients),
+        'viewer_errors': sum(viewer.errors for viewer in clients),
+        'cpu_percent_mean': sum(sampler.cpu) / len(sampler.cpu) if sampler.cpu else None,
+        'cpu_percent_max': max(sampler.cpu, default=None),
+        'rss_mb_max': max(sampler.rss, default=None),
+    }
+
+
+def wait_ready(port: int, app: subprocess.Popen, timeout: float = 60):
+    """ Ожидание, пока приложение начнёт отвечать """
+    import urllib.error
+    import urllib.request
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if app.poll() is not None:
+            raise SystemExit(f'Приложение завершилось с кодом {app.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/streams', timeout=1).close()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise SystemExit(f'Приложение не ответило за {timeout:.0f} с')
+
+
+def stop_app(app: subprocess.Popen):
+    """ Как Ctrl+C: приложение дописывает записи и останавливает процессы """
+    app.send_signal(signal.SIGINT)
+    try:
+        app.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        app.kill()
+        app.wait()
+
+
+def check_model(config: dict):
+    """ Файлы модели, с которыми запустится приложение, должны быть на месте (пути - как в settings.py) """
+    environment = child_environment(config, '', '')
+    missing = [
+        f'{name}={environment[name]}' for name in ('AI_MODEL', 'PROTO_TXT') if not (BASE_DIR / environment[name]).exists()
+    ]
+    if missing:
+        raise SystemExit(f'Нет файлов модели детектора: {", ".join(missing)}. '
+                         f'Укажите пути в .env или через --set AI_MODEL=... --set PROTO_TXT=...')
+
+
+def run_load_test(args) -> dict:
+    config = dict(item.split('=', 1) for item in args.set or [])
+    check_model(config)
+    kinds = args.kinds
+    work_dir = tempfile.mkdtemp(prefix='camera-load-')
+    camera_port = free_port()
+    ready = multiprocessing.Event()
+    camera_server = multiprocessing.Process(
+        target=serve_cameras,
+        args=(camera_port, max(args.cameras), args.width, args.height, args.camera_fps, ready),
+        name='Fake_Cameras',
+        daemon=True,
+    )
+    camera_server.start()
+    if not ready.wait(30):
+        raise SystemExit('Имитации камер не запустились')
+    video_path = os.path.join(work_dir, 'camera.avi')
+    if 'file' in kinds:
+        write_file_camera(video_path, args.width, args.height, args.camera_fps)
+
+    if 'mjpeg' in kinds:
+        # MJPEG-поток читает только общий опрос HTTP-камер
+        config.setdefault('HTTP_INGEST_MODE', 'engine')
+
+    results = []
+    try:
+        for count in args.cameras:
+            cameras = camera_config(count, kinds, camera_port, video_path, args.camera_fps)
+            cameras_json = os.path.join(work_dir, f'cameras_{count}.json')
+            with open(cameras_json, 'w') as f:
+                json.dump({key: {k: v for k, v in value.items() if k != 'kind'} for key, value in cameras.items()}, f)
+            app_port = free_port()
+            environment = child_environment(config, os.path.join(work_dir, f'archive_{count}'), cameras_json)
+            environment['PORT'] = str(app_port)
+            with open(os.path.join(work_dir, f'app_{count}.log'), 'w') as log:
+                app = subprocess.Popen(
+                    [sys.executable, str(BASE_DIR / 'src' / 'main.py')],
+                    cwd=BASE_DIR,
+                    env=environment,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                )
+                try:
+                    wait_ready(app_port, app)
+                    sampler = ProcessTreeSampler(app.pid)
+                    for viewers in args.viewers:
+                        result = asyncio.run(measure(app_port, cameras, viewers, args, sampler))
+                        result['config'] = config
+                        results.append(result)
+                        print(_summary(result), file=sys.stderr)
+                finally:
+                    stop_app(app)
+    finally:
+        camera_server.terminate()
+        if args.keep:
+            print(f'Файлы прогона: {work_dir}', file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'created': time.time(),
+        'cpu_count': os.cpu_count(),
+        'camera_resolution': [args.width, args.height],
+        'camera_fps': args.camera_fps,
+        'quality': args.quality,
+        'results': results,
+    }
+
+
+def _format(value, pattern: str) -> str:
+    return '-' if value is None else pattern.format(value)
+
+
+def _summary(result: dict) -> str:
+    return (f"камер {result['cameras']}, зрителей {result['viewers']}: "
+            f"{_format(result['viewer_fps_mean'], '{:.1f}')} кадр/с у зрителя "
+            f"(мин. {_format(result['viewer_fps_min'], '{:.1f}')}), "
+            f"задержка p50/p99 {_format(result['latency_p50_ms'], '{:.0f}')}/"
+            f"{_format(result['latency_p99_ms'], '{:.0f}')} мс, "
+            f"процессор {_format(result['cpu_percent_mean'], '{:.0f}')}%, "
+            f"память {_format(result['rss_mb_max'], '{:.0f}')} Мб")
+
+
+def _numbers(value: str) -> List[int]:
+    return [int(item) for item in value.split(',')]
+
+
+def _kinds(value: str) -> List[str]:
+    kinds = value.split(',')
+    for kind in kinds:
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f'неизвестный вид камеры {kind}, возможны: {", ".join(KINDS)}')
+    return kinds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест: имитации камер и зрителей')
+    parser.add_argument('--cameras', type=_numbers, default=[4], help='числа камер через запятую')
+    parser.add_argument('--viewers', type=_numbers, default=[0, 10], help='числа зрителей через запятую')
+    parser.add_argument('--kinds', type=_kinds, default=['snapshot', 'mjpeg'],
+                        help=f'виды камер по кругу: {", ".join(KINDS)}')
+    parser.add_argument('--width', type=int, default=1280, help='ширина кадра камер')
+    parser.add_argument('--height', type=int, default=720, help='высота кадра камер')
+    parser.add_argument('--camera-fps', type=float, default=5, help='кадров в секунду у камер')
+    parser.add_argument('--quality', default='standard', help='вариант потока у зрителей (?q=)')
+    parser.add_argument('--warmup', type=float, default=10, help='разогрев перед замером, секунд')
+    parser.add_argument('--duration', type=float, default=30, help='длительность замера, секунд')
+    parser.add_argument('--latency-interval', type=float, default=1,
+                        help='как часто зритель читает время съёмки из кадра, секунд')
+    parser.add_argument('--set', action='append', metavar='NAME=VALUE', help='переменная окружения приложения')
+    parser.add_argument('--output', help='файл для JSON с результатами (по умолчанию - stdout)')
+    parser.add_argument('--keep', action='store_true', help='не удалять файлы прогона (журналы приложения)')
+    args = parser.parse_args()
+
+    results = run_load_test(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,35 @@
 import time
 
-from flask import Response, Flask, render_template, jsonify
-from multiprocessing import Process, Manager
+from flask import Response, Flask, render_template, jsonify, request, send_file, url_for
+from multiprocessing import Process, Manager, Queue
 from flask_cors import CORS
 
 import settings
+from archive_index import ArchiveCatalog, VIDEO_MIMETYPES
+from broadcaster import BroadcastHub
+from detection_store import DetectionCatalog
+from frame_bus import FrameBus
 from handlers.archive_handler import ArchiveHandler
+from handlers.http_ingest import HTTPIngestEngine
 from handlers.http_video_handler import HTTPVideoHandler
 from handlers.video_handler import VideoHandler
-from services import get_resource_usage, is_running_in_docker, get_container_resource_usage
+from inference_service import InferenceService
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, collect_viewers, render_prometheus
+from renditions import STANDARD, load_renditions, rendition_key, resolve_rendition, slot_sizes
+from resource_sampler import ResourceSampler
+from scheduler import WorkerSupervisor
+from services import collect_resources, get_resource_usage, parse_time
+from thumbnails import PREVIEW_KINDS, read_preview
 from settings import cameras, additional_cameras
 
 
 app: Flask = Flask(__name__)
 CORS(app)
+archive_catalog = ArchiveCatalog(settings.save_path, settings.archive_index_path) if settings.archive_index_path else None
+renditions = load_renditions()
+detection_catalog = DetectionCatalog(settings.detection_store_path) if settings.detection_store_path else None
+supervisor = None  # распределение камер по процессам-обработчикам (WORKER_PROCESSES > 0)
+resource_sampler = None  # фоновый замер загрузки процессов для /resources
 
 
 @app.route('/')
@@ -30,39 +46,176 @@ def video_feed(camera_key) -> Response:
     camera_source = cameras.get(camera_key) # Получаем источник камеры
     if not camera_source:
         return "Camera not found", 404  # Если камера не найдена, возвращаем 404
+    # Вариант потока: ?q=grid (плитка), standard (по умолчанию), full (исходное разрешение);
+    # ненастроенный вариант заменяется на standard
+    quality = resolve_rendition(request.args.get('q', STANDARD), renditions)
     return Response(
-        generate(camera_key, last_frame),
+        generate(rendition_key(camera_key, quality), broadcast_hub),
         mimetype="multipart/x-mixed-replace; boundary=frame",
     )
 
 
 @app.route('/resources')
 def resources():
-    if is_running_in_docker():
-        return jsonify(get_container_resource_usage())
-    else:
-        resource_usage = get_resource_usage(processes)
-    return jsonify(resource_usage)
+    # ?window=секунд - история замеров для графиков
+    window = request.args.get('window', type=float)
+    return jsonify(collect_resources(processes, camera_stats, resource_sampler, window))
 
 
-def generate(camera_key, shared_last_frame: dict):
-    frame_data = None
-    while True:
-        new_frame_data = shared_last_frame.get(camera_key)
-        if frame_data != new_frame_data:
-            frame_data = new_frame_data
-            if frame_data:  # Проверяем, есть ли данные кадра
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-        time.sleep(1 / 15)
+@app.route('/metrics')
+def metrics_view():
+    # Длительность этапов обработки, счётчики кадров и зрители в формате Prometheus
+    viewers = collect_viewers(cameras.keys(), broadcast_hub.viewers(), renditions)
+    return Response(render_prometheus(dict(camera_stats), viewers), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/workers')
+def workers():
+    # Процессы с размещением камер, привязкой к ядрам и измеренной нагрузкой
+    placement = supervisor.describe() if supervisor else None
+    sample = resource_sampler.latest() if resource_sampler else None
+    return jsonify(get_resource_usage(processes, summary=False, placement=placement, sample=sample))
+
+
+@app.route('/archive/stats')
+def archive_stats_view():
+    # Занятость архива и прогноз заполнения по камерам (обновляет процесс архива)
+    return jsonify(dict(archive_stats))
+
+
+@app.route('/archive/<camera_key>/clips')
+def archive_clips(camera_key):
+    if archive_catalog is None:
+        return "Archive index is disabled", 404
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+    except ValueError:
+        return "Invalid time range", 400
+    clips = archive_catalog.list_clips(camera_key, start, end, request.args.get('limit', 1000, type=int))
+    for clip in clips:
+        clip['url'] = url_for('archive_clip', clip_id=clip['id'])
+    return jsonify(clips)
+
+
+@app.route('/archive/clips/<int:clip_id>')
+def archive_clip(clip_id):
+    # Range-запросы, ETag и Last-Modified обрабатывает send_file
+    clip = archive_catalog.get_clip(clip_id) if archive_catalog else None
+    path = archive_catalog.clip_path(clip) if clip else None
+    if path is None or not path.exists():
+        return "Clip not found", 404
+    return send_file(
+        path,
+        mimetype=VIDEO_MIMETYPES.get(path.suffix),
+        conditional=True,
+        etag=True,
+        last_modified=clip['mtime'],
+        max_age=3600,
+    )
+
+
+@app.route('/archive/clips/<int:clip_id>/<kind>.jpg')
+def archive_clip_preview(clip_id, kind):
+    # Постер (poster) или лист миниатюр (sheet) записи
+    clip = archive_catalog.get_clip(clip_id) if archive_catalog and kind in PREVIEW_KINDS else None
+    path = archive_catalog.clip_path(clip) if clip else None
+    preview = read_preview(path, kind) if path else None
+    if preview is None:
+        return "Preview not found", 404
+    data, mtime = preview
+    response = Response(data, mimetype='image/jpeg')
+    response.set_etag(f'{clip_id}-{kind}-{int(mtime)}')
+    response.last_modified = mtime
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request)
+
+
+@app.route('/detections')
+def detections():
+    # Записи с найденными объектами: /detections?camera=...&class=person&start=...&end=...
+    if detection_catalog is None:
+        return "Detection store is disabled", 404
+    try:
+        start = parse_time(request.args.get('start'))
+        end = parse_time(request.args.get('end'))
+    except ValueError:
+        return "Invalid time range", 400
+    clips = detection_catalog.find_clips(
+        camera=request.args.get('camera'),
+        label=request.args.get('class'),
+        start=start,
+        end=end,
+        min_confidence=request.args.get('min_confidence', 0, type=float),
+        limit=request.args.get('limit', 100, type=int),
+    )
+    clip_ids = archive_catalog.clip_ids(clip['clip'] for clip in clips if clip['clip']) if archive_catalog else {}
+    for clip in clips:
+        clip['clip_id'] = clip_ids.get(clip['clip'])
+        clip['url'] = url_for('archive_clip', clip_id=clip['clip_id']) if clip['clip_id'] else None
+    return jsonify(clips)
+
+
+@app.route('/detections/<camera_key>')
+def camera_detections(camera_key):
+    # Отдельные детекции камеры за интервал, по умолчанию - за последний час
+    if detection_catalog is None:
+        return "Detection store is disabled", 404
+    try:
+        end = parse_time(request.args.get('end')) or time.time()
+        start = parse_time(request.args.get('start')) or end - 3600
+    except ValueError:
+        return "Invalid time range", 400
+    return jsonify(detection_catalog.find_detections(
+        camera_key, start, end, request.args.get('limit', 1000, type=int)
+    ))
+
+
+@app.route('/streams')
+def streams():
+    # Подписчики потоков и их отставание по камерам
+    return jsonify(broadcast_hub.stats())
+
+
+def generate(camera_key, hub: BroadcastHub):
+    subscriber = hub.subscribe(camera_key)
+    try:
+        while True:
+            chunk = subscriber.get(timeout=1)  # Готовый multipart-фрагмент от рассыльщика камеры
+            if chunk:
+                yield chunk
+    finally:
+        hub.unsubscribe(subscriber)
 
 
 if __name__ == '__main__':
     with Manager() as manager:
-        last_frame = manager.dict()  # Используем словарь для кэширования последних кадров
+        # Последние кадры камер хранятся в разделяемой памяти
+        sizes = slot_sizes(cameras.keys())  # все варианты потока всех камер
+        last_frame = FrameBus.create(sizes.keys(), sizes)
+        broadcast_hub = BroadcastHub(last_frame, settings.stream_queue_size)
         running = manager.Value('i', 1)
+        camera_stats = manager.dict()  # Статистика камер, обновляется раз в секунду
         # Запуск процесса проверки размера архива
-        archive_handler = ArchiveHandler(settings.save_path, settings.max_archive_size_gb)
+        archive_events = Queue()  # Закрытые записи для индекса архива
+        archive_stats = manager.dict()
+        archive_handler = ArchiveHandler(
+            settings.save_path,
+            settings.max_archive_size_gb,
+            low_watermark_gb=settings.archive_low_watermark_gb,
+            index_path=settings.archive_index_path,
+            events=archive_events,
+            reconcile_interval=settings.archive_reconcile_interval,
+            quotas={
+                camera_key: {
+                    'quota_gb': config.get('quota_gb'),
+                    'max_age_days': config.get('max_age_days'),
+                }
+                for camera_key, config in settings.camera_configs.items()
+            },
+            stats=archive_stats,
+        )
         archive_process = Process(
             # target=asyncio.run,
             # args=(archive_handler.check_archive(),),
@@ -73,6 +226,19 @@ if __name__ == '__main__':
         print(f"Started {archive_process.name}")
 
         processes = []
+        inference_service = None
+        if settings.inference_mode == 'service':
+            # Одна модель на все камеры, кадры обрабатываются пакетами
+            inference_service = InferenceService(
+                cameras.keys(),
+                max_batch=settings.inference_max_batch,
+                max_wait=settings.inference_max_wait_ms / 1000,
+            )
+            inference_process = Process(target=inference_service.run, name='Inference_Process')
+            inference_process.start()
+            print(f'Started {inference_process.name}')
+            processes.append(inference_process)
+
         # Old version before refactor (12.05.2024)
         # for camera_key, camera_source in cameras.items():
         #     # Для каждой камеры создаём отдельный процесс
@@ -85,18 +251,47 @@ if __name__ == '__main__':
         #     print(f'Started process {p.name}')
         #     processes.append(p)
 
+        http_handlers = []
+        worker_handlers = {}
         for camera_key, camera_source in cameras.items():
+            inference_client = inference_service.client(camera_key) if inference_service else None
+            camera_config = settings.camera_configs[camera_key]
             # Создаем объект для каждой камеры
-            if camera_source.startswith('rtsp'):
-                video_processor = VideoHandler(camera_key, camera_source, last_frame, running)
+            if not camera_source.startswith('http'):  # RTSP, видеофайл и другие источники OpenCV
+                video_processor = VideoHandler(
+                    camera_key,
+                    camera_source,
+                    last_frame,
+                    running,
+                    inference_client=inference_client,
+                    stats=camera_stats,
+                    archive_events=archive_events,
+                    record_source=camera_config.get('record'),
+                    live_source=camera_config.get('live'),
+                )
             elif camera_source.startswith('http'):
                 video_processor = HTTPVideoHandler(
                     camera_key,
                     camera_source,
                     last_frame,
                     running,
-                    interval = settings.http_request_interval
+                    interval = camera_config.get('interval', settings.http_request_interval),
+                    inference_client=inference_client,
+                    stats=camera_stats,
+                    archive_events=archive_events,
+                    timeout=camera_config.get('timeout', settings.http_request_timeout),
+                    record_source=camera_config.get('record'),
+                    live_source=camera_config.get('live'),
                 )
+                if settings.http_ingest_mode == 'engine':
+                    # Опрашивается вместе с остальными HTTP-камерами в одном процессе
+                    http_handlers.append(video_processor)
+                    continue
+
+            if settings.worker_processes > 0:
+                # Камеры распределяются по процессам-обработчикам ниже
+                worker_handlers[camera_key] = video_processor
+                continue
 
             # Для каждой камеры создаём отдельный процесс
             p = Process(
@@ -107,12 +302,45 @@ if __name__ == '__main__':
             print(f'Started process {p.name}')
             processes.append(p)
 
+        if worker_handlers:
+            supervisor = WorkerSupervisor(worker_handlers, running, processes, camera_stats)
+            supervisor.start()
+
+        if http_handlers:
+            p = Process(target=HTTPIngestEngine(http_handlers, running).run, name='HTTP_Ingest_Process')
+            p.start()
+            print(f'Started process {p.name}')
+            processes.append(p)
+
+        resource_sampler = ResourceSampler(processes)
+        resource_sampler.start()
+
         try:
-            app.run(host='0.0.0.0', port=settings.port, debug=False, threaded=True, use_reloader=False)
+            if settings.server_mode == 'async':
+                # aiohttp нужен только в этом режиме
+                from async_server import run_async_server
+                run_async_server(
+                    broadcast_hub,
+                    processes,
+                    camera_stats,
+                    archive_stats,
+                    settings.port,
+                    supervisor,
+                    resource_sampler,
+                )
+            else:
+                app.run(host='0.0.0.0', port=settings.port, debug=False, threaded=True, use_reloader=False)
         except KeyboardInterrupt:
             pass  # Обработка выхода по Ctrl+C
         finally:
             running.value = 0  # Завершение процессов
+            resource_sampler.stop()
+            if inference_service:
+                inference_service.stop()
             for p in processes:
                 p.join()
                 p.terminate()
+            if inference_service:
+                inference_service.close()
+            broadcast_hub.stop()
+            last_frame.close()
@@ -0,0 +1,143 @@
+"""
+Метрики конвейера обработки кадров.
+
+Каждая камера ведёт свои гистограммы длительности этапов (захват,
+движение, детекция, кодирование, запись) и счётчики кадров. Пишет в
+них только поток камеры (длительность записи на диск - поток записи,
+выброшенные из очереди записи кадры - под блокировкой записи), поэтому
+отдельные блокировки не нужны. Снимок метрик публикуется вместе со
+статистикой камеры, а веб-процесс отдаёт их в текстовом формате
+Prometheus на /metrics.
+"""
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List
+
+from renditions import rendition_key
+
+# Границы корзин гистограмм, секунды (как в клиенте Prometheus)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Этапы обработки кадра
+STAGES = ('capture', 'decode', 'motion', 'resize', 'detection', 'recording', 'encode', 'write')
+# Счётчики кадров
+COUNTERS = ('captured', 'skipped', 'analysed', 'recorded', 'dropped')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """ Гистограмма длительностей; counts - по корзинам без накопления, последняя - +Inf """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class PipelineMetrics:
+    """ Метрики одной камеры """
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {stage: Histogram() for stage in STAGES}
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+
+    def observe(self, stage: str, started: float) -> float:
+        """
+        Длительность этапа от started (time.perf_counter()) до текущего момента.
+
+        Returns:
+            текущий момент - начало следующего этапа
+        """
+        now = time.perf_counter()
+        self.stages[stage].observe(now - started)
+        return now
+
+    def count(self, counter: str, value: int = 1):
+        self.counters[counter] += value
+
+    def snapshot(self) -> dict:
+        """ Для общего словаря статистики камер """
+        return {
+            'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items() if histogram.count},
+            'counters': dict(self.counters),
+        }
+
+
+def _labels(**labels) -> str:
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(camera_stats: dict, viewers: Dict[str, Dict[str, int]]) -> str:
+    """
+    Метрики всех камер в текстовом формате Prometheus.
+
+    Args:
+        camera_stats: статистика камер (снимок общего словаря), метрики - в ключе 'metrics'
+        viewers: зрители по камерам и вариантам потока {камера: {вариант: число}}
+    """
+    lines: List[str] = [
+        '# HELP camera_stage_duration_seconds Длительность этапа обработки кадра',
+        '# TYPE camera_stage_duration_seconds histogram',
+    ]
+    for camera_key, stats in sorted(camera_stats.items()):
+        for stage, histogram in sorted(stats.get('metrics', {}).get('stages', {}).items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (None,), histogram['counts']):
+                cumulative += count
+                le = '+Inf' if bound is None else repr(bound)
+                lines.append(
+                    f'camera_stage_duration_seconds_bucket{{{_labels(camera=camera_key, stage=stage, le=le)}}} '
+                    f'{cumulative}'
+                )
+            labels = _labels(camera=camera_key, stage=stage)
+            lines.append(f'camera_stage_duration_seconds_sum{{{labels}}} {_format_number(histogram["sum"])}')
+            lines.append(f'camera_stage_duration_seconds_count{{{labels}}} {histogram["count"]}')
+
+    lines += [
+        '# HELP camera_frames_total Кадры камеры по результату обработки',
+        '# TYPE camera_frames_total counter',
+    ]
+    for camera_key, stats in sorted(camera_stats.items()):
+        for counter, value in sorted(stats.get('metrics', {}).get('counters', {}).items()):
+            lines.append(f'camera_frames_total{{{_labels(camera=camera_key, result=counter)}}} {value}')
+
+    lines += [
+        '# HELP camera_load Доля ядра, занятая обработкой кадров камеры',
+        '# TYPE camera_load gauge',
+    ]
+    for camera_key, stats in sorted(camera_stats.items()):
+        if 'load' in stats:
+            lines.append(f'camera_load{{{_labels(camera=camera_key)}}} {_format_number(stats["load"])}')
+
+    lines += [
+        '# HELP camera_viewers Зрители живого потока камеры',
+        '# TYPE camera_viewers gauge',
+    ]
+    for camera_key, renditions in sorted(viewers.items()):
+        for rendition, count in sorted(renditions.items()):
+            lines.append(f'camera_viewers{{{_labels(camera=camera_key, rendition=rendition)}}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def collect_viewers(camera_keys: Iterable[str], stream_viewers: Dict[str, int], rendition_names: Iterable[str]):
+    """ Зрители по камерам и вариантам из числа зрителей по ключам шины кадров """
+    return {
+        camera_key: {name: stream_viewers.get(rendition_key(camera_key, name), 0) for name in rendition_names}
+        for camera_key in camera_keys
+    }
@@ -0,0 +1,116 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+import settings
+
+Box = Tuple[int, int, int, int]  # x, y, w, h в координатах исходного кадра
+
+
+class FrameDiffMotionDetector:
+    """ Разница с предыдущим кадром в полном разрешении (исходный алгоритм) """
+
+    def __init__(self, min_area: int):
+        self.min_area = min_area
+        self.previous_gray_frame = None
+
+    @staticmethod
+    def _frame_to_gray(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (21, 21), 0)
+        return gray
+
+    def detect(self, frame) -> Tuple[bool, List[Box]]:
+        gray = self._frame_to_gray(frame)
+
+        # В первый раз устанавливаем доминантный кадр
+        if self.previous_gray_frame is None:
+            self.previous_gray_frame = gray
+            return False, []
+
+        frame_delta = cv2.absdiff(self.previous_gray_frame, gray)
+        thresh = cv2.threshold(frame_delta, 25, 255, cv2.THRESH_BINARY)[1]
+        thresh = cv2.dilate(thresh, None, iterations=2)
+
+        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        if contours is not None:
+            for contour in contours:
+                contour_area = cv2.contourArea(contour)
+                if contour_area < self.min_area:  # можно регулировать размер области детектирования
+                    return bool(boxes), boxes
+                boxes.append(cv2.boundingRect(contour))
+        self.previous_gray_frame = gray
+        return bool(boxes), boxes
+
+
+class BackgroundMotionDetector:
+    """
+    Движение относительно модели фона на уменьшенной копии кадра.
+
+    method: running_average - скользящее среднее (cv2.accumulateWeighted),
+            mog2 - смесь гауссиан (cv2.createBackgroundSubtractorMOG2).
+    Зоны движения отбираются по площади векторно (connectedComponentsWithStats)
+    и масштабируются обратно к разрешению исходного кадра.
+    """
+
+    def __init__(self, min_area: int, method: str = 'running_average', width: int = 320, learning_rate: float = 0.05):
+        self.min_area = min_area
+        self.method = method
+        self.width = width
+        self.learning_rate = learning_rate
+        self.background = None
+        self.subtractor = None
+        if method == 'mog2':
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=500, detectShadows=True)
+
+    def _mask(self, gray):
+        if self.subtractor is not None:
+            mask = self.subtractor.apply(gray, learningRate=self.learning_rate)
+            # Тени MOG2 помечает значением 127, движением их не считаем
+            return cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)[1]
+
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+            return None
+        frame_delta = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+        return cv2.threshold(frame_delta, 25, 255, cv2.THRESH_BINARY)[1]
+
+    def detect(self, frame) -> Tuple[bool, List[Box]]:
+        frame_height, frame_width = frame.shape[:2]
+        scale = min(1.0, self.width / frame_width)
+        if scale < 1.0:
+            small = cv2.resize(frame, (self.width, int(frame_height * scale)), interpolation=cv2.INTER_AREA)
+        else:
+            small = frame
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+        mask = self._mask(gray)
+        if mask is None:
+            return False, []
+        mask = cv2.dilate(mask, None, iterations=2)
+
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        stats = stats[1:]  # нулевая компонента - фон
+        # Площадь задана для исходного разрешения, переводим её в масштаб уменьшенного кадра
+        stats = stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area * scale * scale]
+        boxes = np.rint(stats[:, :4] / scale).astype(int)
+        return len(boxes) > 0, [tuple(box) for box in boxes.tolist()]
+
+
+def create_motion_detector():
+    """ Детектор движения по настройке MOTION_ENGINE (diff, running_average, mog2) """
+    engine = settings.motion_engine
+    if engine in ('running_average', 'mog2'):
+        return BackgroundMotionDetector(
+            settings.min_detection_aria,
+            method=engine,
+            width=settings.motion_width,
+            learning_rate=settings.motion_learning_rate,
+        )
+    if engine != 'diff':
+        print(f'Неизвестный MOTION_ENGINE={engine}, используется diff')
+    return FrameDiffMotionDetector(settings.min_detection_aria)
@@ -0,0 +1,198 @@
+"""
+Запись потока камеры без перекодирования.
+
+Сжатые пакеты камеры перепаковываются (remux) в файлы-сегменты MP4/MKV,
+границы сегментов совпадают с ключевыми кадрами. Детектор только отмечает
+моменты активности; сегменты без активности удаляются после закрытия.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import av
+
+from video_writer import AsyncVideoWriter
+
+
+class PassthroughRecorder(threading.Thread):
+    def __init__(
+            self,
+            camera_key: str,
+            source: str,
+            segment_seconds: float = 60,
+            container_format: str = 'mp4',
+            keep_margin: float = 10,
+            keep_all: bool = False,
+            on_segment_kept: Optional[Callable[[str], None]] = None,
+            on_segment_removed: Optional[Callable[[str], None]] = None,
+            reconnect_delay: float = 60,
+    ):
+        """
+        Args:
+            segment_seconds: длительность сегмента (по времени потока)
+            container_format: mp4 или mkv
+            keep_margin: сегмент сохраняется, если активность была не дальше keep_margin
+                секунд от его границ (запись до и после события)
+            keep_all: сохранять все сегменты (для проверки на локальном файле)
+            on_segment_kept: вызывается с путём сохранённого сегмента
+            on_segment_removed: вызывается с путём удалённого сегмента (сверка индекса архива)
+        """
+        super().__init__(name=f'Passthrough_{camera_key}', daemon=True)
+        self.camera_key = camera_key
+        self.source = source
+        self.segment_seconds = segment_seconds
+        self.container_format = container_format
+        self.keep_margin = keep_margin
+        self.keep_all = keep_all
+        self.on_segment_kept = on_segment_kept
+        self.on_segment_removed = on_segment_removed
+        self.reconnect_delay = reconnect_delay
+
+        self.lock = threading.Lock()
+        self.activity = deque()  # моменты активности (time.time())
+        self.pending = []  # закрытые сегменты, ожидающие решения: (путь, начало, конец)
+        self._stopped = threading.Event()
+
+        self.output = None
+        self.output_stream = None
+        self.segment_path = None
+        self.segment_start = 0.0
+        self.segment_stream_start = 0.0
+        self.timestamp_offset = 0
+
+        self.segments_kept = 0
+        self.segments_deleted = 0
+
+    def mark_activity(self, timestamp: float = None):
+        """ Детектор сообщает, что в этот момент было событие """
+        with self.lock:
+            self.activity.append(time.time() if timestamp is None else timestamp)
+
+    def position(self):
+        """ Текущий сегмент и смещение в нём (мс); (None, None) до первого ключевого кадра """
+        path, start = self.segment_path, self.segment_start
+        if self.output is None or path is None:
+            return None, None
+        return path, int((time.time() - start) * 1000)
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout=10)
+
+    def _open_input(self):
+        options = {}
+        if self.source.startswith('rtsp'):
+            options['rtsp_transport'] = 'tcp'
+        return av.open(self.source, options=options, timeout=10)
+
+    def _open_segment(self, input_stream, packet):
+        # Короткий GOP или быстрое переподключение открывают сегменты чаще раза в секунду
+        self.segment_path = AsyncVideoWriter.get_filename(
+            self.camera_key, extension=self.container_format, prefix='s', precise=True
+        )
+        self.output = av.open(self.segment_path, 'w', format=self.container_format)
+        if hasattr(self.output, 'add_stream_from_template'):
+            self.output_stream = self.output.add_stream_from_template(input_stream)
+        else:
+            self.output_stream = self.output.add_stream(template=input_stream)
+        self.segment_start = time.time()
+        self.segment_stream_start = float(packet.dts * input_stream.time_base)
+        # Каждый сегмент начинается с нулевой метки времени
+        self.timestamp_offset = packet.dts
+
+    def _close_segment(self):
+        if self.output is None:
+            return
+        try:
+            self.output.close()
+        except av.error.FFmpegError as e:
+            print(f'Ошибка закрытия сегмента {self.segment_path}: {e}')
+        with self.lock:
+            self.pending.append((self.segment_path, self.segment_start, time.time()))
+        self.output = None
+        self.output_stream = None
+
+    def _decide_segments(self, force: bool = False):
+        """ Оставляем сегменты с активностью, остальные удаляем """
+        now = time.time()
+        with self.lock:
+            ready = [segment for segment in self.pending if force or segment[2] + self.keep_margin < now]
+            self.pending = [segment for segment in self.pending if segment not in ready]
+            activity = list(self.activity)
+            if self.pending:
+                horizon = min(start for _, start, _ in self.pending) - self.keep_margin
+            else:
+                horizon = now - self.keep_margin
+            while self.activity and self.activity[0] < horizon:
+                self.activity.popleft()
+
+        for path, start, end in ready:
+            keep = self.keep_all or any(
+                start - self.keep_margin <= moment <= end + self.keep_margin for moment in activity
+            )
+            if keep:
+                self.segments_kept += 1
+                if self.on_segment_kept is not None:
+                    self.on_segment_kept(path)
+            else:
+                try:
+                    os.remove(path)
+                    self.segments_deleted += 1
+                except OSError as e:
+                    print(f'Не удалось удалить сегмент {path}: {e}')
+                    continue
+                if self.on_segment_removed is not None:
+                    self.on_segment_removed(path)
+
+    def _record(self):
+        container = self._open_input()
+        try:
+            input_stream = container.streams.video[0]
+            print(f'Камера {self.camera_key}: запись без перекодирования ({input_stream.codec_context.name})')
+            for packet in container.demux(input_stream):
+                if self._stopped.is_set():
+                    break
+                if packet.dts is None:
+                    continue
+                stream_time = float(packet.dts * input_stream.time_base)
+                # Новый сегмент начинается только с ключевого кадра
+                if packet.is_keyframe and (
+                        self.output is None or stream_time - self.segment_stream_start >= self.segment_seconds
+                ):
+                    self._close_segment()
+                    self._open_segment(input_stream, packet)
+                if self.output is None:
+                    continue  # ждём первый ключевой кадр
+                packet.dts -= self.timestamp_offset
+                if packet.pts is not None:
+                    packet.pts -= self.timestamp_offset
+                packet.stream = self.output_stream
+                self.output.mux(packet)
+                self._decide_segments()
+        finally:
+            self._close_segment()
+            container.close()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._record()
+            except av.error.FFmpegError as e:
+                print(f'Камера {self.camera_key}: ошибка записи без перекодирования: {e}')
+            if self._stopped.is_set() or os.path.isfile(self.source):
+                break  # видеофайл записан до конца - переподключаться некуда
+            print(f'Камера {self.camera_key}: переподключение записи через {self.reconnect_delay} секунд')
+            self._stopped.wait(self.reconnect_delay)
+        self._decide_segments(force=True)
+
+    def stats(self) -> dict:
+        return {
+            'segment': self.segment_path,
+            'pending': len(self.pending),
+            'segments_kept': self.segments_kept,
+            'segments_deleted': self.segments_deleted,
+        }
+
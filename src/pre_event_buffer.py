@@ -0,0 +1,61 @@
+import sys
+import time
+from collections import deque
+from typing import List, Tuple
+
+
+class PreEventBuffer:
+    """
+    Кольцевой буфер уже закодированных (JPEG) кадров камеры.
+
+    Хранит кадры за последние seconds секунд, но не больше max_bytes памяти.
+    При начале записи содержимое буфера сбрасывается в новый файл, поэтому
+    запись начинается раньше срабатывания детектора.
+    """
+
+    def __init__(self, seconds: float, max_bytes: int):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.frames = deque()  # (timestamp, jpeg bytes, учтённый размер)
+        self.memory_bytes = 0
+        self.evicted = 0
+        self.flushed = 0
+
+    @staticmethod
+    def _entry_size(entry: tuple) -> int:
+        # Сам объект bytes, кортеж записи и float метки времени
+        return sys.getsizeof(entry[1]) + sys.getsizeof(entry) + sys.getsizeof(entry[0])
+
+    def append(self, data: bytes, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.time()
+        entry = (timestamp, data)
+        size = self._entry_size(entry)
+        self.frames.append(entry + (size,))
+        self.memory_bytes += size
+        self._evict(timestamp)
+
+    def _evict(self, now: float):
+        while self.frames and (now - self.frames[0][0] > self.seconds or self.memory_bytes > self.max_bytes):
+            _, _, size = self.frames.popleft()
+            self.memory_bytes -= size
+            self.evicted += 1
+
+    def drain(self) -> List[Tuple[float, bytes]]:
+        """ Забрать все кадры (от старых к новым) и очистить буфер """
+        self._evict(time.time())
+        frames = [(timestamp, data) for timestamp, data, _ in self.frames]
+        self.frames.clear()
+        self.memory_bytes = 0
+        self.flushed += len(frames)
+        return frames
+
+    def stats(self) -> dict:
+        return {
+            'frames': len(self.frames),
+            'memory_bytes': self.memory_bytes,
+            'max_bytes': self.max_bytes,
+            'seconds': self.frames[-1][0] - self.frames[0][0] if self.frames else 0.0,
+            'evicted': self.evicted,
+            'flushed': self.flushed,
+        }
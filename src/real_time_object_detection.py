@@ -1,4 +1,5 @@
-from typing import Tuple, Any
+import threading
+from typing import Tuple, Any, List, NamedTuple
 
 import cv2
 import numpy as np
@@ -12,17 +13,56 @@ CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
 IGNORE_CLASSES = ['bottle', 'boat', 'train', 'bus', 'aeroplane', 'diningtable', 'chair', 'tvmonitor']
 COLORS = np.random.uniform(0, 255, size=(len(CLASSES), 3))
 
-print("[INFO] loading model...")
-net = cv2.dnn.readNetFromCaffe(proto_txt, ai_model)
 
+class Detection(NamedTuple):
+    class_id: int
+    confidence: float
+    box: Tuple[int, int, int, int]  # startX, startY, endX, endY
 
-def object_detection(frame) -> Tuple[bool, Any]:
-    if frame is None:
-        return
+
+net = None
+# Несколько камер одного процесса (движок опроса HTTP) используют одну локальную модель
+net_lock = threading.Lock()
+# Клиент общего сервиса инференса; если задан, локальная модель не загружается
+inference_client = None
+
+
+def load_net():
+    print("[INFO] loading model...")
+    return cv2.dnn.readNetFromCaffe(proto_txt, ai_model)
+
+
+def set_inference_client(client):
+    global inference_client
+    inference_client = client
+
+
+def _forward(blob, client=None):
+    global net
+    client = client or inference_client
+    if client is not None:
+        detections = client.infer(blob)
+        if detections is None:
+            return np.zeros((1, 1, 0, 7), dtype=np.float32)
+        return detections
+    with net_lock:
+        if net is None:
+            net = load_net()
+        net.setInput(blob)
+        return net.forward()
+
+
+def detect_objects(frame, client=None) -> List[Detection]:
+    """
+    Детекции объектов на кадре (координаты рамок - в пикселях кадра)
+
+    Args:
+        client: клиент сервиса инференса камеры; по умолчанию - заданный set_inference_client
+    """
     fshape = frame.shape
     frame_height = fshape[0]
     frame_width = fshape[1]
-    found_objects = False
+    found = []
 
     # noinspection PyTypeChecker
     blob = cv2.dnn.blobFromImage(
@@ -32,8 +72,7 @@ def object_detection(frame) -> Tuple[bool, Any]:
         127.5
     )
 
-    net.setInput(blob)
-    detections = net.forward()
+    detections = _forward(blob, client)
 
     for i in np.arange(0, detections.shape[2]):
         # extract the confidence (i.e., probability) associated with
@@ -50,15 +89,68 @@ def object_detection(frame) -> Tuple[bool, Any]:
             if CLASSES[idx] in IGNORE_CLASSES:
                 continue
             box = detections[0, 0, i, 3:7] * np.array([frame_width, frame_height, frame_width, frame_height])
-            (startX, startY, endX, endY) = box.astype("int")
-
-            # draw the prediction on the frame
-            label = "{}: {:.2f}%".format(CLASSES[idx],
-                                         confidence * 100)
-            cv2.rectangle(frame, (startX, startY), (endX, endY),
-                          COLORS[idx], 2)
-            y = startY - 15 if startY - 15 > 15 else startY + 15
-            cv2.putText(frame, label, (startX, y),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, COLORS[idx], 2)
-            found_objects = True
-    return found_objects, frame
+            found.append(Detection(idx, float(confidence), tuple(int(v) for v in box)))
+    return found
+
+
+def draw_detections(frame, detections: List[Detection]):
+    for detection in detections:
+        idx = detection.class_id
+        (startX, startY, endX, endY) = detection.box
+
+        # draw the prediction on the frame
+        label = "{}: {:.2f}%".format(CLASSES[idx],
+                                     detection.confidence * 100)
+        cv2.rectangle(frame, (startX, startY), (endX, endY),
+                      COLORS[idx], 2)
+        y = startY - 15 if startY - 15 > 15 else startY + 15
+        cv2.putText(frame, label, (startX, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, COLORS[idx], 2)
+
+
+def object_detection(frame) -> Tuple[bool, Any]:
+    if frame is None:
+        return
+    detections = detect_objects(frame)
+    draw_detections(frame, detections)
+    return bool(detections), frame
+
+
+def detect_objects_regions(frame, regions, source_frame=None, client=None) -> List[Detection]:
+    """
+    Детекция только в областях кадра (например, вокруг зон движения)
+
+    Args:
+        frame: кадр, в координатах которого возвращаются рамки
+        regions: области (x1, y1, x2, y2) в координатах frame
+        source_frame: кадр большего разрешения, из которого вырезаются области;
+            по умолчанию сам frame
+        client: клиент сервиса инференса камеры
+    """
+    source = frame if source_frame is None else source_frame
+    scale_x = source.shape[1] / frame.shape[1]
+    scale_y = source.shape[0] / frame.shape[0]
+    detections = []
+    for x1, y1, x2, y2 in regions:
+        crop = source[int(y1 * scale_y):int(y2 * scale_y), int(x1 * scale_x):int(x2 * scale_x)]
+        if crop.size == 0:
+            continue
+        for detection in detect_objects(crop, client):
+            # Переводим рамку из координат вырезки в координаты кадра
+            bx1, by1, bx2, by2 = detection.box
+            box = (
+                int(x1 + bx1 / scale_x),
+                int(y1 + by1 / scale_y),
+                int(x1 + bx2 / scale_x),
+                int(y1 + by2 / scale_y),
+            )
+            detections.append(detection._replace(box=box))
+    return detections
+
+
+def object_detection_regions(frame, regions, source_frame=None) -> Tuple[bool, Any]:
+    if frame is None:
+        return
+    detections = detect_objects_regions(frame, regions, source_frame)
+    draw_detections(frame, detections)
+    return bool(detections), frame
@@ -0,0 +1,116 @@
+"""
+Основной (высокого разрешения) поток камеры для записи.
+
+Анализ идёт по дешёвому дополнительному потоку, а основной поток
+открывается только на время записи (и пока его кадры нужны живому
+просмотру). Кадры основного потока пишутся в файл из этого потока
+начиная с момента срабатывания, так что запись совпадает по времени
+с анализом.
+"""
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+import cv2
+
+
+class RecordStream(threading.Thread):
+    def __init__(
+            self,
+            camera_key: str,
+            source: str,
+            annotate: Optional[Callable] = None,
+            idle_timeout: float = 10,
+    ):
+        """
+        Args:
+            annotate: рисует на кадре результаты анализа перед записью
+            idle_timeout: поток закрывается, если он не нужен дольше idle_timeout секунд
+        """
+        super().__init__(name=f'Record_{camera_key}', daemon=True)
+        self.camera_key = camera_key
+        self.source = source
+        self.annotate = annotate
+        self.idle_timeout = idle_timeout
+
+        self.lock = threading.Lock()
+        self.writer = None
+        self.since = 0.0
+        self.last_used = time.monotonic()
+        self.latest_frame: Optional[Tuple[float, object, bool]] = None  # (время, кадр, рамки нарисованы)
+        self.frame_size = None  # (ширина, высота) основного потока
+        self.fps = None
+        self.delivering = False  # кадры идут в подключённую запись
+        self._stopped = threading.Event()
+
+        self.frames_read = 0
+        self.frames_written = 0
+
+    def attach(self, writer, since: float):
+        """ Писать кадры основного потока начиная с времени since (time.time()) """
+        with self.lock:
+            self.writer = writer
+            self.since = since
+            self.delivering = False
+        self.keep_alive()
+
+    def detach(self):
+        with self.lock:
+            self.writer = None
+            self.delivering = False
+        self.keep_alive()
+
+    def keep_alive(self):
+        self.last_used = time.monotonic()
+
+    def latest(self) -> Optional[Tuple[float, object, bool]]:
+        self.keep_alive()
+        return self.latest_frame
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            print(f'Камера {self.camera_key}: не удаётся открыть основной поток для записи')
+            return
+        self.frame_size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or None
+        print(f'Камера {self.camera_key}: основной поток открыт, {self.frame_size[0]}x{self.frame_size[1]}')
+        try:
+            while not self._stopped.is_set():
+                ret, frame = capture.read()
+                if not ret:
+                    print(f'Камера {self.camera_key}: потеряно соединение с основным потоком')
+                    break
+                timestamp = time.time()
+                self.frames_read += 1
+                with self.lock:
+                    writer = self.writer if timestamp >= self.since else None
+                    if writer is not None:
+                        self.delivering = True
+                annotated = False
+                if writer is not None:
+                    if self.annotate is not None:
+                        frame = self.annotate(frame)
+                        annotated = True
+                    writer.write_frame(frame)
+                    self.frames_written += 1
+                self.latest_frame = (timestamp, frame, annotated)
+                if writer is None and time.monotonic() - self.last_used > self.idle_timeout:
+                    break  # запись закончилась и кадры никому не нужны
+        finally:
+            self.delivering = False
+            capture.release()
+            print(f'Камера {self.camera_key}: основной поток закрыт')
+
+    def stats(self) -> dict:
+        return {
+            'open': self.is_alive(),
+            'frame_size': self.frame_size,
+            'fps': self.fps,
+            'delivering': self.delivering,
+            'frames_read': self.frames_read,
+            'frames_written': self.frames_written,
+        }
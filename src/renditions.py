@@ -0,0 +1,61 @@
+"""
+Варианты (renditions) живого потока камеры.
+
+Каждый вариант - отдельный ключ в шине кадров: standard публикуется под
+ключом камеры (как раньше), остальные - под ключом камера@вариант.
+"""
+from typing import Dict, Iterable, NamedTuple
+
+import settings
+
+STANDARD = 'standard'
+SEPARATOR = '@'
+# Минимальный буфер варианта фиксированного размера в шине кадров
+MIN_SLOT_SIZE = 64 * 1024
+
+
+class Rendition(NamedTuple):
+    name: str
+    width: int  # 0 - исходное разрешение
+    height: int
+    quality: int
+
+
+def load_renditions() -> Dict[str, Rendition]:
+    """ Варианты из настройки RENDITIONS; standard есть всегда """
+    renditions = {
+        name: Rendition(name, int(width), int(height), int(quality))
+        for name, (width, height, quality) in settings.renditions.items()
+    }
+    renditions.setdefault(STANDARD, Rendition(STANDARD, 640, 360, 85))
+    return renditions
+
+
+def rendition_key(camera_key: str, name: str = STANDARD) -> str:
+    """ Ключ варианта в шине кадров """
+    return camera_key if name == STANDARD else f'{camera_key}{SEPARATOR}{name}'
+
+
+def resolve_rendition(name: str, renditions: Dict[str, Rendition]) -> str:
+    """ Запрошенный вариант, если он настроен, иначе standard (страница всегда просит grid) """
+    return name if name in renditions else STANDARD
+
+
+def slot_sizes(camera_keys: Iterable[str]) -> Dict[str, int]:
+    """
+    Размеры буферов шины кадров для всех вариантов всех камер.
+
+    Варианту фиксированного размера хватает меньшего буфера (JPEG редко
+    больше несжатого кадра в оттенках серого), исходному разрешению -
+    FRAME_BUS_SLOT_SIZE_KB.
+    """
+    full_size = settings.frame_bus_slot_size_kb * 1024
+    sizes = {}
+    for camera_key in camera_keys:
+        for rendition in load_renditions().values():
+            if rendition.width and rendition.height:
+                size = min(full_size, max(MIN_SLOT_SIZE, rendition.width * rendition.height))
+            else:
+                size = full_size
+            sizes[rendition_key(camera_key, rendition.name)] = size
+    return sizes
@@ -0,0 +1,133 @@
+"""
+Фоновый сбор загрузки процессов и контейнера для /resources.
+
+Замер идёт в отдельном потоке веб-процесса с постоянным интервалом, и
+запрос получает готовый результат сразу. Загрузка процессора берётся
+неблокирующим cpu_percent(None) - по разнице с прошлым замером того же
+объекта psutil.Process, поэтому объекты процессов кэшируются по pid.
+Клиент Docker создаётся один раз; если Docker недоступен, ошибка печатается
+один раз, а повторные попытки идут всё реже. Последние замеры хранятся в кольцевом
+буфере, из него отдаётся история за запрошенное окно.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import docker
+import psutil
+
+import settings
+from services import calculate_cpu_percent, is_running_in_docker
+
+# Наибольший интервал между попытками получить статистику недоступного Docker, секунд
+DOCKER_RETRY_MAX = 300
+
+
+class ResourceSampler(threading.Thread):
+    def __init__(self, processes: list, interval: float = None, history_seconds: float = None):
+        """
+        Args:
+            processes: общий с main.py список процессов; читается при каждом замере
+            interval: период замеров, секунд
+            history_seconds: сколько секунд истории хранить
+        """
+        super().__init__(name='Resource_Sampler', daemon=True)
+        self.processes = processes
+        self.interval = interval or settings.resource_sample_interval
+        history_seconds = history_seconds or settings.resource_history_seconds
+        self.samples = deque(maxlen=max(1, int(history_seconds / self.interval)) + 1)
+        self.in_docker = is_running_in_docker()
+        self.container = None
+        self.docker_failures = 0  # неудачные попытки подряд
+        self.docker_retry_at = 0.0
+        self._process_cache: Dict[int, psutil.Process] = {}
+        self._stopped = threading.Event()
+
+    def _get_process(self, pid: int) -> psutil.Process:
+        process = self._process_cache.get(pid)
+        if process is None:
+            process = psutil.Process(pid)
+            process.cpu_percent(None)  # первый вызов только запоминает точку отсчёта
+            self._process_cache[pid] = process
+        return process
+
+    def _sample_processes(self) -> List[dict]:
+        usage = []
+        alive = set()
+        for p in list(self.processes):
+            if not p.is_alive():
+                continue
+            try:
+                process = self._get_process(p.pid)
+                usage.append({
+                    'pid': p.pid,
+                    'name': p.name,
+                    'memory_use': process.memory_info()[0] / 2. ** 30,  # память в Гб
+                    'cpu_use': process.cpu_percent(None),  # процент с прошлого замера
+                    'cpu_affinity': process.cpu_affinity(),
+                })
+                alive.add(p.pid)
+            except psutil.NoSuchProcess:
+                continue
+        # Перезапущенные процессы получают новые pid - старые объекты не нужны
+        for pid in set(self._process_cache) - alive:
+            del self._process_cache[pid]
+        return usage
+
+    def _sample_container(self) -> dict:
+        if self.container is None:
+            self.container = docker.from_env().containers.get(os.getenv('HOSTNAME'))
+        stats = self.container.stats(stream=False)
+        return {
+            'total_memory_use': float(stats['memory_stats']['usage'] / (1024 ** 3)),
+            'total_cpu_use': calculate_cpu_percent(stats),
+            'net_use': stats['networks'],
+        }
+
+    def sample(self) -> dict:
+        processes = self._sample_processes()
+        sample = {
+            'time': time.time(),
+            'total_memory_use': sum(process['memory_use'] for process in processes),
+            'total_cpu_use': sum(process['cpu_use'] for process in processes) / os.cpu_count(),
+            'processes': processes,
+        }
+        if self.in_docker and time.monotonic() >= self.docker_retry_at:
+            try:
+                sample.update(self._sample_container())
+                self.docker_failures = 0
+            except Exception as e:
+                if self.docker_failures == 0:
+                    print(f'Ошибка получения статистики контейнера: {e!r}; '
+                          f'повторные попытки всё реже, не чаще раза в {DOCKER_RETRY_MAX} секунд')
+                self.docker_failures += 1
+                self.docker_retry_at = time.monotonic() + min(DOCKER_RETRY_MAX, self.interval * 2 ** self.docker_failures)
+                self.container = None  # клиент пересоздаётся при следующей попытке
+        return sample
+
+    def run(self):
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.samples.append(self.sample())
+            except Exception as e:
+                print(f'Ошибка замера ресурсов: {e!r}')
+            self._stopped.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def stop(self):
+        self._stopped.set()
+
+    def latest(self) -> Optional[dict]:
+        """ Последний замер; None - если замеров ещё не было """
+        return self.samples[-1] if self.samples else None
+
+    def history(self, window: float) -> List[dict]:
+        """ Итоговые значения замеров за последние window секунд (для графиков) """
+        since = time.time() - window
+        return [
+            {key: sample[key] for key in ('time', 'total_memory_use', 'total_cpu_use')}
+            for sample in list(self.samples)
+            if sample['time'] >= since
+        ]
@@ -0,0 +1,249 @@
+"""
+Распределение камер по фиксированному числу процессов-обработчиков.
+
+Вместо процесса на камеру запускается K процессов; в каждом камеры работают
+потоками. Процесс привязан к своей группе ядер (sched_setaffinity), а число
+потоков OpenCV ограничено (cv2.setNumThreads), поэтому процессы не
+конкурируют за все ядра сразу. Камеры раскладываются по процессам по
+измеренной нагрузке (жадно, от самой тяжёлой камеры к лёгким), упавший
+процесс перезапускается.
+"""
+import os
+import threading
+import time
+import traceback
+from multiprocessing import Event, Process
+from typing import Dict, List
+
+import settings
+
+# Нагрузка камеры, пока она ещё не измерена (доля одного ядра)
+DEFAULT_LOAD = 0.5
+# Перераспределение выполняется, если самый загруженный процесс станет легче хотя бы на эту долю
+REBALANCE_GAIN = 0.25
+
+
+class _WorkerRunning:
+    """ Флаг работы камеры в процессе: общий флаг приложения и флаг остановки процесса """
+
+    def __init__(self, running, stopped):
+        self.running = running
+        self.stopped = stopped
+
+    @property
+    def value(self):
+        return self.running.value and not self.stopped.is_set()
+
+
+def _run_camera(handler):
+    """
+    Поток камеры; при исключении камера перезапускается, остальные камеры процесса не затрагиваются.
+    Захват и потоки записи прошлого запуска run() обработчика освобождает сам (VideoHandler.close)
+    """
+    while handler.running.value:
+        try:
+            handler.run()
+        except Exception:
+            print(f'Камера {handler.camera_key}: ошибка обработки, перезапуск через 5 секунд')
+            traceback.print_exc()
+            time.sleep(5)
+
+
+def run_worker(worker_id: int, handlers: list, cpus: List[int], cv_threads: int, running, stopped):
+    """ Точка входа процесса-обработчика """
+    import cv2
+
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    cv2.setNumThreads(cv_threads)
+    print(f'Обработчик {worker_id}: камеры {[handler.camera_key for handler in handlers]}, '
+          f'ядра {cpus}, потоков OpenCV {cv_threads}')
+
+    threads = []
+    for handler in handlers:
+        handler.running = _WorkerRunning(running, stopped)
+        thread = threading.Thread(target=_run_camera, args=(handler,), name=f'Camera_{handler.camera_key}')
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+def place_cameras(loads: Dict[str, float], workers: int) -> List[List[str]]:
+    """ Жадное распределение (LPT): очередная по убыванию нагрузки камера - в наименее загруженный процесс """
+    placement = [[] for _ in range(workers)]
+    totals = [0.0] * workers
+    for camera_key in sorted(loads, key=loads.get, reverse=True):
+        worker = totals.index(min(totals))
+        placement[worker].append(camera_key)
+        totals[worker] += loads[camera_key]
+    return placement
+
+
+def split_cpus(workers: int) -> List[List[int]]:
+    """ Группы ядер процессов-обработчиков: доступные ядра делятся на непрерывные группы """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    groups = []
+    start = 0
+    for i in range(workers):
+        size = len(cpus) // workers + (1 if i < len(cpus) % workers else 0)
+        groups.append(cpus[start:start + size])
+        start += size
+    return groups
+
+
+class WorkerSupervisor:
+    """
+    Запуск процессов-обработчиков, перезапуск упавших и перераспределение камер.
+
+    processes - общий с main.py список процессов (для /resources): процессы
+    обработчиков добавляются в него и заменяются в нём при перезапуске.
+    """
+
+    def __init__(
+            self,
+            handlers: dict,
+            running,
+            processes: list,
+            camera_stats: dict = None,
+            workers: int = None,
+            cv_threads: int = None,
+            rebalance_interval: float = None,
+    ):
+        self.handlers = handlers
+        self.running = running
+        self.processes = processes
+        self.camera_stats = camera_stats
+        self.workers = min(workers or settings.worker_processes, len(handlers)) or 1
+        self.cv_threads = cv_threads if cv_threads is not None else settings.worker_cv_threads
+        if rebalance_interval is None:
+            rebalance_interval = settings.worker_rebalance_interval
+        self.rebalance_interval = rebalance_interval
+        self.cpu_groups = split_cpus(self.workers) if settings.worker_pin_cpus else [[] for _ in range(self.workers)]
+
+        self.placement: List[List[str]] = place_cameras(self.camera_loads(), self.workers)
+        self.worker_processes: List[Process] = [None] * self.workers
+        self.stop_events = [None] * self.workers
+        self.restarts = [0] * self.workers
+        self.last_rebalance = time.monotonic()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def camera_loads(self) -> Dict[str, float]:
+        """ Измеренная нагрузка камер (доля ядра), из статистики камер """
+        stats = dict(self.camera_stats) if self.camera_stats is not None else {}
+        return {
+            camera_key: max(stats.get(camera_key, {}).get('load', DEFAULT_LOAD), 0.01)
+            for camera_key in self.handlers
+        }
+
+    def _threads_for(self, worker: int) -> int:
+        if self.cv_threads > 0:
+            return self.cv_threads
+        return max(1, len(self.cpu_groups[worker]))
+
+    def _start_worker(self, worker: int):
+        stopped = Event()
+        process = Process(
+            target=run_worker,
+            args=(
+                worker,
+                [self.handlers[camera_key] for camera_key in self.placement[worker]],
+                self.cpu_groups[worker],
+                self._threads_for(worker),
+                self.running,
+                stopped,
+            ),
+            name=f'Worker_{worker}',
+        )
+        process.start()
+        print(f'Started process {process.name}: {self.placement[worker]}')
+        previous = self.worker_processes[worker]
+        if previous in self.processes:
+            self.processes[self.processes.index(previous)] = process
+        else:
+            self.processes.append(process)
+        self.worker_processes[worker] = process
+        self.stop_events[worker] = stopped
+
+    def _stop_worker(self, worker: int):
+        """ Камеры процесса завершаются штатно: дописывают записи и закрывают файлы """
+        self.stop_events[worker].set()
+        self.worker_processes[worker].join(timeout=30)
+        if self.worker_processes[worker].is_alive():
+            self.worker_processes[worker].terminate()
+
+    def start(self):
+        for worker in range(self.workers):
+            if self.placement[worker]:
+                self._start_worker(worker)
+        self.thread = threading.Thread(target=self._supervise, name='Worker_Supervisor', daemon=True)
+        self.thread.start()
+
+    def _supervise(self):
+        backoff = [0.0] * self.workers
+        while self.running.value:
+            time.sleep(1)
+            with self.lock:
+                for worker, process in enumerate(self.worker_processes):
+                    if process is None or process.is_alive() or not self.running.value:
+                        continue
+                    if time.monotonic() < backoff[worker]:
+                        continue
+                    self.restarts[worker] += 1
+                    print(f'Процесс {process.name} завершился с кодом {process.exitcode}, перезапуск')
+                    # Повторные падения перезапускаются всё реже, не чаще раза в минуту
+                    backoff[worker] = time.monotonic() + min(60, 2 ** self.restarts[worker])
+                    self._start_worker(worker)
+            if self.rebalance_interval and time.monotonic() - self.last_rebalance > self.rebalance_interval:
+                self.last_rebalance = time.monotonic()
+                self.rebalance()
+
+    def rebalance(self):
+        """ Перераспределение камер по измеренной нагрузке; перезапускаются только изменившиеся процессы """
+        loads = self.camera_loads()
+        current = max(sum(loads[key] for key in cameras) for cameras in self.placement)
+        placement = place_cameras(loads, self.workers)
+        proposed = max(sum(loads[key] for key in cameras) for cameras in placement)
+        if proposed > current * (1 - REBALANCE_GAIN):
+            return
+        print(f'Перераспределение камер: нагрузка самого загруженного процесса {current:.2f} -> {proposed:.2f}')
+        with self.lock:
+            # Номера процессов сопоставляем так, чтобы перезапустить как можно меньше
+            remaining = list(placement)
+            ordered = []
+            for cameras in self.placement:
+                best = max(remaining, key=lambda candidate: len(set(candidate) & set(cameras)))
+                remaining.remove(best)
+                ordered.append(best)
+            for worker, cameras in enumerate(ordered):
+                if set(cameras) == set(self.placement[worker]):
+                    continue
+                if self.worker_processes[worker] is not None:
+                    self._stop_worker(worker)
+                self.placement[worker] = cameras
+                if cameras:
+                    self._start_worker(worker)
+
+    def describe(self) -> List[dict]:
+        """ Размещение камер и нагрузка процессов (для get_resource_usage(summary=False)) """
+        loads = self.camera_loads()
+        return [
+            {
+                'worker': worker,
+                'pid': process.pid if process is not None else None,
+                'alive': process is not None and process.is_alive(),
+                'cameras': list(self.placement[worker]),
+                'camera_loads': {key: loads[key] for key in self.placement[worker]},
+                'load': sum(loads[key] for key in self.placement[worker]),
+                'cpus': self.cpu_groups[worker],
+                'cv_threads': self._threads_for(worker),
+                'restarts': self.restarts[worker],
+            }
+            for worker, process in enumerate(self.worker_processes)
+        ]
@@ -2,8 +2,6 @@ import datetime
 import os
 import time
 
-import asyncio
-
 import docker
 import psutil
 import cv2
@@ -85,14 +83,14 @@ def cache_frames_old(camera_key: str, camera_source: str, last_frame: dict, runn
                     if object_detected:
                         if video_writer is None:  # Инициализировать записывающее устройство, если его нет
                             video_writer = AsyncVideoWriter(camera_key)
-                            asyncio.run(video_writer.write_frame(new_frame))
+                            video_writer.write_frame(new_frame)
 
-                        asyncio.run(video_writer.write_frame(new_frame))  # Запись кадра
+                        video_writer.write_frame(new_frame)  # Запись кадра
                         frames_recorded += 1
 
                 else:  # Если нет движения
                     if video_writer is not None:  # Если записывающее устройство инициализировано
-                        asyncio.run(video_writer.stop_recording())
+                        video_writer.stop_recording()
                         video_writer = None
                         frames_recorded = 0
                 # Конец записи в файл
@@ -106,41 +104,92 @@ def cache_frames_old(camera_key: str, camera_source: str, last_frame: dict, runn
         cap.release()
 
 
+def parse_time(value):
+    """ Время из параметра запроса: unix-время или ISO 8601 """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
 def is_running_in_docker():
     return os.path.isfile('/.dockerenv')
 
 
-def get_resource_usage(processes, summary=True):
-    total_memory_use = 0
-    total_cpu_use = 0
-    detail_usage = []
-    py = None
-    for p in processes:
-        if p.is_alive():
-            py = psutil.Process(p.pid)
-            cpu_affinity = py.cpu_affinity()
-            memory_use = py.memory_info()[0] / 2. ** 30  # память в Гб
-            cpu_use = py.cpu_percent(interval=1)  # процент использования процессора
-            total_memory_use += memory_use
-            total_cpu_use += cpu_use / os.cpu_count()
-            detail_usage.append({
-                'pid': p.pid,
-                'name': p.name,
-                'memory_use': memory_use,
-                'cpu_use': cpu_use,
-                'cpu_affinity': cpu_affinity,
-            })
-    # print(detail_usage)
-    # print('py:', py)
+def get_resource_usage(processes, summary=True, placement=None, sample=None):
+    """
+    Args:
+        placement: размещение камер по процессам-обработчикам (WorkerSupervisor.describe());
+            добавляется к подробной статистике процессов по pid
+        sample: последний замер ResourceSampler; без него процессы замеряются здесь,
+            по секунде на процесс
+    """
+    workers = {worker['pid']: worker for worker in placement or [] if worker['pid'] is not None}
+    if sample is not None:
+        detail_usage = [dict(process) for process in sample['processes']]
+    else:
+        detail_usage = []
+        for p in processes:
+            if p.is_alive():
+                py = psutil.Process(p.pid)
+                detail_usage.append({
+                    'pid': p.pid,
+                    'name': p.name,
+                    'memory_use': py.memory_info()[0] / 2. ** 30,  # память в Гб
+                    'cpu_use': py.cpu_percent(interval=1),  # процент использования процессора
+                    'cpu_affinity': py.cpu_affinity(),
+                })
+    for detail in detail_usage:
+        if detail['pid'] in workers:
+            detail['worker'] = workers[detail['pid']]
     if not summary:
         return detail_usage
 
     return {
-        "total_memory_use": total_memory_use,
-        "total_cpu_use": total_cpu_use,
+        "total_memory_use": sum(detail['memory_use'] for detail in detail_usage),
+        "total_cpu_use": sum(detail['cpu_use'] for detail in detail_usage) / os.cpu_count(),
+    }
+
+
+def get_pre_event_buffer_usage(camera_stats: dict) -> dict:
+    """ Память буферов кадров до срабатывания по камерам """
+    cameras = {
+        camera_key: stats['pre_event_buffer']
+        for camera_key, stats in camera_stats.items()
+        if 'pre_event_buffer' in stats
+    }
+    return {
+        'cameras': cameras,
+        'total_memory_bytes': sum(buffer['memory_bytes'] for buffer in cameras.values()),
     }
 
 
+def collect_resources(processes, camera_stats: dict, sampler=None, window: float = None) -> dict:
+    """
+    Ответ /resources
+
+    Args:
+        sampler: ResourceSampler - ответ берётся из его последнего замера без ожидания
+        window: добавить историю замеров за столько секунд
+    """
+    if sampler is not None:
+        sample = sampler.latest()
+        if sample is None:
+            resource_usage = {"total_memory_use": 0.0, "total_cpu_use": 0.0}  # первый замер ещё не готов
+        else:
+            resource_usage = {key: value for key, value in sample.items() if key != 'processes'}
+        if window:
+            resource_usage['history'] = sampler.history(window)
+    elif is_running_in_docker():
+        resource_usage = get_container_resource_usage()
+    else:
+        resource_usage = get_resource_usage(processes)
+    resource_usage['pre_event_buffer'] = get_pre_event_buffer_usage(dict(camera_stats))
+    return resource_usage
+
+
 def calculate_cpu_percent(stats):
     cpu_percent = 0.0
     cpu_delta = float(stats['cpu_stats']['cpu_usage']['total_usage']) - float(stats['precpu_stats']['cpu_usage']['total_usage'])
@@ -13,9 +13,20 @@ print(f'JSON: {cameras_json}')
 additional_json = env('ADDITIONAL_CAMERAS', "")
 print(f'ADDITIONAL: {additional_json}')
 
-# Камеры, подключенные к этой машине:
+# Камеры, подключенные к этой машине.
+# Значение - URL камеры (или путь к видеофайлу - он воспроизводится по кругу, как камера) или словарь {"url": ..., "quota_gb": ..., "max_age_days": ...};
+# для HTTP-камер в словаре можно задать "interval" и "timeout" (секунды).
+# Камера с двумя потоками: "analysis" - дешёвый дополнительный поток для движения и детекции
+# (вместо "url"), "record" - основной поток для записи, "live" - поток для просмотра
+# (если совпадает с "record", варианты просмотра больше стандартного берутся из основного потока)
 with open(str(BASE_DIR / cameras_json)) as f:
-    cameras = json.load(f)
+    camera_configs = {
+        key: value if isinstance(value, dict) else {'url': value}
+        for key, value in json.load(f).items()
+    }
+for camera_config in camera_configs.values():
+    camera_config['url'] = camera_config.get('analysis') or camera_config['url']
+cameras = {key: config['url'] for key, config in camera_configs.items()}
 print(f'Configured {len(cameras)} cameras')
 
 if additional_json != "" and os.path.exists(additional_json):
@@ -26,6 +37,11 @@ else:
 
 save_path = env('SAVE_PATH')
 max_archive_size_gb = env.int('MAX_ARCHIVE_SIZE_GB', 10)
+# Очистка архива идёт до этого размера (по умолчанию 90% от MAX_ARCHIVE_SIZE_GB)
+archive_low_watermark_gb = env.float('ARCHIVE_LOW_WATERMARK_GB', None)
+# Индекс архива (SQLite); пустое значение - считать размер обходом папки
+archive_index_path = env('ARCHIVE_INDEX_PATH', os.path.join(save_path, '.index', 'archive.sqlite'))
+archive_reconcile_interval = env.int('ARCHIVE_RECONCILE_INTERVAL', 3600)
 ai_model = str(BASE_DIR / env('AI_MODEL'))
 proto_txt = str(BASE_DIR / env('PROTO_TXT'))
 min_confidence = env.float('CONFIDENCE')
@@ -35,3 +51,95 @@ display_frame_change_zones = env.bool('DISPLAY_FRAME_CHANGE_ZONES', False)
 min_detection_aria = env.int('MIN_DETECTION_AREA', 500)
 number_of_skip_frames = env.int('NUMBER_OF_SKIP_FRAMES', 9)
 http_request_interval = env.int('HTTP_REQUEST_INTERVAL', 1)
+# Не обрабатывать кадр, совпавший с предыдущим (по отпечатку)
+skip_unchanged_frames = env.bool('SKIP_UNCHANGED_FRAMES', True)
+# Поток камеры считается зависшим, если кадр не меняется дольше, секунд
+stall_seconds = env.float('STALL_SECONDS', 10)
+# Таймаут запроса к HTTP-камере, секунд
+http_request_timeout = env.float('HTTP_REQUEST_TIMEOUT', 10)
+# Опрос HTTP-камер: process (процесс на камеру) или engine (все камеры в одном процессе, асинхронно)
+http_ingest_mode = env('HTTP_INGEST_MODE', 'process')
+# Потоки обработки кадров в режиме engine
+http_ingest_workers = env.int('HTTP_INGEST_WORKERS', 4)
+# Предел частоты обработки кадров MJPEG-камер (0 - без ограничения)
+http_mjpeg_max_fps = env.float('HTTP_MJPEG_MAX_FPS', 5)
+
+# Размер буфера под один закодированный кадр в разделяемой памяти
+frame_bus_slot_size_kb = env.int('FRAME_BUS_SLOT_SIZE_KB', 1024)
+# Сколько кадров может ждать медленный клиент, прежде чем старые начнут выбрасываться
+stream_queue_size = env.int('STREAM_QUEUE_SIZE', 2)
+# Варианты живого потока: имя -> [ширина, высота, качество JPEG]; [0, 0, q] - исходное разрешение.
+# Вариант standard публикуется под ключом камеры, остальные кодируются только при наличии зрителей
+renditions = json.loads(env(
+    'RENDITIONS', '{"grid": [320, 180, 70], "standard": [640, 360, 85], "full": [0, 0, 90]}'
+))
+# Не кодировать кадры для просмотра, пока у камеры нет зрителей (детекция и запись продолжаются)
+live_idle_skip = env.bool('LIVE_IDLE_SKIP', True)
+# Загрузка процессов для /resources замеряется в фоне раз в столько секунд
+resource_sample_interval = env.float('RESOURCE_SAMPLE_INTERVAL', 2)
+# История замеров (/resources?window=секунд) хранится за столько секунд
+resource_history_seconds = env.int('RESOURCE_HISTORY_SECONDS', 900)
+# Веб-сервер: flask (поток на каждого клиента) или async (aiohttp, корутины)
+server_mode = env('SERVER_MODE', 'flask')
+
+# Инференс: local (модель в каждом процессе камеры) или service (общий процесс с пакетной обработкой)
+inference_mode = env('INFERENCE_MODE', 'local')
+inference_max_batch = env.int('INFERENCE_MAX_BATCH', 8)
+inference_max_wait_ms = env.int('INFERENCE_MAX_WAIT_MS', 20)
+
+# Процессы-обработчики камер: 0 - отдельный процесс на камеру, K - камеры распределяются по K процессам
+worker_processes = env.int('WORKER_PROCESSES', 0)
+# Потоки OpenCV на процесс-обработчик (0 - по числу ядер его группы)
+worker_cv_threads = env.int('WORKER_CV_THREADS', 0)
+# Привязка процессов-обработчиков к своим группам ядер
+worker_pin_cpus = env.bool('WORKER_PIN_CPUS', True)
+# Перераспределение камер по измеренной нагрузке раз в N секунд (0 - только при старте)
+worker_rebalance_interval = env.int('WORKER_REBALANCE_INTERVAL', 0)
+
+# Чтение RTSP: legacy (read() в цикле обработки) или threaded (отдельный поток, декодируются только нужные кадры)
+capture_mode = env('CAPTURE_MODE', 'legacy')
+
+# Детекция объектов без движения: раз в N секунд (0 - на каждом кадре, -1 - никогда)
+detection_idle_interval = env.float('DETECTION_IDLE_INTERVAL', 0)
+# Детекция только в областях вокруг зон движения
+detection_roi = env.bool('DETECTION_ROI', False)
+detection_roi_padding = env.float('DETECTION_ROI_PADDING', 0.25)
+detection_roi_min_size = env.int('DETECTION_ROI_MIN_SIZE', 96)
+detection_roi_max_regions = env.int('DETECTION_ROI_MAX_REGIONS', 4)
+# Превью записей: число миниатюр (0 - не создавать), ширина миниатюры и постера
+thumbnail_count = env.int('THUMBNAIL_COUNT', 6)
+thumbnail_width = env.int('THUMBNAIL_WIDTH', 160)
+poster_width = env.int('POSTER_WIDTH', 320)
+# Хранилище детекций (SQLite); пустое значение - не сохранять
+detection_store_path = env('DETECTION_STORE_PATH', os.path.join(save_path, '.index', 'detections.sqlite'))
+detection_store_batch = env.int('DETECTION_STORE_BATCH', 256)
+detection_store_flush_interval = env.float('DETECTION_STORE_FLUSH_INTERVAL', 2.0)
+# Срок хранения детекций, дней (0 - без ограничения)
+detection_store_days = env.float('DETECTION_STORE_DAYS', 30)
+# Сохранять детекции кадров, которые не попали в запись (без файла)
+detection_store_unrecorded = env.bool('DETECTION_STORE_UNRECORDED', False)
+
+# Детектор движения: diff (разница кадров в полном разрешении), running_average или mog2 (модель фона)
+motion_engine = env('MOTION_ENGINE', 'diff')
+# Ширина уменьшенной копии кадра для модели фона
+motion_width = env.int('MOTION_WIDTH', 320)
+motion_learning_rate = env.float('MOTION_LEARNING_RATE', 0.05)
+
+# Буфер кадров до срабатывания: длительность в секундах (0 - выключен) и предел памяти на камеру
+pre_event_seconds = env.float('PRE_EVENT_SECONDS', 0)
+pre_event_max_mb = env.int('PRE_EVENT_MAX_MB', 32)
+
+# Очередь кадров потока записи и поведение при её переполнении: drop_oldest или block
+recording_queue_size = env.int('RECORDING_QUEUE_SIZE', 64)
+recording_overflow = env('RECORDING_OVERFLOW', 'drop_oldest')
+
+# Запись: reencode (кадры с разметкой, MJPG AVI) или passthrough (исходный поток RTSP сегментами без перекодирования)
+recording_mode = env('RECORDING_MODE', 'reencode')
+segment_seconds = env.float('SEGMENT_SECONDS', 60)
+segment_format = env('SEGMENT_FORMAT', 'mp4')
+# Сегмент сохраняется, если событие было не дальше стольких секунд от его границ
+segment_keep_margin = env.float('SEGMENT_KEEP_MARGIN', 10)
+# Основной поток камеры с отдельным потоком записи закрывается, если он не нужен столько секунд
+record_stream_idle_seconds = env.float('RECORD_STREAM_IDLE_SECONDS', 10)
+# Повторная попытка открыть недоступный основной поток - не чаще раза в столько секунд
+record_stream_retry_seconds = env.float('RECORD_STREAM_RETRY_SECONDS', 30)
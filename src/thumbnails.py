@@ -0,0 +1,110 @@
+"""
+Превью записей: кадр-постер и лист миниатюр рядом с файлом записи.
+
+Миниатюры собираются из кадров, которые и так проходят через поток записи,
+поэтому повторно декодировать видео не нужно. Для записи m_....avi
+создаются m_....poster.jpg и m_....sheet.jpg (миниатюры в один ряд).
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+POSTER_SUFFIX = '.poster.jpg'
+SHEET_SUFFIX = '.sheet.jpg'
+JPEG_QUALITY = 80
+
+
+PREVIEW_KINDS = ('poster', 'sheet')
+
+
+def sidecar_paths(clip_path) -> List[Path]:
+    """ Файлы превью записи: постер и лист миниатюр """
+    clip_path = Path(clip_path)
+    stem = clip_path.with_suffix('')
+    return [stem.with_name(stem.name + POSTER_SUFFIX), stem.with_name(stem.name + SHEET_SUFFIX)]
+
+
+def _downscale(frame, width: int):
+    height, frame_width = frame.shape[:2]
+    if frame_width <= width:
+        return frame.copy()
+    return cv2.resize(frame, (width, int(height * width / frame_width)), interpolation=cv2.INTER_AREA)
+
+
+class ThumbnailCollector:
+    """
+    Равномерная выборка миниатюр из потока кадров заранее неизвестной длины.
+
+    Сохраняется каждый stride-й кадр; когда сохранённых становится вдвое
+    больше нужного, остаётся каждый второй, а stride удваивается. В памяти
+    не больше 2 * count уменьшенных кадров.
+    """
+
+    def __init__(self, count: int = 6, width: int = 160, poster_width: int = 320):
+        self.count = count
+        self.width = width
+        self.poster_width = poster_width
+        self.stride = 1
+        self.index = 0
+        self.frames = []
+        self.poster = None
+
+    def add(self, frame, poster: bool = False):
+        if poster and self.poster is None:
+            self.poster = _downscale(frame, self.poster_width)
+        if self.index % self.stride == 0:
+            self.frames.append(_downscale(frame, self.width))
+            if len(self.frames) >= 2 * self.count:
+                self.frames = self.frames[::2]
+                self.stride *= 2
+        self.index += 1
+
+    def thumbnails(self) -> list:
+        if len(self.frames) <= self.count:
+            return self.frames
+        positions = np.linspace(0, len(self.frames) - 1, self.count).round().astype(int)
+        return [self.frames[i] for i in positions]
+
+    def save(self, clip_path) -> List[str]:
+        """ Запись постера и листа миниатюр; возвращает пути созданных файлов """
+        thumbnails = self.thumbnails()
+        if not thumbnails:
+            return []
+        poster = self.poster
+        if poster is None:
+            # Постер не отмечен - берём средний кадр
+            poster = _downscale(self.frames[len(self.frames) // 2], self.poster_width)
+        # Миниатюры одного размера, если разрешение менялось по ходу записи
+        height, width = thumbnails[0].shape[:2]
+        sheet = np.hstack([
+            thumbnail if thumbnail.shape[:2] == (height, width) else cv2.resize(thumbnail, (width, height))
+            for thumbnail in thumbnails
+        ])
+        saved = []
+        for path, image in zip(sidecar_paths(clip_path), (poster, sheet)):
+            if cv2.imwrite(str(path), image, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]):
+                saved.append(str(path))
+        return saved
+
+
+@lru_cache(maxsize=512)
+def read_sidecar(path: str, mtime: float) -> Optional[bytes]:
+    """ Содержимое файла превью; mtime входит в ключ кэша, чтобы заменённый файл перечитывался """
+    try:
+        return Path(path).read_bytes()
+    except OSError:
+        return None
+
+
+def read_preview(clip_path, kind: str) -> Optional[Tuple[bytes, float]]:
+    """ Превью записи (poster или sheet) и время его изменения; None, если превью нет """
+    path = sidecar_paths(clip_path)[PREVIEW_KINDS.index(kind)]
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    data = read_sidecar(str(path), mtime)
+    return (data, mtime) if data is not None else None
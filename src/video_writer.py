@@ -1,41 +1,225 @@
 import datetime
 import os
+import queue
+import threading
+import time
 
 import cv2
+
+import settings
 from settings import save_path
+from thumbnails import ThumbnailCollector
+
+# Признак конца записи в очереди кадров
+_STOP = object()
 
 
 class AsyncVideoWriter:
-    def __init__(self, camera_key, fourcc=cv2.VideoWriter_fourcc(*'MJPG')):
+    """
+    Запись видеофайла в фоновом потоке.
+
+    Кадры попадают в ограниченную очередь, поэтому медленный диск не
+    задерживает захват кадров. При переполнении очереди политика overflow
+    определяет поведение: drop_oldest - выбрасывается самый старый кадр,
+    block - вызывающий ждёт освобождения места.
+
+    Кадры могут ставить в очередь два потока (поток камеры и поток основного
+    потока записи), поэтому постановка кадра выполняется под блокировкой.
+    """
+    # Частота кадров в файле
+    fps = 20.0
+    # Шаг ожидания места в очереди, секунд: между шагами проверяется, жив ли поток записи
+    put_timeout = 1.0
+
+    def __init__(
+            self,
+            camera_key,
+            fourcc=cv2.VideoWriter_fourcc(*'MJPG'),
+            max_queue: int = None,
+            overflow: str = None,
+            on_closed=None,
+            metrics=None,
+            fps: float = None,
+            frame_size=None,
+    ):
+        """
+        Args:
+            on_closed: вызывается с именем файла после его закрытия (из потока записи)
+            metrics: PipelineMetrics камеры - длительность записи кадра и счётчики кадров
+            fps: частота кадров в файле (частота основного потока камеры)
+            frame_size: размер кадра в файле (ширина, высота); кадры другого размера
+                масштабируются. По умолчанию - размер первого кадра
+        """
         self.fourcc = fourcc
+        if fps:
+            self.fps = fps
+        self.frame_size = tuple(frame_size) if frame_size else None
+        self.on_closed = on_closed
+        self.metrics = metrics
         self.camera_key = camera_key
         self.filename = self.get_filename(camera_key)
         self.video_writer = None
         self.frames_recorded = 0
+        self.frames_queued = 0
+        self.overflow = overflow or settings.recording_overflow
+        self.queue = queue.Queue(maxsize=max_queue or settings.recording_queue_size)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.thumbnails = None
+        if settings.thumbnail_count > 0:
+            self.thumbnails = ThumbnailCollector(
+                settings.thumbnail_count, settings.thumbnail_width, settings.poster_width
+            )
+
+        self.frames_dropped = 0
+        self.max_queue_depth = 0
+        self.write_time_total = 0.0
+        self.write_time_max = 0.0
+
+    def write_frame(self, frame, block: bool = None, poster: bool = False):
+        """
+        Постановка кадра в очередь записи
+
+        Args:
+            poster: кадр для превью записи (первый отмеченный)
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f'Writer_{self.camera_key}', daemon=True)
+                self.thread.start()
+        if block is None:
+            block = self.overflow == 'block'
 
-    async def write_frame(self, frame):
-        if self.video_writer is None:
+        item = (frame, poster)
+        if block:
+            if not self._put_waiting(item):
+                with self.lock:
+                    self._count_dropped()  # поток записи завершился, кадр писать некому
+                return
+            with self.lock:
+                self._count_queued()
+            return
+        with self.lock:
+            # Место, освобождённое здесь, не может занять другой поток, пока блокировка у нас
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self._count_dropped()
+                    except queue.Empty:
+                        pass
+            self._count_queued()
+
+    def _count_queued(self):
+        self.frames_queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def _count_dropped(self):
+        self.frames_dropped += 1
+        if self.metrics is not None:
+            self.metrics.count('dropped')
+
+    def _put_waiting(self, item) -> bool:
+        """ Ожидание места в очереди, пока жив поток записи; False - поток записи завершился """
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def position_ms(self) -> int:
+        """ Смещение последнего поставленного в очередь кадра от начала файла """
+        return int(max(self.frames_queued - 1, 0) / self.fps * 1000)
+
+    def stop_recording(self, wait: bool = False):
+        """
+        Завершение записи: поток дописывает все кадры из очереди и закрывает файл.
+
+        Args:
+            wait: дождаться закрытия файла
+        """
+        if self.thread is None:
+            return
+        if not self._put_waiting(_STOP):
+            print(f'Поток записи файла {self.filename} завершился раньше времени')
+            return
+        if wait:
+            self.thread.join()
+
+    def _open(self, frame):
+        if self.frame_size is None:
             fshape = frame.shape
-            fheight = fshape[0]
-            fwidth = fshape[1]
-            print(f'Пишем файл {self.filename}')
-            self.video_writer = cv2.VideoWriter(self.filename, self.fourcc, 20.0, (fwidth, fheight))
+            self.frame_size = (fshape[1], fshape[0])
+        print(f'Пишем файл {self.filename}')
+        self.video_writer = cv2.VideoWriter(self.filename, self.fourcc, self.fps, self.frame_size)
 
-        self.video_writer.write(frame)  # Запись кадра
-        self.frames_recorded += 1
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            frame, poster = item
+            if self.video_writer is None:
+                self._open(frame)
+            if (frame.shape[1], frame.shape[0]) != self.frame_size:
+                # Кадры до события и до подключения основного потока - из потока анализа
+                frame = cv2.resize(frame, self.frame_size)
+            start = time.perf_counter()
+            self.video_writer.write(frame)  # Запись кадра
+            write_time = time.perf_counter() - start
+            self.write_time_total += write_time
+            self.write_time_max = max(self.write_time_max, write_time)
+            self.frames_recorded += 1
+            if self.metrics is not None:
+                self.metrics.stages['write'].observe(write_time)
+                self.metrics.count('recorded')
+            if self.thumbnails is not None:
+                self.thumbnails.add(frame, poster)  # уменьшенные копии для превью
 
-    async def stop_recording(self):
         if self.video_writer is not None:
             # If we're writing a file, close it
             self.video_writer.release()
             self.video_writer = None
-            self.frames_recorded = 0
             print(f'Закрываем файл {self.filename}')
+            if self.thumbnails is not None:
+                self.thumbnails.save(self.filename)
+                self.thumbnails = None
+            if self.on_closed is not None:
+                self.on_closed(self.filename)
+
+    def stats(self) -> dict:
+        return {
+            'filename': self.filename,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'frames_written': self.frames_recorded,
+            'frames_dropped': self.frames_dropped,
+            'write_ms_avg': self.write_time_total / self.frames_recorded * 1000 if self.frames_recorded else 0.0,
+            'write_ms_max': self.write_time_max * 1000,
+        }
 
     @staticmethod
-    def get_filename(camera_key: str):
+    def get_filename(camera_key: str, extension: str = 'avi', prefix: str = 'm', precise: bool = False):
+        """
+        Args:
+            precise: время в имени с миллисекундами и номер, если имя уже занято
+                (файлы могут открываться чаще раза в секунду)
+        """
         now = datetime.datetime.now()
         current_time = now.strftime('%Y-%m-%d_%H:%M:%S')
+        if precise:
+            current_time += f'.{now.microsecond // 1000:03d}'
         path = os.path.join(save_path, camera_key, now.strftime('%Y'), now.strftime('%m'), now.strftime('%d'))
         os.makedirs(path, exist_ok=True)
-        return os.path.join(path, f'm_{current_time}.avi')
+        filename = os.path.join(path, f'{prefix}_{current_time}.{extension}')
+        number = 1
+        while precise and os.path.exists(filename):
+            # Несколько файлов за миллисекунду (например, при записи из видеофайла)
+            filename = os.path.join(path, f'{prefix}_{current_time}_{number}.{extension}')
+            number += 1
+        return filename
@@ -0,0 +1,21 @@
+"""
+Модули приложения читают настройки из окружения при импорте, поэтому
+окружение для тестов задаётся до их импорта: пустой список камер и
+временный архив.
+"""
+import json
+import os
+import tempfile
+
+_config_dir = tempfile.mkdtemp(prefix='camera01-tests-')
+_cameras_path = os.path.join(_config_dir, 'cameras.json')
+with open(_cameras_path, 'w') as f:
+    json.dump({}, f)
+
+os.environ.update({
+    'CAMERAS': _cameras_path,
+    'SAVE_PATH': os.path.join(_config_dir, 'archive'),
+    'AI_MODEL': 'ai_model/MobileNetSSD_deploy.caffemodel',
+    'PROTO_TXT': 'ai_model/MobileNetSSD_deploy.prototxt.txt',
+    'CONFIDENCE': '0.5',
+})
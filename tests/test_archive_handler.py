@@ -0,0 +1,19 @@
+import os
+
+from handlers.archive_handler import ArchiveHandler
+
+
+def test_legacy_cleanup_skips_index_directory(tmp_path):
+    index = tmp_path / '.index' / 'archive.sqlite'
+    index.parent.mkdir()
+    index.write_bytes(b'x' * 1000)
+    os.utime(index, (1, 1))  # старше любой записи
+    recording = tmp_path / 'cam' / 'm_2024-01-01_00-00-00.avi'
+    recording.parent.mkdir()
+    recording.write_bytes(b'x' * 10)
+    handler = ArchiveHandler(str(tmp_path), max_size_gb=1)
+
+    assert handler.calculate_folder_size() * 1024 ** 3 == 10
+    assert handler.delete_oldest_files(count=1) == 1
+    assert index.exists()
+    assert not recording.exists()
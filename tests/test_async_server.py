@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import async_server
+import settings
+from aiohttp.test_utils import TestClient, TestServer
+
+from async_server import create_app
+from broadcaster import BroadcastHub
+from frame_bus import FrameBus
+
+
+@pytest.fixture
+def hub():
+    frame_bus = FrameBus.create(['cam'], 64 * 1024)
+    yield BroadcastHub(frame_bus)
+    frame_bus.close()
+
+
+def request(app, path: str):
+    """ Запрос к приложению на тестовом сервере; возвращает статус и тело """
+
+    async def fetch():
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get(path)
+            return response.status, await response.read()
+
+    return asyncio.run(fetch())
+
+
+def test_create_app_registers_routes(hub):
+    app = create_app(hub, [], {}, {'total_gb': 1.5})
+
+    assert {route.name for route in app.router.routes() if route.name} >= {
+        'index', 'video_feed', 'archive_stats', 'archive_clips', 'detections', 'streams',
+    }
+
+
+def test_archive_stats(hub):
+    status, body = request(create_app(hub, [], {}, {'total_gb': 1.5}), '/archive/stats')
+
+    assert status == 200
+    assert body == b'{"total_gb": 1.5}'
+
+
+def test_index_and_unknown_camera(hub):
+    assert request(create_app(hub, [], {}, {}), '/')[0] == 200
+    assert request(create_app(hub, [], {}, {}), '/video_feed/missing')[0] == 404
+
+
+def test_viewer_of_silent_camera_is_unsubscribed(hub, monkeypatch):
+    monkeypatch.setattr(settings, 'cameras', {'cam': 'rtsp://camera'})
+    monkeypatch.setattr(async_server, 'CLIENT_CHECK_INTERVAL', 0.1)
+    app = create_app(hub, [], {}, {})
+
+    async def watch_and_leave():
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get('/video_feed/cam')
+            assert response.status == 200
+            assert app['streams'].subscribers
+            response.close()  # зритель ушёл, а кадров с камеры нет
+            for _ in range(50):
+                if not app['streams'].subscribers:
+                    break
+                await asyncio.sleep(0.05)
+            return dict(app['streams'].subscribers)
+
+    assert asyncio.run(watch_and_leave()) == {}
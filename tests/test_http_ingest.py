@@ -0,0 +1,119 @@
+import asyncio
+import socket
+import threading
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+
+from handlers.http_ingest import HTTPIngestEngine, MJPEGParser
+
+# JPEG с миниатюрой EXIF: внутри кадра есть свои маркеры начала и конца
+THUMBNAIL = b'\xff\xd8' + b'thumbnail' + b'\xff\xd9'
+IMAGE = b'\xff\xd8\xff\xe1' + THUMBNAIL + b'image data' + b'\xff\xd9'
+
+
+def part(image: bytes, content_length: bool = True) -> bytes:
+    headers = b'--frame\r\nContent-Type: image/jpeg\r\n'
+    if content_length:
+        headers += b'Content-Length: %d\r\n' % len(image)
+    return headers + b'\r\n' + image + b'\r\n'
+
+
+def test_parser_reads_content_length_bytes():
+    parser = MJPEGParser()
+
+    assert parser.feed(part(IMAGE) * 3) == [IMAGE] * 3
+
+
+def test_parser_handles_chunks_split_anywhere():
+    parser = MJPEGParser()
+    frames = []
+    for byte in part(IMAGE) * 2:
+        frames += parser.feed(bytes([byte]))
+
+    assert frames == [IMAGE] * 2
+
+
+def test_parser_falls_back_to_markers_without_content_length():
+    image = b'\xff\xd8' + b'plain image' + b'\xff\xd9'
+    parser = MJPEGParser()
+
+    assert parser.feed(part(image, content_length=False) * 2) == [image] * 2
+
+
+@pytest.fixture
+def camera_server():
+    """ Заглушка камеры: снимок и MJPEG-поток; возвращает базовый URL """
+
+    async def snapshot(request):
+        return web.Response(body=IMAGE, content_type='image/jpeg')
+
+    async def mjpeg(request):
+        response = web.StreamResponse()
+        response.content_type = 'multipart/x-mixed-replace; boundary=frame'
+        await response.prepare(request)
+        while True:
+            await response.write(part(IMAGE))
+            await asyncio.sleep(0.02)
+
+    app = web.Application()
+    app.router.add_get('/snapshot.jpg', snapshot)
+    app.router.add_get('/mjpeg', mjpeg)
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.SockSite(runner, sock).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+class RecordingHandler:
+    """ Обработчик, который только запоминает полученные кадры """
+
+    def __init__(self, camera_key: str, camera_source: str, interval: float):
+        self.camera_key = camera_key
+        self.camera_source = camera_source
+        self.interval = interval
+        self.timeout = 5
+        self.ingest = None
+        self.images = []
+        self.stopped = False
+
+    def start_ingest(self):
+        pass
+
+    def process_image(self, content: bytes):
+        self.images.append(content)
+
+    def stop_ingest(self):
+        self.stopped = True
+
+
+def test_engine_reads_snapshots_and_mjpeg(camera_server):
+    snapshot = RecordingHandler('snapshot', f'{camera_server}/snapshot.jpg', 0.1)
+    mjpeg = RecordingHandler('mjpeg', f'{camera_server}/mjpeg', 1)
+    running = SimpleNamespace(value=True)
+    timer = threading.Timer(1.5, lambda: setattr(running, 'value', False))
+    timer.start()
+
+    HTTPIngestEngine([snapshot, mjpeg], running, workers=2).run()
+    timer.join()
+
+    for handler, mode in ((snapshot, 'snapshot'), (mjpeg, 'mjpeg')):
+        assert handler.stopped
+        assert handler.images
+        assert all(image == IMAGE for image in handler.images)
+        stats = handler.ingest.stats()
+        assert stats['mode'] == mode
+        assert stats['errors'] == 0
+        assert stats['received'] >= len(handler.images)
@@ -0,0 +1,89 @@
+import os
+import time
+from fractions import Fraction
+
+import av
+import numpy as np
+import pytest
+
+from passthrough_recorder import PassthroughRecorder
+
+FPS = 10
+SECONDS = 4
+GOP = 5  # ключевой кадр каждые 0.5 секунды
+
+
+@pytest.fixture
+def source_video(tmp_path):
+    """ Локальный файл вместо камеры: MPEG-4 с частыми ключевыми кадрами """
+    path = str(tmp_path / 'source.mp4')
+    with av.open(path, 'w') as container:
+        stream = container.add_stream('mpeg4', rate=FPS)
+        stream.width, stream.height = 160, 120
+        stream.pix_fmt = 'yuv420p'
+        stream.codec_context.gop_size = GOP
+        stream.codec_context.time_base = Fraction(1, FPS)
+        for i in range(FPS * SECONDS):
+            image = np.full((120, 160, 3), i * 5 % 256, dtype=np.uint8)
+            frame = av.VideoFrame.from_ndarray(image, format='rgb24')
+            frame.pts = i
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    return path
+
+
+def record(source: str, activity: float = None, **kwargs):
+    """ Запись файла до конца; возвращает рекордер, сохранённые и удалённые сегменты """
+    kept, removed = [], []
+    recorder = PassthroughRecorder(
+        'test',
+        source,
+        segment_seconds=1,
+        container_format='mp4',
+        on_segment_kept=kept.append,
+        on_segment_removed=removed.append,
+        reconnect_delay=0,
+        **kwargs,
+    )
+    if activity is not None:
+        recorder.mark_activity(activity)
+    recorder.start()
+    recorder.join(timeout=30)
+    assert not recorder.is_alive()
+    return recorder, kept, removed
+
+
+def frame_count(path: str) -> int:
+    with av.open(path) as container:
+        return sum(1 for _ in container.decode(video=0))
+
+
+def test_segments_with_activity_are_kept(source_video):
+    recorder, kept, removed = record(source_video, activity=time.time(), keep_margin=60)
+
+    assert removed == []
+    assert len(kept) == SECONDS
+    # Все сегменты открыты в пределах одной секунды, имена не должны совпасть
+    assert len(set(kept)) == len(kept)
+    assert all(os.path.exists(path) for path in kept)
+    assert sum(frame_count(path) for path in kept) == FPS * SECONDS
+    assert recorder.stats()['segments_kept'] == SECONDS
+
+
+def test_keep_all_keeps_segments_without_activity(source_video):
+    recorder, kept, removed = record(source_video, keep_margin=0, keep_all=True)
+
+    assert removed == []
+    assert len(kept) == SECONDS
+    assert all(os.path.exists(path) for path in kept)
+
+
+def test_segments_without_activity_are_removed(source_video):
+    recorder, kept, removed = record(source_video, keep_margin=0)
+
+    assert kept == []
+    assert len(removed) == SECONDS
+    assert not any(os.path.exists(path) for path in removed)
+    assert recorder.stats()['segments_deleted'] == SECONDS